@@ -0,0 +1,76 @@
+"""
+Helpers for distributed data-parallel training: one process per device,
+each training on its own shards, gradients summed with
+`torch.distributed`. See train.py for a use case.
+"""
+import torch
+import torch.distributed
+
+
+def is_master(opt):
+    return opt.dist_rank == 0
+
+
+def init_process_group(opt):
+    torch.distributed.init_process_group(
+        backend=opt.dist_backend, init_method=opt.dist_init_method,
+        world_size=opt.world_size, rank=opt.dist_rank)
+
+
+def broadcast_parameters(model):
+    """ Copy the parameters of the rank 0 model to all processes. """
+    for p in model.parameters():
+        torch.distributed.broadcast(p.data, 0)
+
+
+def all_reduce_sum(values, like):
+    """
+    Sum a list of numbers over all processes.
+
+    Args:
+        values (list): numbers of this process.
+        like (Tensor): the sum is computed in a tensor of this type.
+
+    Returns:
+        The list of the sums.
+    """
+    values = like.new(values)
+    torch.distributed.all_reduce(values)
+    return values.tolist()
+
+
+def all_reduce_gradients(params, buffer_size=10 * 1024 * 1024):
+    """
+    Sum the gradients of `params` over all processes. They are copied
+    into flat buffers of about `buffer_size` elements, so that one
+    all-reduce is done per buffer rather than per parameter.
+    """
+    grads = []
+    for p in params:
+        if not p.requires_grad:
+            continue
+        if p.grad is None:
+            # No batch on this process, or unused parameter.
+            p.grad = p.data.new(p.size()).zero_()
+        grads.append(p.grad.data)
+
+    def all_reduce_bucket(bucket):
+        if len(bucket) == 1:
+            torch.distributed.all_reduce(bucket[0])
+            return
+        flat = torch.cat([g.view(-1) for g in bucket])
+        torch.distributed.all_reduce(flat)
+        offset = 0
+        for g in bucket:
+            g.copy_(flat[offset:offset + g.numel()].view_as(g))
+            offset += g.numel()
+
+    bucket, size = [], 0
+    for g in grads:
+        if bucket and size + g.numel() > buffer_size:
+            all_reduce_bucket(bucket)
+            bucket, size = [], 0
+        bucket.append(g)
+        size += g.numel()
+    if bucket:
+        all_reduce_bucket(bucket)
@@ -0,0 +1,192 @@
+"""
+Ensemble decoding: several models with the same vocabularies are run
+side by side in a single search. Each encoder runs once, each decoder
+keeps its own state, and the word distributions are averaged.
+"""
+import time
+
+import torch
+import torch.nn as nn
+
+import onmt.ModelConstructor
+from onmt.Models import DecoderState, NMTModel
+
+
+class EnsembleTimer(object):
+    """
+    Wall time spent in each model of an ensemble, when `enabled`. On
+    gpu, each timed call waits for the device.
+    """
+
+    def __init__(self, n_models):
+        self.times = [0.] * n_models
+        self.enabled = False
+        self.cuda = False
+
+    def run(self, i, fn, *args, **kwargs):
+        """ Call `fn`, the part of model `i`. """
+        if not self.enabled:
+            return fn(*args, **kwargs)
+        if self.cuda:
+            torch.cuda.synchronize()
+        start = time.time()
+        out = fn(*args, **kwargs)
+        if self.cuda:
+            torch.cuda.synchronize()
+        self.times[i] += time.time() - start
+        return out
+
+
+class EnsembleDecoderState(DecoderState):
+    """ The decoder states of the models of an ensemble. """
+
+    def __init__(self, model_states):
+        self.model_states = tuple(model_states)
+
+    def detach(self):
+        for model_state in self.model_states:
+            model_state.detach()
+
+    def repeat_beam_size_times(self, beam_size):
+        for model_state in self.model_states:
+            model_state.repeat_beam_size_times(beam_size)
+
+    def index_select(self, positions):
+        for model_state in self.model_states:
+            model_state.index_select(positions)
+
+
+class EnsembleDecoderOutput(object):
+    """ The outputs of the decoders of an ensemble. """
+
+    def __init__(self, model_outputs):
+        self.model_outputs = tuple(model_outputs)
+
+    def squeeze(self, dim=None):
+        return EnsembleDecoderOutput(
+            x.squeeze(dim) if dim is not None else x.squeeze()
+            for x in self.model_outputs)
+
+    def __getitem__(self, index):
+        return EnsembleDecoderOutput(x[index] for x in self.model_outputs)
+
+    def __len__(self):
+        return len(self.model_outputs[0])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class EnsembleEncoder(nn.Module):
+    """
+    Runs the encoder of each model once. The memory bank is the tuple of
+    the memory banks of the models.
+    """
+
+    def __init__(self, model_encoders, timer):
+        super(EnsembleEncoder, self).__init__()
+        self.model_encoders = nn.ModuleList(model_encoders)
+        self.timer = timer
+
+    def forward(self, src, lengths=None):
+        enc_hidden, memory_bank = zip(*[
+            self.timer.run(i, model_encoder, src, lengths)
+            for i, model_encoder in enumerate(self.model_encoders)])
+        return enc_hidden, memory_bank
+
+
+class EnsembleDecoder(nn.Module):
+    """
+    Runs the decoder of each model on its own memory bank and state. The
+    attentions are averaged.
+    """
+
+    def __init__(self, model_decoders, timer):
+        super(EnsembleDecoder, self).__init__()
+        self.model_decoders = nn.ModuleList(model_decoders)
+        self.timer = timer
+
+    def forward(self, tgt, memory_bank, state, memory_lengths=None):
+        dec_outs, states, attns = zip(*[
+            self.timer.run(i, model_decoder, tgt, memory_bank[i],
+                           state.model_states[i],
+                           memory_lengths=memory_lengths)
+            for i, model_decoder in enumerate(self.model_decoders)])
+        mean_attns = {}
+        for key in attns[0]:
+            mean_attns[key] = torch.stack(
+                [attn[key] for attn in attns]).mean(0)
+        return (EnsembleDecoderOutput(dec_outs),
+                EnsembleDecoderState(states), mean_attns)
+
+    def init_decoder_state(self, src, memory_bank, enc_hidden):
+        return EnsembleDecoderState(
+            model_decoder.init_decoder_state(src, memory_bank[i],
+                                             enc_hidden[i])
+            for i, model_decoder in enumerate(self.model_decoders))
+
+
+class EnsembleGenerator(nn.Module):
+    """
+    Averages the outputs of the generators of the models: the log-probs,
+    or the probs of copy generators, which all get the mean attention.
+    """
+
+    def __init__(self, model_generators, timer):
+        super(EnsembleGenerator, self).__init__()
+        self.model_generators = nn.ModuleList(model_generators)
+        self.timer = timer
+
+    def forward(self, hidden, attn=None, src_map=None):
+        args = () if attn is None else (attn, src_map)
+        return torch.stack([
+            self.timer.run(i, model_generator, h, *args)
+            for i, (model_generator, h) in enumerate(
+                zip(self.model_generators, hidden.model_outputs))]).mean(0)
+
+
+class EnsembleModel(NMTModel):
+    """
+    :obj:`NMTModel` interface to an ensemble of models, for translation
+    only. See :obj:`EnsembleEncoder`, :obj:`EnsembleDecoder` and
+    :obj:`EnsembleGenerator`; `timer` accounts the time of each model.
+    """
+
+    def __init__(self, models):
+        timer = EnsembleTimer(len(models))
+        encoder = EnsembleEncoder(
+            [model.encoder for model in models], timer)
+        decoder = EnsembleDecoder(
+            [model.decoder for model in models], timer)
+        super(EnsembleModel, self).__init__(encoder, decoder)
+        self.generator = EnsembleGenerator(
+            [model.generator for model in models], timer)
+        self.models = nn.ModuleList(models)
+        self.timer = timer
+
+
+def load_test_model(opt, dummy_opt):
+    """
+    Load the models of `opt.model` as an :obj:`EnsembleModel`. They must
+    share the vocabularies, and all or none must use copy attention.
+    """
+    shared_fields, shared_opt = None, None
+    models = []
+    for model_path in opt.model:
+        fields, model, model_opt = \
+            onmt.ModelConstructor.load_test_model(opt, dummy_opt, model_path)
+        if shared_fields is None:
+            shared_fields, shared_opt = fields, model_opt
+        else:
+            for key, field in fields.items():
+                if field is not None and 'vocab' in field.__dict__:
+                    assert field.vocab.stoi == \
+                        shared_fields[key].vocab.stoi, \
+                        "Ensemble models must use the same vocabularies"
+            assert model_opt.copy_attn == shared_opt.copy_attn, \
+                "Ensemble models must all or none use copy attention"
+        models.append(model)
+    model = EnsembleModel(models)
+    model.eval()
+    return shared_fields, model, shared_opt
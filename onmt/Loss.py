@@ -5,6 +5,8 @@ This includes: LossComputeBase and the standard NMTLossCompute, and
                sharded loss compute stuff.
 """
 from __future__ import division
+import math
+
 import torch
 import torch.nn as nn
 import onmt
@@ -135,7 +137,12 @@ class LossComputeBase(nn.Module):
         Returns:
             :obj:`Statistics` : statistics for this batch.
         """
-        pred = scores.max(1)[1]
+        return self._pred_stats(loss, scores.max(1)[1], target)
+
+    def _pred_stats(self, loss, pred, target):
+        """
+        Same as `_stats`, from the predicted words `pred`.
+        """
         non_padding = target.ne(self.padding_idx)
         num_correct = pred.eq(target) \
                           .masked_select(non_padding) \
@@ -154,24 +161,28 @@ class LossComputeBase(nn.Module):
 class NMTLossCompute(LossComputeBase):
     """
     Standard NMT Loss Computation.
+
+    If `generator_chunk_size` is set, the generator, a `Linear` followed
+    by a `LogSoftmax`, is fused with the loss and computed over blocks of
+    that many vocabulary columns (see
+    :func:`onmt.modules.chunked_log_softmax`), so the `[tokens x vocab]`
+    scores are never materialized.
     """
 
     def __init__(self, generator, tgt_vocab, normalization="sents",
-                 label_smoothing=0.0):
+                 label_smoothing=0.0, generator_chunk_size=0):
         super(NMTLossCompute, self).__init__(generator, tgt_vocab)
         assert (label_smoothing >= 0.0 and label_smoothing <= 1.0)
+        self.generator_chunk_size = generator_chunk_size
         if label_smoothing > 0:
             # When label smoothing is turned on,
             # KL-divergence between q_{smoothed ground truth prob.}(w)
             # and p_{prob. computed by model}(w) is minimized.
             # If label smoothing value is set to zero, the loss
             # is equivalent to NLLLoss or CrossEntropyLoss.
-            # All non-true labels are uniformly set to low-confidence.
-            self.criterion = nn.KLDivLoss(size_average=False)
-            one_hot = torch.randn(1, len(tgt_vocab))
-            one_hot.fill_(label_smoothing / (len(tgt_vocab) - 2))
-            one_hot[0][self.padding_idx] = 0
-            self.register_buffer('one_hot', one_hot)
+            # All non-true labels are uniformly set to low-confidence,
+            # except padding. See `_smoothed_loss`.
+            self.smoothing_value = label_smoothing / (len(tgt_vocab) - 2)
         else:
             weight = torch.ones(len(tgt_vocab))
             weight[self.padding_idx] = 0
@@ -185,31 +196,80 @@ class NMTLossCompute(LossComputeBase):
         }
 
     def _compute_loss(self, batch, output, target):
+        gtruth = target.view(-1)
+        if self.generator_chunk_size:
+            return self._compute_chunked_loss(output, gtruth)
+
         scores = self.generator(self._bottle(output))
 
-        gtruth = target.view(-1)
-        if self.confidence < 1:
-            tdata = gtruth.data
-            mask = torch.nonzero(tdata.eq(self.padding_idx)).squeeze()
-            log_likelihood = torch.gather(scores.data, 1, tdata.unsqueeze(1))
-            tmp_ = self.one_hot.repeat(gtruth.size(0), 1)
-            tmp_.scatter_(1, tdata.unsqueeze(1), self.confidence)
-            if mask.numel() > 0:
-                log_likelihood.index_fill_(0, mask, 0)
-                tmp_.index_fill_(0, mask, 0)
-            gtruth = tmp_
-        loss = self.criterion(scores, gtruth)
         if self.confidence < 1:
-            # Default: report smoothed ppl.
-            # loss_data = -log_likelihood.sum(0)
-            loss_data = loss.data.clone()
+            target_scores = scores.gather(1, gtruth.unsqueeze(1)).squeeze(1)
+            loss = self._smoothed_loss(target_scores, scores.sum(1),
+                                       scores[:, self.padding_idx], gtruth)
         else:
-            loss_data = loss.data.clone()
+            loss = self.criterion(scores, gtruth)
+        # Default: report smoothed ppl.
+        loss_data = loss.data.clone()
 
         stats = self._stats(loss_data, scores.data, target.view(-1).data)
 
         return loss, stats
 
+    def _compute_chunked_loss(self, output, gtruth):
+        linear = self.generator[0]
+        index = torch.stack(
+            [gtruth, gtruth.clone().fill_(self.padding_idx)], 1)
+        log_probs, sum_log_probs, _, pred = onmt.modules.chunked_log_softmax(
+            self._bottle(output), linear.weight, linear.bias, index,
+            self.generator_chunk_size)
+        target_scores, pad_scores = log_probs[:, 0], log_probs[:, 1]
+
+        if self.confidence < 1:
+            loss = self._smoothed_loss(target_scores, sum_log_probs,
+                                       pad_scores, gtruth)
+        else:
+            loss = -target_scores.masked_select(
+                gtruth.ne(self.padding_idx)).sum()
+
+        stats = self._pred_stats(loss.data.clone(), pred, gtruth.data)
+        return loss, stats
+
+    def _smoothed_loss(self, target_scores, sum_scores, pad_scores, gtruth):
+        """
+        KL-divergence between the smoothed target distribution q, with
+        q(target) = confidence, q(padding) = 0 and q(w) = smoothing_value
+        elsewhere, and the distribution of the log-probs `scores`, summed
+        over non-padding targets.
+
+        For a target t, sum_w q(w) * (log q(w) - scores[w]) is
+
+            confidence * log(confidence)
+            + label_smoothing * log(smoothing_value)
+            - confidence * scores[t]
+            - smoothing_value * (sum_w scores[w] - scores[t] - scores[pad])
+
+        so only the target, padding and summed scores of each row are
+        needed, not the dense `[tokens x vocab]` q.
+
+        Args:
+            target_scores (`FloatTensor`): `[tokens]` scores[t].
+            sum_scores (`FloatTensor`): `[tokens]` sum_w scores[w].
+            pad_scores (`FloatTensor`): `[tokens]` scores[pad].
+            gtruth (`LongTensor`): `[tokens]` targets.
+        """
+        non_padding = gtruth.ne(self.padding_idx)
+        other_scores = sum_scores - target_scores - pad_scores
+
+        n_vocab = len(self.tgt_vocab)
+        constant = (n_vocab - 2) * self.smoothing_value \
+            * math.log(self.smoothing_value)
+        if self.confidence > 0:
+            constant += self.confidence * math.log(self.confidence)
+
+        loss = constant - self.confidence * target_scores \
+            - self.smoothing_value * other_scores
+        return loss.masked_select(non_padding).sum()
+
 
 def filter_shard_state(state, shard_size=None):
     for k, v in state.items():
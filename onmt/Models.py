@@ -311,6 +311,9 @@ class RNNDecoderBase(nn.Module):
         aeq(tgt_batch, memory_batch)
         # END
 
+        if not state.memory_projected:
+            self._project_memory(memory_bank, state)
+
         # Run the forward pass of the RNN.
         decoder_final, decoder_outputs, attns = self._run_forward_pass(
             tgt, memory_bank, state, memory_lengths=memory_lengths)
@@ -340,12 +343,30 @@ class RNNDecoderBase(nn.Module):
             return h
 
         if isinstance(encoder_final, tuple):  # LSTM
-            return RNNDecoderState(self.hidden_size,
-                                   tuple([_fix_enc_hidden(enc_hid)
-                                          for enc_hid in encoder_final]))
+            state = RNNDecoderState(self.hidden_size,
+                                    tuple([_fix_enc_hidden(enc_hid)
+                                           for enc_hid in encoder_final]))
         else:  # GRU
-            return RNNDecoderState(self.hidden_size,
-                                   _fix_enc_hidden(encoder_final))
+            state = RNNDecoderState(self.hidden_size,
+                                    _fix_enc_hidden(encoder_final))
+        # Projected here, before the state is expanded to a beam.
+        self._project_memory(memory_bank, state)
+        return state
+
+    def _project_memory(self, memory_bank, state):
+        """
+        Store in `state` the source side of the mlp attention scores,
+        which is the same at every target step, see
+        :obj:`onmt.modules.GlobalAttention.project_memory`.
+        """
+        memory_bank = memory_bank.transpose(0, 1)
+        # Coverage changes the memory bank at every step.
+        if not self._coverage:
+            state.memory_proj = self.attn.project_memory(memory_bank)
+        if self._copy and not self._reuse_copy_attn:
+            state.copy_memory_proj = \
+                self.copy_attn.project_memory(memory_bank)
+        state.memory_projected = True
 
 
 class StdRNNDecoder(RNNDecoderBase):
@@ -408,7 +429,8 @@ class StdRNNDecoder(RNNDecoderBase):
         decoder_outputs, p_attn = self.attn(
             rnn_output.transpose(0, 1).contiguous(),
             memory_bank.transpose(0, 1),
-            memory_lengths=memory_lengths
+            memory_lengths=memory_lengths,
+            memory_proj=state.memory_proj
         )
         attns["std"] = p_attn
 
@@ -501,7 +523,8 @@ class InputFeedRNNDecoder(RNNDecoderBase):
             decoder_output, p_attn = self.attn(
                 rnn_output,
                 memory_bank.transpose(0, 1),
-                memory_lengths=memory_lengths)
+                memory_lengths=memory_lengths,
+                memory_proj=state.memory_proj)
             if self.context_gate is not None:
                 # TODO: context gate should be employed
                 # instead of second RNN transform.
@@ -522,8 +545,9 @@ class InputFeedRNNDecoder(RNNDecoderBase):
 
             # Run the forward pass of the copy attention layer.
             if self._copy and not self._reuse_copy_attn:
-                _, copy_attn = self.copy_attn(decoder_output,
-                                              memory_bank.transpose(0, 1))
+                _, copy_attn = self.copy_attn(
+                    decoder_output, memory_bank.transpose(0, 1),
+                    memory_proj=state.copy_memory_proj)
                 attns["copy"] += [copy_attn]
             elif self._copy:
                 attns["copy"] = attns["std"]
@@ -634,6 +658,14 @@ class DecoderState(object):
             sent_states.data.copy_(
                 sent_states.data.index_select(1, positions))
 
+    def index_select(self, positions):
+        """
+        Select `positions` along the batch dimension of every state
+        tensor, e.g. to expand the state to a beam or to reorder it with
+        the beam backpointers.
+        """
+        raise NotImplementedError
+
 
 class RNNDecoderState(DecoderState):
     def __init__(self, hidden_size, rnnstate):
@@ -649,6 +681,13 @@ class RNNDecoderState(DecoderState):
             self.hidden = rnnstate
         self.coverage = None
 
+        # Source side of the mlp attention scores, `[batch x src_len x
+        # hidden]`, set by the decoder; see `RNNDecoderBase._project_memory`.
+        # They only depend on the sentence, not on the beam hypothesis.
+        self.memory_proj = None
+        self.copy_memory_proj = None
+        self.memory_projected = False
+
         # Init the input feed.
         batch_size = self.hidden[0].size(1)
         h_size = (batch_size, hidden_size)
@@ -659,6 +698,14 @@ class RNNDecoderState(DecoderState):
     def _all(self):
         return self.hidden + (self.input_feed,)
 
+    def detach(self):
+        super(RNNDecoderState, self).detach()
+        # The projections belong to the graph of the encoder run that
+        # made them: the next one projects its own memory bank.
+        self.memory_proj = None
+        self.copy_memory_proj = None
+        self.memory_projected = False
+
     def update_state(self, rnnstate, input_feed, coverage):
         if not isinstance(rnnstate, tuple):
             self.hidden = (rnnstate,)
@@ -673,3 +720,17 @@ class RNNDecoderState(DecoderState):
                 for e in self._all]
         self.hidden = tuple(vars[:-1])
         self.input_feed = vars[-1]
+        self.memory_proj, self.copy_memory_proj = [
+            e.data.repeat(beam_size, 1, 1) if e is not None else None
+            for e in (self.memory_proj, self.copy_memory_proj)]
+
+    def index_select(self, positions):
+        """ See :obj:`DecoderState.index_select()` """
+        self.hidden = tuple(e.data.index_select(1, positions)
+                            for e in self.hidden)
+        self.input_feed = self.input_feed.data.index_select(1, positions)
+        if self.coverage is not None:
+            self.coverage = self.coverage.data.index_select(1, positions)
+        self.memory_proj, self.copy_memory_proj = [
+            e.data.index_select(0, positions) if e is not None else None
+            for e in (self.memory_proj, self.copy_memory_proj)]
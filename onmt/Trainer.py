@@ -17,6 +17,7 @@ import torch.nn as nn
 import onmt
 import onmt.io
 import onmt.modules
+import onmt.Distributed
 
 
 class Statistics(object):
@@ -34,12 +35,14 @@ class Statistics(object):
         self.n_words = n_words
         self.n_correct = n_correct
         self.n_src_words = 0
+        self.data_wait = 0
         self.start_time = time.time()
 
     def update(self, stat):
         self.loss += stat.loss
         self.n_words += stat.n_words
         self.n_correct += stat.n_correct
+        self.data_wait += stat.data_wait
 
     def accuracy(self):
         return 100 * (self.n_correct / self.n_words)
@@ -53,6 +56,10 @@ class Statistics(object):
     def elapsed_time(self):
         return time.time() - self.start_time
 
+    def data_wait_ratio(self):
+        """ Percentage of the elapsed time spent waiting for batches. """
+        return 100 * self.data_wait / (self.elapsed_time() + 1e-5)
+
     def output(self, epoch, batch, n_batches, start):
         """Write out statistics to stdout.
 
@@ -67,14 +74,15 @@ class Statistics(object):
         """
         t = self.elapsed_time()
         msg = (("Epoch %2d, %5d/%5d; acc: %6.2f; ppl: %6.2f; xent: " +
-                "%6.2f;  %3.0f src tok/s; %3.0f tgt tok/s; %6.0f s " +
-                "elapsed") %
+                "%6.2f;  %3.0f src tok/s; %3.0f tgt tok/s; %5.1f%% data " +
+                "wait; %6.0f s elapsed") %
                (epoch, batch,  n_batches,
                 self.accuracy(),
                 self.ppl(),
                 self.xent(),
                 self.n_src_words / (t + 1e-5),
                 self.n_words / (t + 1e-5),
+                self.data_wait_ratio(),
                 time.time() - start))
         return msg
 
@@ -91,9 +99,22 @@ class Statistics(object):
         writer.add_scalar(prefix + "/ppl", self.ppl(), step)
         writer.add_scalar(prefix + "/accuracy", self.accuracy(), step)
         writer.add_scalar(prefix + "/tgtper",  self.n_words / t, step)
+        writer.add_scalar(prefix + "/data_wait", self.data_wait_ratio(), step)
         writer.add_scalar(prefix + "/lr", lr, step)
 
 
+def _timed_batches(data_iter):
+    """ Yields (batch, seconds spent waiting for it) pairs. """
+    data_iter = iter(data_iter)
+    while True:
+        start = time.time()
+        try:
+            batch = next(data_iter)
+        except StopIteration:
+            return
+        yield batch, time.time() - start
+
+
 class Trainer(object):
     """
     Class that controls the training process.
@@ -112,11 +133,13 @@ class Trainer(object):
             data_type(string): type of the source input: [text|img|audio]
             norm_method(string): normalization methods: [sents|tokens]
             grad_accum_count(int): accumulate gradients this many times.
+            world_size(int): number of processes of distributed training;
+               see `onmt.Distributed`.
     """
 
     def __init__(self, model, train_loss, valid_loss, optim,
                  trunc_size=0, shard_size=32, data_type='text',
-                 norm_method="sents", grad_accum_count=1):
+                 norm_method="sents", grad_accum_count=1, world_size=1):
         # Basic attributes.
         self.model = model
         self.train_loss = train_loss
@@ -127,6 +150,7 @@ class Trainer(object):
         self.data_type = data_type
         self.norm_method = norm_method
         self.grad_accum_count = grad_accum_count
+        self.world_size = world_size
         self.progress_step = 0
 
         assert(grad_accum_count > 0)
@@ -134,6 +158,10 @@ class Trainer(object):
             assert(self.trunc_size == 0), \
                 """To enable accumulated gradients,
                    you must disable target sequence truncating."""
+        if world_size > 1:
+            assert(self.trunc_size == 0), \
+                """To enable distributed training,
+                   you must disable target sequence truncating."""
 
         # Set model in training mode.
         self.model.train()
@@ -163,9 +191,11 @@ class Trainer(object):
             # Dynamic batching
             num_batches = -1
 
-        for i, batch in enumerate(train_iter):
+        for i, (batch, data_wait) in enumerate(_timed_batches(train_iter)):
             cur_dataset = train_iter.get_cur_dataset()
             self.train_loss.cur_dataset = cur_dataset
+            total_stats.data_wait += data_wait
+            report_stats.data_wait += data_wait
 
             true_batchs.append(batch)
             accum += 1
@@ -194,7 +224,15 @@ class Trainer(object):
                 normalization = 0
                 idx += 1
 
-        if len(true_batchs) > 0:
+        if self.world_size > 1:
+            # Processes step together: keep stepping, without batches,
+            # until the shards of the other processes are over too.
+            while self._gradient_accumulation(
+                    true_batchs, total_stats,
+                    report_stats, normalization):
+                true_batchs = []
+                normalization = 0
+        elif len(true_batchs) > 0:
             self._gradient_accumulation(
                 true_batchs, total_stats,
                 report_stats, normalization)
@@ -278,7 +316,25 @@ class Trainer(object):
 
     def _gradient_accumulation(self, true_batchs, total_stats,
                                report_stats, normalization):
-        if self.grad_accum_count > 1:
+        """
+        Update the parameters with the gradients of `true_batchs`.
+
+        In distributed training, the gradients of all processes are
+        normalized by their total `normalization` and summed, which is
+        the same update as one process with all their batches.
+
+        Returns:
+            False if no process had batches, so nothing was done.
+        """
+        step_once = self.grad_accum_count > 1 or self.world_size > 1
+        if self.world_size > 1:
+            normalization, n_batches = onmt.Distributed.all_reduce_sum(
+                [float(normalization), len(true_batchs)],
+                next(self.model.parameters()).data)
+            if n_batches == 0:
+                return False
+
+        if step_once:
             self.model.zero_grad()
 
         for batch in true_batchs:
@@ -304,7 +360,7 @@ class Trainer(object):
                 tgt = tgt_outer[j: j + trunc_size]
 
                 # 2. F-prop all but generator.
-                if self.grad_accum_count == 1:
+                if not step_once:
                     self.model.zero_grad()
                 outputs, attns, dec_state = \
                     self.model(src, tgt, src_lengths, dec_state)
@@ -315,7 +371,7 @@ class Trainer(object):
                     trunc_size, self.shard_size, normalization)
 
                 # 4. Update the parameters and statistics.
-                if self.grad_accum_count == 1:
+                if not step_once:
                     self.optim.step()
                 total_stats.update(batch_stats)
                 report_stats.update(batch_stats)
@@ -324,5 +380,9 @@ class Trainer(object):
                 if dec_state is not None and j+trunc_size < target_size-1:
                     dec_state.detach()
 
-        if self.grad_accum_count > 1:
+        if step_once:
+            if self.world_size > 1:
+                onmt.Distributed.all_reduce_gradients(
+                    self.model.parameters())
             self.optim.step()
+        return True
@@ -1,11 +1,39 @@
-import onmt.io
-import onmt.Models
-import onmt.Loss
-import onmt.translate
-import onmt.opts
-from onmt.Trainer import Trainer, Statistics
-from onmt.Optim import Optim
-
-# For flake8 compatibility
-__all__ = [onmt.Loss, onmt.Models, onmt.opts,
-           Trainer, Optim, Statistics, onmt.io, onmt.translate]
+import importlib
+import sys
+
+# The submodules, and the classes below, are imported on first access
+# (see `__getattr__`), so `import onmt` doesn't load torchtext, every
+# model and the translation stack up front.
+_SUBMODULES = ['io', 'Models', 'Loss', 'translate', 'opts', 'modules',
+               'Utils', 'ModelConstructor', 'Ensemble', 'Distributed']
+_CLASSES = {'Trainer': 'onmt.Trainer', 'Statistics': 'onmt.Trainer',
+            'Optim': 'onmt.Optim'}
+
+
+def _load(name):
+    if name not in _CLASSES:
+        globals()[name] = importlib.import_module('onmt.' + name)
+        return globals()[name]
+    module = importlib.import_module(_CLASSES[name])
+    # Importing onmt.Trainer binds the module to `onmt.Trainer`: bind
+    # the classes over it.
+    for class_name, module_name in _CLASSES.items():
+        if module_name == module.__name__:
+            globals()[class_name] = getattr(module, class_name)
+    return globals()[name]
+
+
+def __getattr__(name):
+    if name in _CLASSES or name in _SUBMODULES:
+        return _load(name)
+    raise AttributeError("module 'onmt' has no attribute '%s'" % name)
+
+
+if sys.version_info < (3, 7):
+    # No module __getattr__ (PEP 562).
+    for _name in ['io', 'Models', 'Loss', 'translate', 'opts'] + \
+            sorted(_CLASSES):
+        _load(_name)
+
+__all__ = ['Loss', 'Models', 'opts', 'Trainer', 'Optim', 'Statistics',
+           'io', 'translate']
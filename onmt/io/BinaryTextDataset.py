@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+import os
+import random
+
+import numpy as np
+import torch
+
+from onmt.io.DatasetBase import UNK, PAD_WORD, BOS_WORD, EOS_WORD
+from onmt.io.IO import bucket_batches, padding_efficiency
+
+
+class BinaryTextDataset(object):
+    """ Dataset for data_type=='text' stored as flat arrays of token ids.
+
+        A dataset saved at `path` is made of:
+
+        * `path`: a small torch-saved dict with the number of features
+          and the names of the arrays.
+        * `path.src.offsets`, `path.tgt.offsets`: int64 arrays of size
+          `n_examples + 1`; the tokens of example `i` on a side are at
+          `[offsets[i], offsets[i + 1])` of every array of that side.
+        * `path.<key>.ids`: int32 token ids of the words (`src`, `tgt`)
+          and of each feature (`src_feat_j`, `tgt_feat_j`), numericalized
+          with the vocabularies of `vocab.pt`. Targets are stored without
+          `<s>` and `</s>`, which are added when batching.
+        * `path.indices`: int64 line number of each example in its
+          shard, which starts again at 0 in each shard of the corpus,
+          as the `indices` field of the other text datasets.
+
+        The arrays are memory-mapped, so loading a shard does not read
+        it, and an example costs a few bytes per token.
+
+        Args:
+            path (str): location of the dataset.
+            fields (dict): a dictionary of `torchtext.data.Field`, may be
+                set later as for the other datasets.
+    """
+
+    data_type = 'text'
+
+    def __init__(self, path, fields=None):
+        meta = torch.load(path)
+        self.path = path
+        self.n_src_feats = meta["n_src_feats"]
+        self.n_tgt_feats = meta["n_tgt_feats"]
+        self.keys = meta["keys"]
+        self.fields = fields
+        # No dynamic dictionaries, see `save`.
+        self.src_vocabs = []
+
+        self.offsets = {}
+        for side in ["src", "tgt"]:
+            self.offsets[side] = self._memmap(
+                "%s.%s.offsets" % (path, side), np.int64)
+        self.ids = {}
+        for key in self.keys:
+            self.ids[key] = self._memmap("%s.%s.ids" % (path, key), np.int32)
+        self.indices = self._memmap(path + ".indices", np.int64)
+
+    @staticmethod
+    def _memmap(path, dtype):
+        # np.memmap can't map an empty file.
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def __len__(self):
+        return len(self.indices)
+
+    def lengths(self, side):
+        """ Number of tokens of every example on `side`. """
+        return np.diff(self.offsets[side])
+
+    def tokens(self, key, i):
+        """ Token ids of example `i` in the array `key`. """
+        side = key.split("_")[0]
+        offsets = self.offsets[side]
+        return self.ids[key][offsets[i]:offsets[i + 1]]
+
+    @staticmethod
+    def save(path, fields, examples_iter, n_src_feats, n_tgt_feats):
+        """
+        Numericalize `examples_iter` with the vocabularies of `fields`
+        and write a dataset at `path`.
+
+        Args:
+            path (str): location of the dataset.
+            fields (dict): fields with their vocabularies.
+            examples_iter: iterator of example dicts with the keys
+                `src`, `tgt`, `src_feat_j`, `tgt_feat_j` and `indices`,
+                as produced by :obj:`ShardedTextCorpusIterator`.
+            n_src_feats (int): number of source features.
+            n_tgt_feats (int): number of target features.
+
+        Returns:
+            The number of examples written.
+        """
+        keys = ["src"] + ["src_feat_" + str(j) for j in range(n_src_feats)] \
+            + ["tgt"] + ["tgt_feat_" + str(j) for j in range(n_tgt_feats)]
+        stoi = dict((key, fields[key].vocab.stoi) for key in keys)
+        files = dict((key, open("%s.%s.ids" % (path, key), "wb"))
+                     for key in keys)
+        offsets = {"src": [0], "tgt": [0]}
+        indices = []
+        for ex in examples_iter:
+            for key in keys:
+                ids = [stoi[key].get(tok, UNK) for tok in ex[key]]
+                files[key].write(np.array(ids, dtype=np.int32).tobytes())
+            for side in ["src", "tgt"]:
+                offsets[side].append(offsets[side][-1] + len(ex[side]))
+            indices.append(ex["indices"])
+        for f in files.values():
+            f.close()
+
+        for side in ["src", "tgt"]:
+            with open("%s.%s.offsets" % (path, side), "wb") as f:
+                f.write(np.array(offsets[side], dtype=np.int64).tobytes())
+        with open(path + ".indices", "wb") as f:
+            f.write(np.array(indices, dtype=np.int64).tobytes())
+
+        torch.save({"n_src_feats": n_src_feats,
+                    "n_tgt_feats": n_tgt_feats,
+                    "keys": keys}, path)
+        return len(indices)
+
+
+class BinaryBatch(object):
+    """
+    A batch of a :obj:`BinaryTextDataset`, with the attributes of a
+    torchtext `Batch` used by the trainer: `batch_size`, `dataset`,
+    `indices`, `src` (data, lengths), `tgt` and the features.
+    """
+
+    def __init__(self, dataset, examples, device):
+        self.batch_size = len(examples)
+        self.dataset = dataset
+        fields = dataset.fields
+        src_lengths = [len(dataset.tokens("src", i)) for i in examples]
+        tgt_lengths = [len(dataset.tokens("tgt", i)) + 2 for i in examples]
+
+        for key in dataset.keys:
+            field = fields[key]
+            pad = field.vocab.stoi[PAD_WORD]
+            if key.startswith("src"):
+                data = np.full((max(src_lengths), len(examples)), pad,
+                               dtype=np.int64)
+                for b, i in enumerate(examples):
+                    tokens = dataset.tokens(key, i)
+                    data[:len(tokens), b] = tokens
+            else:
+                bos = field.vocab.stoi[BOS_WORD]
+                eos = field.vocab.stoi[EOS_WORD]
+                data = np.full((max(tgt_lengths), len(examples)), pad,
+                               dtype=np.int64)
+                for b, i in enumerate(examples):
+                    tokens = dataset.tokens(key, i)
+                    data[0, b] = bos
+                    data[1:len(tokens) + 1, b] = tokens
+                    data[len(tokens) + 1, b] = eos
+            data = self._to_device(torch.from_numpy(data), device)
+            if key == "src":
+                data = (data, self._to_device(
+                    torch.LongTensor(src_lengths), device))
+            setattr(self, key, data)
+
+        self.indices = self._to_device(
+            torch.from_numpy(dataset.indices[examples]), device)
+
+    @staticmethod
+    def _to_device(tensor, device):
+        if device is not None and device >= 0:
+            return tensor.cuda(device)
+        return tensor
+
+
+class BinaryTextIterator(object):
+    """
+    Iterator over the batches of a :obj:`BinaryTextDataset`, batching
+    straight from the memory-mapped arrays. It follows
+    :obj:`OrderedIterator`: for training, the examples are shuffled,
+    sorted by length inside pools of `100 * batch_size` examples and the
+    batches are shuffled; otherwise the batches are taken in order. The
+    examples of a batch are sorted by decreasing length.
+
+    Args:
+        dataset (:obj:`BinaryTextDataset`): the dataset.
+        batch_size (int): maximum number of examples (or tokens) per batch.
+        device (int): GPU device, -1 for CPU.
+        train (bool): train or valid?
+        batch_type (str): "sents", "tokens" or "buckets"; with "tokens",
+            the number of padded src or tgt tokens of a batch is at most
+            `batch_size`; with "buckets", batches are made by
+            `onmt.io.bucket_batches`.
+        batch_multiple (int): see `onmt.io.bucket_batches`.
+    """
+
+    def __init__(self, dataset, batch_size, device=-1, train=True,
+                 batch_type="sents", batch_multiple=1):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.device = device
+        self.train = train
+        self.batch_type = batch_type
+        self.batch_multiple = batch_multiple
+        self.src_lengths = dataset.lengths("src")
+        self.tgt_lengths = dataset.lengths("tgt")
+        self.batches = None
+        self.padding_efficiency = None
+
+    def _batch(self, examples):
+        """ Split `examples` into lists of examples. """
+        batch, max_src, max_tgt = [], 0, 0
+        for i in examples:
+            # Src: w1 ... wN, Tgt: <s> w1 ... wN </s>
+            src_len = int(self.src_lengths[i])
+            tgt_len = int(self.tgt_lengths[i]) + 2
+            if self.batch_type == "tokens":
+                size = (len(batch) + 1) * max(max_src, src_len, max_tgt,
+                                              tgt_len)
+            else:
+                size = len(batch) + 1
+            if batch and size > self.batch_size:
+                yield batch
+                batch, max_src, max_tgt = [], 0, 0
+            batch.append(i)
+            max_src = max(max_src, src_len)
+            max_tgt = max(max_tgt, tgt_len)
+        if batch:
+            yield batch
+
+    def create_batches(self):
+        if self.batch_type == "buckets":
+            lengths = list(zip(self.src_lengths.tolist(),
+                               (self.tgt_lengths + 2).tolist()))
+            batches = bucket_batches(lengths, self.batch_size,
+                                     self.batch_multiple, self.train)
+            self.padding_efficiency = padding_efficiency(batches, lengths)
+            return batches
+
+        examples = list(range(len(self.dataset)))
+        if not self.train:
+            return list(self._batch(examples))
+
+        def sort_key(i):
+            return (self.src_lengths[i], self.tgt_lengths[i])
+
+        random.shuffle(examples)
+        pool_size = self.batch_size * 100
+        batches = []
+        for p in range(0, len(examples), pool_size):
+            pool = sorted(examples[p:p + pool_size], key=sort_key)
+            pool_batches = list(self._batch(pool))
+            random.shuffle(pool_batches)
+            batches += pool_batches
+        return batches
+
+    def __iter__(self):
+        if self.batches is None:
+            self.batches = self.create_batches()
+        batches, self.batches = self.batches, None
+        for examples in batches:
+            examples = sorted(
+                examples, key=lambda i: (self.src_lengths[i],
+                                         self.tgt_lengths[i]),
+                reverse=True)
+            yield BinaryBatch(self.dataset, examples, self.device)
+
+    def __len__(self):
+        if self.batches is None:
+            self.batches = self.create_batches()
+        return len(self.batches)
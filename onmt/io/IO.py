@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import os
+import random
+import sys
+import threading
 from collections import Counter, defaultdict, OrderedDict
 from itertools import count
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 import torch
 import torchtext.data
 import torchtext.vocab
@@ -254,31 +262,8 @@ def build_vocab(train_dataset_files, fields, data_type, share_vocab,
         counter[k] = Counter()
 
     # Load vocabulary
-    src_vocab = None
-    if len(src_vocab_path) > 0:
-        src_vocab = set([])
-        print('Loading source vocab from %s' % src_vocab_path)
-        assert os.path.exists(src_vocab_path), \
-            'src vocab %s not found!' % src_vocab_path
-        with open(src_vocab_path) as f:
-            for line in f:
-                if len(line.strip()) == 0:
-                    continue
-                word = line.strip().split()[0]
-                src_vocab.add(word)
-
-    tgt_vocab = None
-    if len(tgt_vocab_path) > 0:
-        tgt_vocab = set([])
-        print('Loading target vocab from %s' % tgt_vocab_path)
-        assert os.path.exists(tgt_vocab_path), \
-            'tgt vocab %s not found!' % tgt_vocab_path
-        with open(tgt_vocab_path) as f:
-            for line in f:
-                if len(line.strip()) == 0:
-                    continue
-                word = line.strip().split()[0]
-                tgt_vocab.add(word)
+    src_vocab = read_vocab_file(src_vocab_path, "source")
+    tgt_vocab = read_vocab_file(tgt_vocab_path, "target")
 
     for path in train_dataset_files:
         dataset = torch.load(path)
@@ -295,16 +280,58 @@ def build_vocab(train_dataset_files, fields, data_type, share_vocab,
                     val = [item for item in val if item in tgt_vocab]
                 counter[k].update(val)
 
+    return build_vocab_from_counter(counter, fields, data_type, share_vocab,
+                                    src_vocab_size, src_words_min_frequency,
+                                    tgt_vocab_size, tgt_words_min_frequency,
+                                    logger)
+
+
+def read_vocab_file(vocab_path, tag):
+    """
+    Args:
+        vocab_path(string): Path to a vocabulary file, one word per line.
+            An empty path means no vocabulary.
+        tag(string): "source" or "target", for logging.
+
+    Returns:
+        The set of words of the vocabulary, or None.
+    """
+    if len(vocab_path) == 0:
+        return None
+    vocab = set([])
+    print('Loading %s vocab from %s' % (tag, vocab_path))
+    assert os.path.exists(vocab_path), \
+        '%s vocab %s not found!' % (tag, vocab_path)
+    with open(vocab_path) as f:
+        for line in f:
+            if len(line.strip()) == 0:
+                continue
+            word = line.strip().split()[0]
+            vocab.add(word)
+    return vocab
+
+
+def build_vocab_from_counter(counter, fields, data_type, share_vocab,
+                             src_vocab_size, src_words_min_frequency,
+                             tgt_vocab_size, tgt_words_min_frequency,
+                             logger=None):
+    """
+    Build the vocab of `fields` from token counts.
+
+    Args:
+        counter (dict): a `Counter` of tokens for each field name.
+        See :obj:`build_vocab` for the other arguments.
+
+    Returns:
+        Dict of Fields
+    """
     _build_field_vocab(fields["tgt"], counter["tgt"],
                        max_size=tgt_vocab_size,
                        min_freq=tgt_words_min_frequency)
     if logger:
         logger.info(" * tgt vocab size: %d." % len(fields["tgt"].vocab))
 
-    # All datasets have same num of n_tgt_features,
-    # getting the last one is OK.
-    for j in range(dataset.n_tgt_feats):
-        key = "tgt_feat_" + str(j)
+    for key in collect_features(fields, 'tgt'):
         _build_field_vocab(fields[key], counter[key])
         if logger:
             logger.info(" * %s vocab size: %d." % (key,
@@ -317,10 +344,7 @@ def build_vocab(train_dataset_files, fields, data_type, share_vocab,
         if logger:
             logger.info(" * src vocab size: %d." % len(fields["src"].vocab))
 
-        # All datasets have same num of n_src_features,
-        # getting the last one is OK.
-        for j in range(dataset.n_src_feats):
-            key = "src_feat_" + str(j)
+        for key in collect_features(fields, 'src'):
             _build_field_vocab(fields[key], counter[key])
             if logger:
                 logger.info(" * %s vocab size: %d." %
@@ -385,3 +409,170 @@ class OrderedIterator(torchtext.data.Iterator):
             for b in torchtext.data.batch(self.data(), self.batch_size,
                                           self.batch_size_fn):
                 self.batches.append(sorted(b, key=self.sort_key))
+
+
+def bucket_batches(lengths, batch_tokens, batch_multiple=1, train=True):
+    """
+    Group examples of similar lengths into batches of at most
+    `batch_tokens` src + tgt tokens, padding included.
+
+    The examples are sorted by lengths (ties in random order when
+    training), so each batch is cut from a bucket of examples of nearly
+    the same lengths, and the batches are shuffled.
+
+    Args:
+        lengths: list of the (src, tgt) lengths of each example, as
+            padded in a batch.
+        batch_tokens (int): token budget of a batch.
+        batch_multiple (int): if larger than 1, the number of examples of
+            a batch is rounded down to a multiple of it (e.g. 8 for fp16
+            kernels), unless the batch is smaller than that.
+        train (bool): shuffle the batches?
+
+    Returns:
+        A list of batches, each a list of example indices.
+    """
+    examples = list(range(len(lengths)))
+    if train:
+        random.shuffle(examples)
+    examples.sort(key=lambda i: lengths[i])
+
+    batches = []
+    batch, max_src, max_tgt = [], 0, 0
+    for i in examples:
+        src_len, tgt_len = lengths[i]
+        new_max_src = max(max_src, src_len)
+        new_max_tgt = max(max_tgt, tgt_len)
+        if batch and (len(batch) + 1) * (new_max_src + new_max_tgt) \
+                > batch_tokens:
+            keep = len(batch)
+            if keep >= batch_multiple:
+                keep -= keep % batch_multiple
+            batches.append(batch[:keep])
+            batch = batch[keep:]
+            new_max_src = max([src_len] + [lengths[j][0] for j in batch])
+            new_max_tgt = max([tgt_len] + [lengths[j][1] for j in batch])
+            if batch and (len(batch) + 1) * (new_max_src + new_max_tgt) \
+                    > batch_tokens:
+                # The remainder of the rounding doesn't fit with this
+                # example either: it is a batch of its own.
+                batches.append(batch)
+                batch, new_max_src, new_max_tgt = [], src_len, tgt_len
+        batch.append(i)
+        max_src, max_tgt = new_max_src, new_max_tgt
+    if batch:
+        batches.append(batch)
+
+    if train:
+        random.shuffle(batches)
+    return batches
+
+
+def padding_efficiency(batches, lengths):
+    """
+    Ratio of real src + tgt tokens to the tokens of the padded batches.
+    """
+    real, padded = 0, 0
+    for batch in batches:
+        src = [lengths[i][0] for i in batch]
+        tgt = [lengths[i][1] for i in batch]
+        real += sum(src) + sum(tgt)
+        padded += len(batch) * (max(src) + max(tgt))
+    return float(real) / max(padded, 1)
+
+
+class TokenBucketIterator(torchtext.data.Iterator):
+    """
+    Iterator of `bucket_batches`: `batch_size` is the budget of padded
+    src + tgt tokens per batch.
+
+    Args:
+        batch_multiple (int): see `bucket_batches`.
+        Other arguments are those of `torchtext.data.Iterator`.
+    """
+
+    def __init__(self, dataset, batch_size, batch_multiple=1, **kwargs):
+        super(TokenBucketIterator, self).__init__(dataset, batch_size,
+                                                  **kwargs)
+        self.batch_multiple = batch_multiple
+        self.index_batches = None
+        self.index_data = None
+        self.padding_efficiency = None
+
+    def _index_batches(self):
+        # `data()` is in a new random order at each call when shuffling:
+        # the batches index this one.
+        self.index_data = self.data()
+        # Src: w1 ... wN, Tgt: <s> w1 ... wN </s>, if any.
+        lengths = [(len(ex.src), len(ex.tgt) + 2 if hasattr(ex, "tgt")
+                    else 0) for ex in self.index_data]
+        batches = bucket_batches(lengths, self.batch_size,
+                                 self.batch_multiple, self.train)
+        self.padding_efficiency = padding_efficiency(batches, lengths)
+        return batches
+
+    def create_batches(self):
+        if self.index_batches is None:
+            self.index_batches = self._index_batches()
+        data = self.index_data
+        self.batches = [[data[i] for i in batch]
+                        for batch in self.index_batches]
+        # Batches are drawn again at the next epoch.
+        self.index_batches = None
+        self.index_data = None
+
+    def __len__(self):
+        if self.index_batches is None:
+            self.index_batches = self._index_batches()
+        return len(self.index_batches)
+
+
+class PrefetchIterator(object):
+    """
+    Iterates over `data_iter` in a background thread, which builds up to
+    `n_batches` batches ahead of the consumer: padding, numericalization,
+    copies to the GPU and the loading of the next shard happen while the
+    model runs on the previous batches.
+
+    Args:
+        data_iter: iterator of batches with `__len__` and
+            `get_cur_dataset()`, like `DatasetLazyIter`.
+        n_batches (int): size of the queue of ready batches.
+    """
+
+    def __init__(self, data_iter, n_batches):
+        assert n_batches > 0
+        self.data_iter = data_iter
+        self.n_batches = n_batches
+        self.cur_dataset = None
+
+    def __len__(self):
+        return len(self.data_iter)
+
+    def get_cur_dataset(self):
+        """ The dataset of the last batch returned. """
+        return self.cur_dataset
+
+    def _produce(self, batches):
+        try:
+            for batch in self.data_iter:
+                batches.put(
+                    ("batch", batch, self.data_iter.get_cur_dataset()))
+            batches.put(("end", None, None))
+        except Exception:
+            batches.put(("error", sys.exc_info()[1], None))
+
+    def __iter__(self):
+        batches = queue.Queue(self.n_batches)
+        producer = threading.Thread(target=self._produce, args=(batches,))
+        producer.daemon = True
+        producer.start()
+        while True:
+            kind, batch, dataset = batches.get()
+            if kind == "end":
+                break
+            elif kind == "error":
+                raise batch
+            self.cur_dataset = dataset
+            yield batch
+        producer.join()
@@ -11,7 +11,7 @@ import torchtext
 
 from onmt.Utils import aeq
 from onmt.io.DatasetBase import (ONMTDatasetBase, UNK_WORD,
-                                 PAD_WORD, BOS_WORD, EOS_WORD)
+                                 PAD_WORD, BOS_WORD, EOS_WORD, UNK)
 
 
 class TextDataset(ONMTDatasetBase):
@@ -91,6 +91,12 @@ class TextDataset(ONMTDatasetBase):
             out_examples, out_fields, filter_pred
         )
 
+        # At translation time the target vocabulary is already known.
+        self.copy_maps = None
+        if self.src_vocabs and hasattr(fields.get("tgt"), "vocab"):
+            self.copy_maps = self.make_copy_maps(self.src_vocabs,
+                                                 fields["tgt"].vocab)
+
     def sort_key(self, ex):
         """ Sort using length of source sentences. """
         # Default to a balanced sort, prioritizing tgt len match.
@@ -100,30 +106,108 @@ class TextDataset(ONMTDatasetBase):
         return len(ex.src)
 
     @staticmethod
-    def collapse_copy_scores(scores, batch, tgt_vocab, src_vocabs):
+    def make_copy_maps(src_vocabs, tgt_vocab):
+        """
+        Map the words of the dynamic dictionaries to the target
+        vocabulary, once for all the examples.
+
+        Args:
+            src_vocabs (list): dynamic dictionary of each example.
+            tgt_vocab (`Vocab`): the target vocabulary.
+
+        Returns:
+            (`LongTensor`, `LongTensor`): the target index of every word
+            of the dictionaries, 0 if it has none, laid end to end, and
+            the offset of each example in it, `[len(src_vocabs) + 1]`.
+        """
+        ids, offsets = [], [0]
+        for src_vocab in src_vocabs:
+            ids.append(0)
+            for i in range(1, len(src_vocab)):
+                ids.append(tgt_vocab.stoi.get(src_vocab.itos[i], UNK))
+            offsets.append(len(ids))
+        return torch.LongTensor(ids), torch.LongTensor(offsets)
+
+    @staticmethod
+    def select_copy_maps(copy_maps, indices, extra_words):
+        """
+        Args:
+            copy_maps: see `make_copy_maps`.
+            indices (`LongTensor`): example indices `[batch]`.
+            extra_words (int): size of the extended part of the scores.
+
+        Returns:
+            `LongTensor` `[batch x extra_words]`: the target index of each
+            word of the dynamic dictionary of each example, 0 if it has
+            none, on the device of `indices`.
+        """
+        ids, offsets = copy_maps
+        cpu_indices = indices.cpu()
+        start = offsets.index_select(0, cpu_indices)
+        length = offsets.index_select(0, cpu_indices + 1) - start
+        pos = torch.arange(0, extra_words).long().unsqueeze(0)
+        padding = 1 - pos.lt(length.unsqueeze(1))
+        flat = (start.unsqueeze(1) + pos).masked_fill(padding, 0)
+        fill = ids.index_select(0, flat.view(-1)).view_as(flat) \
+            .masked_fill(padding, 0)
+        return fill.type_as(indices)
+
+    @staticmethod
+    def batch_copy_maps(batch, copy_maps, extra_words):
+        """
+        The `select_copy_maps` of the examples of `batch`, on the device
+        of the batch. They are built once per batch, kept on it, and
+        reused by every step and shard of the batch.
+        """
+        fill = getattr(batch, "copy_fill", None)
+        if fill is None or fill.size(1) != extra_words:
+            fill = TextDataset.select_copy_maps(copy_maps, batch.indices.data,
+                                                extra_words)
+            batch.copy_fill = fill
+        return fill
+
+    def get_copy_maps(self, tgt_vocab):
+        """
+        The `make_copy_maps` of the dataset, computed on first use when
+        the target vocabulary was not known at build time.
+        """
+        # Not getattr: torchtext datasets make any missing attribute a
+        # generator over the examples.
+        if self.__dict__.get("copy_maps") is None:
+            self.copy_maps = self.make_copy_maps(self.src_vocabs, tgt_vocab)
+        return self.copy_maps
+
+    @staticmethod
+    def collapse_copy_scores(scores, batch, tgt_vocab, copy_maps,
+                             batch_offset=None):
         """
         Given scores from an expanded dictionary
         corresponeding to a batch, sums together copies,
         with a dictionary word when it is ambigious.
+
+        The copy probability of every extra word that is in `tgt_vocab`
+        is added to it with a single scatter-add over the batch, and then
+        set to 1e-10.
+
+        Args:
+            scores (`FloatTensor`): `[n x batch x tgt_vocab + extra]`.
+            batch: the batch, for its example indices.
+            tgt_vocab (`Vocab`): the target vocabulary.
+            copy_maps: `get_copy_maps()` of the dataset.
+            batch_offset (`LongTensor`): the position in `batch` of each
+                column of `scores`, when only some of the sentences of
+                `batch` are scored.
         """
         offset = len(tgt_vocab)
-        for b in range(batch.batch_size):
-            blank = []
-            fill = []
-            index = batch.indices.data[b]
-            src_vocab = src_vocabs[index]
-            for i in range(1, len(src_vocab)):
-                sw = src_vocab.itos[i]
-                ti = tgt_vocab.stoi[sw]
-                if ti != 0:
-                    blank.append(offset + i)
-                    fill.append(ti)
-            if blank:
-                blank = torch.Tensor(blank).type_as(batch.indices.data)
-                fill = torch.Tensor(fill).type_as(batch.indices.data)
-                scores[:, b].index_add_(1, fill,
-                                        scores[:, b].index_select(1, blank))
-                scores[:, b].index_fill_(1, blank, 1e-10)
+        extra = scores.narrow(2, offset, scores.size(2) - offset)
+        fill = TextDataset.batch_copy_maps(batch, copy_maps, extra.size(2))
+        if batch_offset is not None:
+            fill = fill.index_select(0, batch_offset)
+        fill = fill.unsqueeze(0).expand_as(extra)
+        mapped = fill.ne(0)
+        scores.narrow(2, 0, offset).scatter_add_(
+            2, fill, extra.masked_fill(1 - mapped, 0))
+        extra.masked_fill_(mapped, 1e-10)
         return scores
 
     @staticmethod
@@ -168,20 +252,34 @@ class TextDataset(ONMTDatasetBase):
             (word, features, nfeat) triples for each line.
         """
         with codecs.open(path, "r", "utf-8") as corpus_file:
-            for i, line in enumerate(corpus_file):
-                line = line.strip().split()
-                if truncate:
-                    line = line[:truncate]
+            for ex in TextDataset.read_text_lines(corpus_file, truncate,
+                                                  side):
+                yield ex
+
+    @staticmethod
+    def read_text_lines(lines, truncate, side):
+        """
+        Args:
+            lines: iterable of the lines of a src or tgt corpus.
+            truncate (int): maximum sequence length (0 for unlimited).
+            side (str): "src" or "tgt".
+
+        Yields:
+            (example_dict, nfeat) pairs for each line.
+        """
+        for i, line in enumerate(lines):
+            line = line.strip().split()
+            if truncate:
+                line = line[:truncate]
 
-                words, feats, n_feats = \
-                    TextDataset.extract_text_features(line)
+            words, feats, n_feats = TextDataset.extract_text_features(line)
 
-                example_dict = {side: words, "indices": i}
-                if feats:
-                    prefix = side + "_feat_"
-                    example_dict.update((prefix + str(j), f)
-                                        for j, f in enumerate(feats))
-                yield example_dict, n_feats
+            example_dict = {side: words, "indices": i}
+            if feats:
+                prefix = side + "_feat_"
+                example_dict.update((prefix + str(j), f)
+                                    for j, f in enumerate(feats))
+            yield example_dict, n_feats
 
     @staticmethod
     def get_fields(n_src_features, n_tgt_features):
@@ -285,6 +383,144 @@ class TextDataset(ONMTDatasetBase):
             yield example
 
 
+class InMemoryTextDataset(object):
+    """
+    Tokenized source sentences held in memory, for translation.
+
+    The sentences are numericalized directly with the vocabularies of
+    `fields` into padded tensors, without temporary files or torchtext
+    `Example` objects. This provides what
+    :obj:`onmt.translate.Translator` and
+    :obj:`onmt.translate.TranslationBuilder` use from a
+    :obj:`TextDataset`.
+
+    Args:
+        fields (dict): a dictionary of `torchtext.data.Field`.
+        sentences (list of list of str): tokenized source sentences, each
+            token optionally followed by u"￨"-delimited features.
+        dynamic_dict (bool): create dynamic dictionaries (for copy
+            attention)?
+    """
+
+    data_type = 'text'
+    collapse_copy_scores = staticmethod(TextDataset.collapse_copy_scores)
+    select_copy_maps = staticmethod(TextDataset.select_copy_maps)
+    batch_copy_maps = staticmethod(TextDataset.batch_copy_maps)
+
+    def __init__(self, fields, sentences, dynamic_dict=False):
+        self.fields = fields
+        self.examples = []
+        self.src_vocabs = []
+        for tokens in sentences:
+            words, feats, _ = TextDataset.extract_text_features(tokens)
+            self.examples.append(InMemoryExample(words, feats))
+            if dynamic_dict:
+                self.src_vocabs.append(torchtext.vocab.Vocab(
+                    Counter(words), specials=[UNK_WORD, PAD_WORD]))
+        self.copy_maps = None
+        if self.src_vocabs:
+            self.copy_maps = TextDataset.make_copy_maps(
+                self.src_vocabs, fields["tgt"].vocab)
+
+    def __len__(self):
+        return len(self.examples)
+
+    def get_copy_maps(self, tgt_vocab):
+        """ See :obj:`TextDataset.get_copy_maps`. """
+        return self.copy_maps
+
+    def _numericalize(self, name, tokens):
+        stoi = self.fields[name].vocab.stoi
+        return [stoi.get(tok, UNK) for tok in tokens]
+
+    def batches(self, batch_size, cuda=False, batch_type="sents",
+                sort_by_length=False):
+        """
+        Yield batches of `batch_size` consecutive sentences, sorted by
+        decreasing length within each batch.
+
+        With `batch_type` "tokens", `batch_size` is the number of padded
+        source tokens of a batch. With `sort_by_length`, the sentences are
+        sorted by length before being batched.
+        """
+        order = list(range(len(self.examples)))
+        if sort_by_length:
+            order.sort(key=lambda i: len(self.examples[i].src))
+
+        indices, max_len = [], 0
+        for i in order:
+            length = len(self.examples[i].src)
+            if batch_type == "tokens":
+                size = (len(indices) + 1) * max(max_len, length)
+            else:
+                size = len(indices) + 1
+            if indices and size > batch_size:
+                yield self._make_batch(indices, cuda)
+                indices, max_len = [], 0
+            indices.append(i)
+            max_len = max(max_len, length)
+        if indices:
+            yield self._make_batch(indices, cuda)
+
+    def _make_batch(self, indices, cuda):
+        indices = sorted(indices, key=lambda i: -len(self.examples[i].src))
+        examples = [self.examples[i] for i in indices]
+        lengths = [len(ex.src) for ex in examples]
+        max_len = max(lengths)
+
+        def pad_tensor(name, seqs):
+            pad = self.fields[name].vocab.stoi[PAD_WORD]
+            data = torch.LongTensor(max_len, len(seqs)).fill_(pad)
+            for b, seq in enumerate(seqs):
+                if seq:
+                    data[:len(seq), b] = torch.LongTensor(
+                        self._numericalize(name, seq))
+            return data
+
+        batch = InMemoryBatch()
+        batch.batch_size = len(indices)
+        batch.indices = torch.LongTensor(indices)
+        batch.src = (pad_tensor("src", [ex.src for ex in examples]),
+                     torch.LongTensor(lengths))
+        n_feats = len(examples[0].src_feats)
+        for j in range(n_feats):
+            name = "src_feat_" + str(j)
+            setattr(batch, name,
+                    pad_tensor(name, [ex.src_feats[j] for ex in examples]))
+        if self.src_vocabs:
+            src_vocabs = [self.src_vocabs[i] for i in indices]
+            batch.src_map = torch.zeros(
+                max_len, len(indices), max(len(v) for v in src_vocabs))
+            for b, (ex, src_vocab) in enumerate(zip(examples, src_vocabs)):
+                for j, w in enumerate(ex.src):
+                    batch.src_map[j, b, src_vocab.stoi[w]] = 1
+
+        if cuda:
+            for name, value in list(batch.__dict__.items()):
+                if isinstance(value, tuple):
+                    setattr(batch, name, tuple(v.cuda() for v in value))
+                elif torch.is_tensor(value):
+                    setattr(batch, name, value.cuda())
+        return batch
+
+
+class InMemoryExample(object):
+    """ A source sentence of an :obj:`InMemoryTextDataset`. """
+
+    def __init__(self, src, src_feats):
+        self.src = src
+        self.src_feats = src_feats
+
+
+class InMemoryBatch(object):
+    """
+    A batch of an :obj:`InMemoryTextDataset`, with the attributes of a
+    torchtext `Batch` used at translation time: `batch_size`, `indices`,
+    `src` (data, lengths), `src_feat_*` and `src_map`.
+    """
+    pass
+
+
 class ShardedTextCorpusIterator(object):
     """
     This is the iterator for text corpus, used for sharding large text
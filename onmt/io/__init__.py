@@ -2,10 +2,15 @@ from onmt.io.IO import collect_feature_vocabs, make_features, \
     collect_features, get_num_features, \
     load_fields_from_vocab, get_fields, \
     save_fields_to_vocab, build_dataset, \
-    build_vocab, merge_vocabs, OrderedIterator
+    build_vocab, build_vocab_from_counter, read_vocab_file, \
+    merge_vocabs, OrderedIterator, TokenBucketIterator, PrefetchIterator, \
+    bucket_batches, padding_efficiency
 from onmt.io.DatasetBase import ONMTDatasetBase, PAD_WORD, BOS_WORD, \
     EOS_WORD, UNK
-from onmt.io.TextDataset import TextDataset, ShardedTextCorpusIterator
+from onmt.io.TextDataset import TextDataset, ShardedTextCorpusIterator, \
+    InMemoryTextDataset
+from onmt.io.BinaryTextDataset import BinaryTextDataset, \
+    BinaryTextIterator
 from onmt.io.ImageDataset import ImageDataset
 from onmt.io.AudioDataset import AudioDataset
 
@@ -15,6 +20,9 @@ __all__ = [PAD_WORD, BOS_WORD, EOS_WORD, UNK, ONMTDatasetBase,
            collect_features, get_num_features,
            load_fields_from_vocab, get_fields,
            save_fields_to_vocab, build_dataset,
-           build_vocab, merge_vocabs, OrderedIterator,
+           build_vocab, build_vocab_from_counter, read_vocab_file,
+           merge_vocabs, OrderedIterator, TokenBucketIterator,
+           PrefetchIterator, bucket_batches, padding_efficiency,
            TextDataset, ImageDataset, AudioDataset,
-           ShardedTextCorpusIterator]
+           ShardedTextCorpusIterator, InMemoryTextDataset,
+           BinaryTextDataset, BinaryTextIterator]
@@ -0,0 +1,134 @@
+import torch
+
+
+class ChunkedLogSoftmax(torch.autograd.Function):
+    """
+    Fused `LogSoftmax(Linear(hidden))` that never holds the whole
+    `[n x vocab]` matrix: the logits are computed over blocks of
+    `chunk_size` vocabulary columns, with an online log-sum-exp, and
+    only a few log-probs per row are kept. The backward pass computes
+    the logits of each block again.
+
+    See :func:`chunked_log_softmax` for the arguments and outputs.
+    """
+
+    @staticmethod
+    def forward(ctx, hidden, weight, bias, index, chunk_size, mask_index):
+        n, n_vocab = hidden.size(0), weight.size(0)
+        row_max = hidden.new(n).fill_(-float('inf'))
+        exp_sum = hidden.new(n).zero_()
+        logit_sum = hidden.new(n).zero_()
+        gathered = hidden.new(index.size()).zero_()
+        best = hidden.new(n).fill_(-float('inf'))
+        argmax = index.new(n).zero_()
+
+        for start in range(0, n_vocab, chunk_size):
+            logits = _block_logits(hidden, weight, bias, start, chunk_size)
+            end = start + logits.size(1)
+            if mask_index is not None and start <= mask_index < end:
+                logits[:, mask_index - start] = -float('inf')
+                logit_sum += logits[:, :mask_index - start].sum(1) \
+                    + logits[:, mask_index - start + 1:].sum(1)
+            else:
+                logit_sum += logits.sum(1)
+
+            block_max, block_argmax = logits.max(1)
+            new_max = torch.max(row_max, block_max)
+            exp_sum.mul_(torch.exp(row_max - new_max)).add_(
+                torch.exp(logits - new_max.unsqueeze(1)).sum(1))
+            row_max = new_max
+
+            better = block_max > best
+            best = torch.where(better, block_max, best)
+            argmax = torch.where(better, block_argmax + start, argmax)
+
+            in_block = (index >= start) & (index < end)
+            local = (index - start).clamp(0, end - start - 1)
+            gathered += logits.gather(1, local).masked_fill(1 - in_block, 0)
+
+        lse = row_max + exp_sum.log()
+        n_cols = n_vocab - (mask_index is not None)
+
+        ctx.save_for_backward(hidden, weight, bias, index, lse)
+        ctx.chunk_size = chunk_size
+        ctx.mask_index = mask_index
+        ctx.n_cols = n_cols
+
+        log_probs = gathered - lse.unsqueeze(1)
+        max_log_prob = best - lse
+        ctx.mark_non_differentiable(max_log_prob, argmax)
+        return log_probs, logit_sum - n_cols * lse, max_log_prob, argmax
+
+    @staticmethod
+    def backward(ctx, grad_log_probs, grad_sum, grad_max, grad_argmax):
+        hidden, weight, bias, index, lse = ctx.saved_tensors
+        chunk_size, mask_index = ctx.chunk_size, ctx.mask_index
+        if grad_log_probs is None:
+            grad_log_probs = hidden.new(index.size()).zero_()
+        if grad_sum is None:
+            grad_sum = hidden.new(hidden.size(0)).zero_()
+
+        # d log_softmax(x)[i] / dx = onehot(i) - softmax(x), so the
+        # gradient of the logits is
+        # grad_sum - softmax(x) * (sum of all grads) + gathered grads.
+        total = (grad_log_probs.sum(1) + ctx.n_cols * grad_sum).unsqueeze(1)
+        grad_hidden = torch.zeros_like(hidden)
+        grad_weight = torch.zeros_like(weight)
+        grad_bias = torch.zeros_like(bias) if bias is not None else None
+
+        for start in range(0, weight.size(0), chunk_size):
+            logits = _block_logits(hidden, weight, bias, start, chunk_size)
+            end = start + logits.size(1)
+            probs = torch.exp(logits - lse.unsqueeze(1))
+            grad_logits = grad_sum.unsqueeze(1) - probs * total
+
+            in_block = (index >= start) & (index < end)
+            local = (index - start).clamp(0, end - start - 1)
+            grad_logits.scatter_add_(
+                1, local, grad_log_probs.masked_fill(1 - in_block, 0))
+            if mask_index is not None and start <= mask_index < end:
+                grad_logits[:, mask_index - start] = 0
+
+            grad_hidden += grad_logits.mm(weight[start:end])
+            if ctx.needs_input_grad[1]:
+                grad_weight[start:end] = grad_logits.t().mm(hidden)
+            if grad_bias is not None:
+                grad_bias[start:end] = grad_logits.sum(0)
+
+        return grad_hidden, grad_weight, grad_bias, None, None, None
+
+
+def _block_logits(hidden, weight, bias, start, chunk_size):
+    logits = hidden.mm(weight[start:start + chunk_size].t())
+    if bias is not None:
+        logits += bias[start:start + chunk_size].unsqueeze(0)
+    return logits
+
+
+def chunked_log_softmax(hidden, weight, bias, index, chunk_size,
+                        mask_index=None):
+    """
+    Log-probs of `log_softmax(hidden * weight^T + bias)` computed over
+    blocks of `chunk_size` vocabulary columns, see
+    :obj:`ChunkedLogSoftmax`.
+
+    Args:
+        hidden (`FloatTensor`): `[n x dim]`
+        weight (`FloatTensor`): `[vocab x dim]`
+        bias (`FloatTensor`): `[vocab]` or None.
+        index (`LongTensor`): `[n x k]` columns to gather for each row.
+        chunk_size (int): number of vocabulary columns per block.
+        mask_index (int): a column whose logit is set to -inf, e.g.
+            padding, or None.
+
+    Returns:
+        (log_probs, sum_log_probs, max_log_probs, argmax):
+
+        * log_probs `[n x k]`: the log-probs of the `index` columns.
+        * sum_log_probs `[n]`: sum of the log-probs of every column but
+          `mask_index`.
+        * max_log_probs `[n]`, argmax `[n]`: the best column of each row
+          (not differentiable).
+    """
+    return ChunkedLogSoftmax.apply(hidden, weight, bias, index, chunk_size,
+                                   mask_index)
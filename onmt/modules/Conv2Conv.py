@@ -133,7 +133,14 @@ class CNNDecoder(nn.Module):
             self._copy = True
 
     def forward(self, tgt, memory_bank, state, memory_lengths=None):
-        """ See :obj:`onmt.modules.RNNDecoderBase.forward()`"""
+        """
+        See :obj:`onmt.modules.RNNDecoderBase.forward()`
+
+        When decoding one step at a time in evaluation mode, the last
+        `cnn_kernel_width - 1` input columns of each layer are cached in
+        `state`, so each step only convolves and attends from the new
+        position instead of the whole prefix.
+        """
         # CHECKS
         assert isinstance(state, CNNDecoderState)
         tgt_len, tgt_batch, _ = tgt.size()
@@ -141,7 +148,17 @@ class CNNDecoder(nn.Module):
         aeq(tgt_batch, contxt_batch)
         # END CHECKS
 
+        # Incremental decoding: one step at a time, with a cache started
+        # at the first step.
+        cache = None
+        if not self.training and tgt_len == 1 and \
+                (state.cache is not None or state.previous_input is None):
+            cache = state.cache
+            if cache is None:
+                cache = [None] * self.num_layers
+        step = 0
         if state.previous_input is not None:
+            step = state.previous_input.size(0)
             tgt = torch.cat([state.previous_input, tgt], 0)
 
         # Initialize return variables.
@@ -151,7 +168,10 @@ class CNNDecoder(nn.Module):
         if self._copy:
             attns["copy"] = []
 
-        emb = self.embeddings(tgt)
+        if cache is not None:
+            emb = self.embeddings(tgt[-1:], step=step)
+        else:
+            emb = self.embeddings(tgt)
         assert emb.dim() == 3  # len x batch x embedding_dim
 
         tgt_emb = emb.transpose(0, 1).contiguous()
@@ -171,8 +191,14 @@ class CNNDecoder(nn.Module):
         pad = pad.type_as(x)
         base_target_emb = x
 
-        for conv, attention in zip(self.conv_layers, self.attn_layers):
-            new_target_input = torch.cat([pad, x], 2)
+        for i, (conv, attention) in enumerate(zip(self.conv_layers,
+                                                  self.attn_layers)):
+            if cache is not None and cache[i] is not None:
+                new_target_input = torch.cat([cache[i], x], 2)
+            else:
+                new_target_input = torch.cat([pad, x], 2)
+            if cache is not None:
+                cache[i] = new_target_input[:, :, 1:]
             out = conv(new_target_input)
             c, attn = attention(base_target_emb, out,
                                 src_memory_bank_t, src_memory_bank_c)
@@ -181,16 +207,16 @@ class CNNDecoder(nn.Module):
 
         # Process the result and update the attentions.
         outputs = output.transpose(0, 1).contiguous()
-        if state.previous_input is not None:
-            outputs = outputs[state.previous_input.size(0):]
-            attn = attn[:, state.previous_input.size(0):].squeeze()
-            attn = torch.stack([attn])
+        attn = attn.transpose(0, 1).contiguous()
+        if cache is None and step > 0:
+            outputs = outputs[step:]
+            attn = attn[step:]
         attns["std"] = attn
         if self._copy:
             attns["copy"] = attn
 
         # Update the state.
-        state.update_state(tgt)
+        state.update_state(tgt, cache)
 
         return outputs, state, attns
 
@@ -202,6 +228,10 @@ class CNNDecoderState(DecoderState):
     def __init__(self, memory_bank, enc_hidden):
         self.init_src = (memory_bank + enc_hidden) * SCALE_WEIGHT
         self.previous_input = None
+        # Last `cnn_kernel_width - 1` input columns of each layer,
+        # `[batch x hidden x (cnn_kernel_width - 1) x 1]`, when decoding
+        # incrementally.
+        self.cache = None
 
     @property
     def _all(self):
@@ -210,10 +240,24 @@ class CNNDecoderState(DecoderState):
         """
         return (self.previous_input,)
 
-    def update_state(self, input):
+    def update_state(self, input, cache=None):
         """ Called for every decoder forward pass. """
         self.previous_input = input
+        self.cache = cache
 
     def repeat_beam_size_times(self, beam_size):
         """ Repeat beam_size times along batch dimension. """
         self.init_src = self.init_src.data.repeat(1, beam_size, 1)
+        if self.cache is not None:
+            self.cache = [layer_cache.data.repeat(beam_size, 1, 1, 1)
+                          for layer_cache in self.cache]
+
+    def index_select(self, positions):
+        """ See :obj:`onmt.Models.DecoderState.index_select()` """
+        self.init_src = self.init_src.data.index_select(1, positions)
+        if self.previous_input is not None:
+            self.previous_input = \
+                self.previous_input.data.index_select(1, positions)
+        if self.cache is not None:
+            self.cache = [layer_cache.data.index_select(0, positions)
+                          for layer_cache in self.cache]
@@ -91,16 +91,28 @@ class CopyGenerator(nn.Module):
         logits[:, self.tgt_dict.stoi[onmt.io.PAD_WORD]] = -float('inf')
         prob = F.softmax(logits)
 
-        # Probability of copying p(z=1) batch.
-        p_copy = F.sigmoid(self.linear_copy(hidden))
+        p_copy, copy_prob = self.copy_probs(hidden, attn, src_map)
         # Probibility of not copying: p_{word}(w) * (1 - p(z))
         out_prob = torch.mul(prob,  1 - p_copy.expand_as(prob))
+        return torch.cat([out_prob, copy_prob], 1)
+
+    def copy_probs(self, hidden, attn, src_map):
+        """
+        The copy part of `forward`: returns p(z=1) `[batch*tlen, 1]` and
+        p(z=1) p_{copy}(w) over the extra words
+        `[batch*tlen, extra_words]`.
+        """
+        _, slen = attn.size()
+        _, batch, cvocab = src_map.size()
+
+        # Probability of copying p(z=1) batch.
+        p_copy = F.sigmoid(self.linear_copy(hidden))
         mul_attn = torch.mul(attn, p_copy.expand_as(attn))
         copy_prob = torch.bmm(mul_attn.view(-1, batch, slen)
                               .transpose(0, 1),
                               src_map.transpose(0, 1)).transpose(0, 1)
         copy_prob = copy_prob.contiguous().view(-1, cvocab)
-        return torch.cat([out_prob, copy_prob], 1)
+        return p_copy, copy_prob
 
 
 class CopyGeneratorCriterion(object):
@@ -111,18 +123,26 @@ class CopyGeneratorCriterion(object):
         self.pad = pad
 
     def __call__(self, scores, align, target):
+        # Copy probability of tokens in source
+        out = scores.gather(1, align.view(-1, 1) + self.offset).view(-1)
+        # Get scores for tokens in target
+        tmp = scores.gather(1, target.view(-1, 1)).view(-1)
+        return self.loss_from_probs(out, tmp, align, target)
+
+    def loss_from_probs(self, out, tmp, align, target):
+        """
+        Args:
+            out: copy probability of the `align` words `[batch*tlen]`.
+            tmp: probability of the `target` words `[batch*tlen]`.
+        """
         # Compute unks in align and target for readability
         align_unk = align.eq(0).float()
         align_not_unk = align.ne(0).float()
         target_unk = target.eq(0).float()
         target_not_unk = target.ne(0).float()
 
-        # Copy probability of tokens in source
-        out = scores.gather(1, align.view(-1, 1) + self.offset).view(-1)
         # Set scores for unk to 0 and add eps
         out = out.mul(align_not_unk) + self.eps
-        # Get scores for tokens in target
-        tmp = scores.gather(1, target.view(-1, 1)).view(-1)
 
         # Regular prob (no unks and unks that can't be copied)
         if not self.force_copy:
@@ -142,13 +162,19 @@ class CopyGeneratorCriterion(object):
 class CopyGeneratorLossCompute(onmt.Loss.LossComputeBase):
     """
     Copy Generator Loss Computation.
+
+    If `generator_chunk_size` is set, the softmax over the target
+    vocabulary is fused with the loss as in
+    :obj:`onmt.Loss.NMTLossCompute`; only the copy probabilities over
+    the extra words are computed densely.
     """
 
     def __init__(self, generator, tgt_vocab,
                  force_copy, normalize_by_length,
-                 eps=1e-20):
+                 eps=1e-20, generator_chunk_size=0):
         super(CopyGeneratorLossCompute, self).__init__(
             generator, tgt_vocab)
+        self.generator_chunk_size = generator_chunk_size
 
         # We lazily load datasets when there are more than one, so postpone
         # the setting of cur_dataset.
@@ -183,15 +209,20 @@ class CopyGeneratorLossCompute(onmt.Loss.LossComputeBase):
         """
         target = target.view(-1)
         align = align.view(-1)
-        scores = self.generator(self._bottle(output),
-                                self._bottle(copy_attn),
-                                batch.src_map)
-        loss = self.criterion(scores, align, target)
-        scores_data = scores.data.clone()
-        scores_data = onmt.io.TextDataset.collapse_copy_scores(
-            self._unbottle(scores_data, batch.batch_size),
-            batch, self.tgt_vocab, self.cur_dataset.src_vocabs)
-        scores_data = self._bottle(scores_data)
+        if self.generator_chunk_size:
+            loss, pred = self._chunked_loss(batch, output, target,
+                                            copy_attn, align)
+        else:
+            scores = self.generator(self._bottle(output),
+                                    self._bottle(copy_attn),
+                                    batch.src_map)
+            loss = self.criterion(scores, align, target)
+            scores_data = scores.data.clone()
+            scores_data = onmt.io.TextDataset.collapse_copy_scores(
+                self._unbottle(scores_data, batch.batch_size),
+                batch, self.tgt_vocab,
+                self.cur_dataset.get_copy_maps(self.tgt_vocab))
+            pred = self._bottle(scores_data).max(1)[1]
 
         # Correct target copy token instead of <unk>
         # tgt[i] = align[i] + len(tgt_vocab)
@@ -203,7 +234,7 @@ class CopyGeneratorLossCompute(onmt.Loss.LossComputeBase):
 
         # Compute sum of perplexities for stats
         loss_data = loss.sum().data.clone()
-        stats = self._stats(loss_data, scores_data, target_data)
+        stats = self._pred_stats(loss_data, pred, target_data)
 
         if self.normalize_by_length:
             # Compute Loss as NLL divided by seq length
@@ -218,3 +249,51 @@ class CopyGeneratorLossCompute(onmt.Loss.LossComputeBase):
             loss = loss.sum()
 
         return loss, stats
+
+    def _chunked_loss(self, batch, output, target, copy_attn, align):
+        """
+        Loss and predicted words, with the vocabulary softmax computed
+        by `onmt.modules.chunked_log_softmax`.
+
+        The prediction is the best word of the distribution collapsed as
+        in `collapse_copy_scores`: the best vocabulary word, an extra
+        word that is in the vocabulary (its vocabulary probability plus
+        its copy probability), or an extra word that is not.
+        """
+        hidden = self._bottle(output)
+        p_copy, copy_prob = self.generator.copy_probs(
+            hidden, self._bottle(copy_attn), batch.src_map)
+
+        # Rows are tlen-major: row t * batch_size + b is sentence b.
+        tlen = target.size(0) // batch.batch_size
+        fill = onmt.io.TextDataset.batch_copy_maps(
+            batch, self.cur_dataset.get_copy_maps(self.tgt_vocab),
+            batch.src_map.size(2)).repeat(tlen, 1)
+        index = torch.cat([target.unsqueeze(1), fill], 1)
+
+        linear = self.generator.linear
+        log_probs, _, max_log_prob, best_word = \
+            onmt.modules.chunked_log_softmax(
+                hidden, linear.weight, linear.bias, index,
+                self.generator_chunk_size, mask_index=self.padding_idx)
+        probs = torch.exp(log_probs) * (1 - p_copy)
+
+        loss = self.criterion.loss_from_probs(
+            copy_prob.gather(1, align.unsqueeze(1)).view(-1),
+            probs[:, 0], align, target)
+
+        # Prediction, on the collapsed distribution.
+        probs, copy_prob = probs.data, copy_prob.data
+        offset = len(self.tgt_vocab)
+        mapped = fill.ne(0)
+        extra_scores = torch.where(mapped, probs[:, 1:] + copy_prob,
+                                   copy_prob)
+        extra_words = torch.where(
+            mapped, fill, torch.arange(0, fill.size(1)).type_as(fill)
+            .unsqueeze(0).expand_as(fill) + offset)
+        best_extra, best_j = extra_scores.max(1)
+        best_vocab = torch.exp(max_log_prob.data) * (1 - p_copy.data[:, 0])
+        pred = torch.where(best_extra > best_vocab,
+                           extra_words.gather(1, best_j.unsqueeze(1))[:, 0],
+                           best_word.data)
+        return loss, pred
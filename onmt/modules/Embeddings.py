@@ -32,9 +32,12 @@ class PositionalEncoding(nn.Module):
         self.dropout = nn.Dropout(p=dropout)
         self.dim = dim
 
-    def forward(self, emb):
+    def forward(self, emb, step=None):
         emb = emb * math.sqrt(self.dim)
-        emb = emb + self.pe[:emb.size(0)]
+        if step is None:
+            emb = emb + self.pe[:emb.size(0)]
+        else:
+            emb = emb + self.pe[step]
         emb = self.dropout(emb)
         return emb
 
@@ -167,19 +170,27 @@ class Embeddings(nn.Module):
             if fixed:
                 self.word_lut.weight.requires_grad = False
 
-    def forward(self, input):
+    def forward(self, input, step=None):
         """
         Computes the embeddings for words and features.
 
         Args:
             input (`LongTensor`): index tensor `[len x batch x nfeat]`
+            step (int): position of a single-step `input` in the
+                sequence, used by the positional encoding.
         Return:
             `FloatTensor`: word embeddings `[len x batch x embedding_size]`
         """
         in_length, in_batch, nfeat = input.size()
         aeq(nfeat, len(self.emb_luts))
 
-        emb = self.make_embedding(input)
+        if step is None:
+            emb = self.make_embedding(input)
+        else:
+            emb = input
+            for name, module in self.make_embedding.named_children():
+                emb = module(emb, step=step) if name == 'pe' \
+                    else module(emb)
 
         out_length, out_batch, emb_size = emb.size()
         aeq(in_length, out_length)
@@ -51,6 +51,10 @@ class GlobalAttention(nn.Module):
     * Bahdanau Attention (mlp):
        * :math:`score(H_j, q) = v_a^T tanh(W_a q + U_a h_j)`
 
+    For mlp, :math:`U_a h_j` does not depend on the query: it can be
+    computed once per source with :obj:`project_memory` and passed to
+    every call as `memory_proj`.
+
 
     Args:
        dim (int): dimensionality of query and key
@@ -83,11 +87,30 @@ class GlobalAttention(nn.Module):
         if coverage:
             self.linear_cover = nn.Linear(1, dim, bias=False)
 
-    def score(self, h_t, h_s):
+    def project_memory(self, memory_bank):
+        """
+        Source side :math:`U_a h_j` of the mlp score.
+
+        Args:
+          memory_bank (`FloatTensor`): source vectors `[batch x src_len x dim]`
+
+        Returns:
+          :obj:`FloatTensor`: `[batch x src_len x dim]`, or None if the
+          attention type is not mlp.
+        """
+        if self.attn_type != "mlp":
+            return None
+        batch, src_len, dim = memory_bank.size()
+        uh = self.linear_context(memory_bank.contiguous().view(-1, dim))
+        return uh.view(batch, src_len, dim)
+
+    def score(self, h_t, h_s, memory_proj=None):
         """
         Args:
           h_t (`FloatTensor`): sequence of queries `[batch x tgt_len x dim]`
           h_s (`FloatTensor`): sequence of sources `[batch x src_len x dim]`
+          memory_proj (`FloatTensor`): `project_memory(h_s)` for mlp, or
+            None to compute it here.
 
         Returns:
           :obj:`FloatTensor`:
@@ -113,12 +136,19 @@ class GlobalAttention(nn.Module):
             return torch.bmm(h_t, h_s_)
         else:
             dim = self.dim
-            wq = self.linear_query(h_t.view(-1, dim))
+            wq = self.linear_query(h_t.contiguous().view(-1, dim))
+            uh = memory_proj if memory_proj is not None \
+                else self.project_memory(h_s)
+
+            if tgt_len == 1:
+                # (batch, s_len, d)
+                wquh = self.tanh(wq.unsqueeze(1) + uh)
+                return self.v(wquh.view(-1, dim)).view(tgt_batch, 1, src_len)
+
             wq = wq.view(tgt_batch, tgt_len, 1, dim)
             wq = wq.expand(tgt_batch, tgt_len, src_len, dim)
 
-            uh = self.linear_context(h_s.contiguous().view(-1, dim))
-            uh = uh.view(src_batch, 1, src_len, dim)
+            uh = uh.unsqueeze(1)
             uh = uh.expand(src_batch, tgt_len, src_len, dim)
 
             # (batch, t_len, s_len, d)
@@ -126,7 +156,8 @@ class GlobalAttention(nn.Module):
 
             return self.v(wquh.view(-1, dim)).view(tgt_batch, tgt_len, src_len)
 
-    def forward(self, input, memory_bank, memory_lengths=None, coverage=None):
+    def forward(self, input, memory_bank, memory_lengths=None, coverage=None,
+                memory_proj=None):
         """
 
         Args:
@@ -134,6 +165,8 @@ class GlobalAttention(nn.Module):
           memory_bank (`FloatTensor`): source vectors `[batch x src_len x dim]`
           memory_lengths (`LongTensor`): the source context lengths `[batch]`
           coverage (`FloatTensor`): None (not supported yet)
+          memory_proj (`FloatTensor`): `project_memory(memory_bank)`, see
+            `score`. Ignored with coverage, which changes the memory bank.
 
         Returns:
           (`FloatTensor`, `FloatTensor`):
@@ -164,12 +197,14 @@ class GlobalAttention(nn.Module):
             cover = coverage.view(-1).unsqueeze(1)
             memory_bank += self.linear_cover(cover).view_as(memory_bank)
             memory_bank = self.tanh(memory_bank)
+            memory_proj = None
 
         # compute attention scores, as in Luong et al.
-        align = self.score(input, memory_bank)
+        align = self.score(input, memory_bank, memory_proj)
 
         if memory_lengths is not None:
-            mask = sequence_mask(memory_lengths)
+            # The longest source may have left the batch.
+            mask = sequence_mask(memory_lengths, max_len=sourcel)
             mask = mask.unsqueeze(1)  # Make it broadcastable.
             align.data.masked_fill_(1 - mask, -float('inf'))
 
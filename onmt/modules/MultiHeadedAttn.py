@@ -65,7 +65,8 @@ class MultiHeadedAttention(nn.Module):
         self.dropout = nn.Dropout(dropout)
         self.final_linear = nn.Linear(model_dim, model_dim)
 
-    def forward(self, key, value, query, mask=None):
+    def forward(self, key, value, query, mask=None,
+                layer_cache=None, type=None):
         """
         Compute the context vector and the attention vectors.
 
@@ -78,6 +79,12 @@ class MultiHeadedAttention(nn.Module):
                  query vectors  `[batch, query_len, dim]`
            mask: binary mask indicating which keys have
                  non-zero attention `[batch, query_len, key_len]`
+           layer_cache (dict): projected keys and values of the previous
+                 decoding steps, updated in place. With `type` "self",
+                 the new keys and values are appended to
+                 `self_keys`/`self_values`; with `type` "context", the
+                 `memory_keys`/`memory_values` are only computed once.
+           type (str): "self" or "context", see `layer_cache`.
         Returns:
            (`FloatTensor`, `FloatTensor`) :
 
@@ -117,9 +124,27 @@ class MultiHeadedAttention(nn.Module):
                     .view(batch_size, -1, head_count * dim_per_head)
 
         # 1) Project key, value, and query.
-        key_up = shape(self.linear_keys(key))
-        value_up = shape(self.linear_values(value))
+        if layer_cache is not None and type == "self":
+            key_up = shape(self.linear_keys(key))
+            value_up = shape(self.linear_values(value))
+            if layer_cache.get("self_keys") is not None:
+                key_up = torch.cat((layer_cache["self_keys"], key_up), 2)
+                value_up = torch.cat((layer_cache["self_values"], value_up),
+                                     2)
+            layer_cache["self_keys"] = key_up
+            layer_cache["self_values"] = value_up
+        elif layer_cache is not None and type == "context":
+            if layer_cache.get("memory_keys") is None:
+                layer_cache["memory_keys"] = shape(self.linear_keys(key))
+                layer_cache["memory_values"] = \
+                    shape(self.linear_values(value))
+            key_up = layer_cache["memory_keys"]
+            value_up = layer_cache["memory_values"]
+        else:
+            key_up = shape(self.linear_keys(key))
+            value_up = shape(self.linear_values(value))
         query_up = shape(self.linear_query(query))
+        key_len = key_up.size(2)
 
         # 2) Calculate and scale scores.
         query_up = query_up / math.sqrt(dim_per_head)
@@ -1,30 +1,16 @@
 # flake8: noqa
 
-import subprocess
-import platform
+import pkgutil
 import os
 import re
-import argparse
 import torch
 import torch.nn as nn
 from torch.autograd import Function
 from collections import namedtuple
 
 
-# For command-line option parsing
-class CheckSRU(argparse.Action):
-    def __init__(self, option_strings, dest, **kwargs):
-        super(CheckSRU, self).__init__(option_strings, dest, **kwargs)
-
-    def __call__(self, parser, namespace, values, option_string=None):
-        if values == 'SRU':
-            check_sru_requirement(abort=True)
-        # Check pass, set the args.
-        setattr(namespace, self.dest, values)
-
-
 # This SRU version implements its own cuda-level optimization,
-# so it requires that:
+# so on gpu it requires that:
 # 1. `cupy` and `pynvrtc` python package installed.
 # 2. pytorch is built with cuda support.
 # 3. library path set: export LD_LIBRARY_PATH=<cuda lib path>.
@@ -32,39 +18,41 @@ def check_sru_requirement(abort=False):
     """
     Return True if check pass; if check fails and abort is True,
     raise an Exception, othereise return False.
+
+    The requirements are only probed on the first call.
     """
+    global _sru_requirement_error
+    if _sru_requirement_error is None:
+        _sru_requirement_error = _probe_sru_requirement()
+    if _sru_requirement_error and abort:
+        raise AssertionError(_sru_requirement_error)
+    return not _sru_requirement_error
+
+
+# Result of `_probe_sru_requirement`, once probed.
+_sru_requirement_error = None
+
+
+def _probe_sru_requirement():
+    """ The reason why SRU can't be used, or "" if it can. """
     # Check 1.
-    try:
-        if platform.system() == 'Windows':
-            subprocess.check_output('pip freeze | findstr cupy', shell=True)
-            subprocess.check_output('pip freeze | findstr pynvrtc',
-                                    shell=True)
-        else:  # Unix-like systems
-            subprocess.check_output('pip freeze | grep -w cupy', shell=True)
-            subprocess.check_output('pip freeze | grep -w pynvrtc',
-                                    shell=True)
-    except subprocess.CalledProcessError:
-        if not abort:
-            return False
-        raise AssertionError("Using SRU requires 'cupy' and 'pynvrtc' "
-                             "python packages installed.")
+    if pkgutil.find_loader('cupy') is None or \
+            pkgutil.find_loader('pynvrtc') is None:
+        return ("Using SRU requires 'cupy' and 'pynvrtc' "
+                "python packages installed.")
 
     # Check 2.
     if torch.cuda.is_available() is False:
-        if not abort:
-            return False
-        raise AssertionError("Using SRU requires pytorch built with cuda.")
+        return "Using SRU requires pytorch built with cuda."
 
     # Check 3.
     pattern = re.compile(".*cuda/lib.*")
     ld_path = os.getenv('LD_LIBRARY_PATH', "")
     if re.match(pattern, ld_path) is None:
-        if not abort:
-            return False
-        raise AssertionError("Using SRU requires setting cuda lib path, e.g. "
-                             "export LD_LIBRARY_PATH=/usr/local/cuda/lib64.")
+        return ("Using SRU requires setting cuda lib path, e.g. "
+                "export LD_LIBRARY_PATH=/usr/local/cuda/lib64.")
 
-    return True
+    return ""
 
 
 SRU_CODE = """
@@ -345,7 +333,19 @@ extern "C" {
 """
 
 
-if check_sru_requirement():
+SRU_FWD_FUNC = SRU_BWD_FUNC = SRU_BiFWD_FUNC = SRU_BiBWD_FUNC = None
+SRU_STREAM = None
+
+
+def load_sru_kernels():
+    """
+    Compile the cuda kernels of SRU_CODE, on the first call only, so that
+    importing this module stays cheap.
+    """
+    global SRU_FWD_FUNC, SRU_BWD_FUNC, SRU_BiFWD_FUNC, SRU_BiBWD_FUNC, \
+        SRU_STREAM
+    if SRU_FWD_FUNC is not None:
+        return
     from cupy.cuda import function
     from pynvrtc.compiler import Program
 
@@ -358,13 +358,13 @@ if check_sru_requirement():
     sru_mod = function.Module()
     sru_mod.load(bytes(sru_ptx.encode()))
 
-    SRU_FWD_FUNC = sru_mod.get_function('sru_fwd')
     SRU_BWD_FUNC = sru_mod.get_function('sru_bwd')
     SRU_BiFWD_FUNC = sru_mod.get_function('sru_bi_fwd')
     SRU_BiBWD_FUNC = sru_mod.get_function('sru_bi_bwd')
 
     stream = namedtuple('Stream', ['ptr'])
     SRU_STREAM = stream(ptr=torch.cuda.current_stream().cuda_stream)
+    SRU_FWD_FUNC = sru_mod.get_function('sru_fwd')
 
 
 class SRU_Compute(Function):
@@ -376,6 +376,33 @@ class SRU_Compute(Function):
         self.bidirectional = bidirectional
 
     def forward(self, u, x, bias, init=None, mask_h=None):
+        d = self.d_out
+        if u.is_cuda:
+            h, c = self._cuda_forward(u, x, bias, init, mask_h)
+        else:
+            h, c = self._cpu_forward(u, x, bias, init, mask_h)
+
+        self.save_for_backward(u, x, bias, init, mask_h)
+        self.intermediate = c
+        if x.dim() == 2:
+            last_hidden = c
+        elif self.bidirectional:
+            # -> directions x batch x dim
+            last_hidden = torch.stack((c[-1, :, :d], c[0, :, d:]))
+        else:
+            last_hidden = c[-1]
+        return h, last_hidden
+
+    def backward(self, grad_h, grad_last):
+        if self.bidirectional:
+            grad_last = torch.cat((grad_last[0], grad_last[1]), 1)
+        if grad_h.is_cuda:
+            return self._cuda_backward(grad_h, grad_last)
+        return self._cpu_backward(grad_h, grad_last)
+
+    def _cuda_forward(self, u, x, bias, init, mask_h):
+        check_sru_requirement(abort=True)
+        load_sru_kernels()
         bidir = 2 if self.bidirectional else 1
         length = x.size(0) if x.dim() == 3 else 1
         batch = x.size(-2)
@@ -409,20 +436,9 @@ class SRU_Compute(Function):
             stream=SRU_STREAM
         )
 
-        self.save_for_backward(u, x, bias, init, mask_h)
-        self.intermediate = c
-        if x.dim() == 2:
-            last_hidden = c
-        elif self.bidirectional:
-            # -> directions x batch x dim
-            last_hidden = torch.stack((c[-1, :, :d], c[0, :, d:]))
-        else:
-            last_hidden = c[-1]
-        return h, last_hidden
+        return h, c
 
-    def backward(self, grad_h, grad_last):
-        if self.bidirectional:
-            grad_last = torch.cat((grad_last[0], grad_last[1]), 1)
+    def _cuda_backward(self, grad_h, grad_last):
         bidir = 2 if self.bidirectional else 1
         u, x, bias, init, mask_h = self.saved_tensors
         c = self.intermediate
@@ -472,6 +488,125 @@ class SRU_Compute(Function):
         )
         return grad_u, grad_x, grad_bias.sum(1).view(-1), grad_init, None
 
+    def _cpu_gates(self, u, x, bias):
+        """
+        The projections `u` split for the recurrence, each
+        `[len x batch x directions*d_out]`, over all steps at once: the
+        candidate cell states, the forget and reset gates and the
+        highway inputs. They are in the order of the recurrence: see
+        `_flip_backward_direction`.
+        """
+        width = self.d_out * (2 if self.bidirectional else 1)
+        length = x.size(0) if x.dim() == 3 else 1
+        batch = x.size(-2)
+        k_ = u.size(-1) // width
+        u = u.contiguous().view(length, batch, width, k_)
+        bias = bias.view(2, width)
+        u0 = u[:, :, :, 0]
+        forget = torch.sigmoid(u[:, :, :, 1] + bias[0])
+        reset = torch.sigmoid(u[:, :, :, 2] + bias[1])
+        x_tilde = x.contiguous().view(length, batch, width) if k_ == 3 \
+            else u[:, :, :, 3]
+        return [self._flip_backward_direction(a)
+                for a in (u0, forget, reset, x_tilde)]
+
+    def _flip_backward_direction(self, a):
+        """
+        Reverse the backward direction of `a` `[len x batch x 2*d_out]`
+        in time, so that both directions run over the steps in the same
+        order. It is its own inverse.
+        """
+        if not self.bidirectional or a.size(0) == 1:
+            return a
+        d = self.d_out
+        reverse = torch.arange(a.size(0) - 1, -1, -1).long()
+        return torch.cat([a[:, :, :d], a[:, :, d:].index_select(0, reverse)],
+                         2)
+
+    def _activation(self, c):
+        if self.activation_type == 1:
+            return torch.tanh(c)
+        if self.activation_type == 2:
+            return c.clamp(min=0)
+        return c
+
+    def _cpu_forward(self, u, x, bias, init, mask_h):
+        """
+        `sru_fwd` and `sru_bi_fwd` on CPU: the gates are computed for all
+        steps at once, and only the elementwise recurrence of the cell
+        states loops over time, on every batch column and direction.
+        """
+        u0, forget, reset, x_tilde = self._cpu_gates(u, x, bias)
+        length, batch, width = u0.size()
+
+        # c_t = forget_t * c_{t-1} + (1 - forget_t) * u0_t
+        candidate = u0 - forget * u0
+        c = u0.new(length, batch, width)
+        cur = u0.new(batch, width).zero_() if init is None \
+            else init.contiguous().view(batch, width)
+        for t in range(length):
+            cur = torch.addcmul(candidate[t], forget[t], cur)
+            c[t] = cur
+
+        val = self._activation(c)
+        if mask_h is not None:
+            val = val * mask_h.view(batch, width)
+        h = (val - x_tilde) * reset + x_tilde
+        size = (length, batch, width) if x.dim() == 3 else (batch, width)
+        return (self._flip_backward_direction(h).view(*size),
+                self._flip_backward_direction(c).view(*size))
+
+    def _cpu_backward(self, grad_h, grad_last):
+        """ `sru_bwd` and `sru_bi_bwd` on CPU, see `_cpu_forward`. """
+        u, x, bias, init, mask_h = self.saved_tensors
+        u0, forget, reset, x_tilde = self._cpu_gates(u, x, bias)
+        length, batch, width = u0.size()
+        c = self._flip_backward_direction(
+            self.intermediate.contiguous().view(length, batch, width))
+        grad_h = self._flip_backward_direction(
+            grad_h.contiguous().view(length, batch, width))
+        mask = 1 if mask_h is None else mask_h.view(batch, width)
+
+        # h = (c - x) * reset + x
+        c_val = self._activation(c)
+        grad_x_tilde = grad_h * (1 - reset)
+        grad_reset = grad_h * (c_val * mask - x_tilde) * reset * (1 - reset)
+        if self.activation_type == 1:
+            grad_val = reset * (1 - c_val * c_val)
+        elif self.activation_type == 2:
+            grad_val = reset * c_val.gt(0).type_as(reset)
+        else:
+            grad_val = reset
+        grad_c = grad_h * mask * grad_val
+
+        # c = (c' - u0) * forget + u0
+        cur = grad_last.contiguous().view(batch, width)
+        for t in range(length - 1, -1, -1):
+            grad_c[t] += cur
+            cur = grad_c[t] * forget[t]
+        grad_init = cur
+
+        prev_c = init.contiguous().view(1, batch, width) if init is not None \
+            else c.new(1, batch, width).zero_()
+        if length > 1:
+            prev_c = torch.cat([prev_c, c[:-1]], 0)
+        grad_u0 = grad_c * (1 - forget)
+        grad_forget = grad_c * (prev_c - u0) * forget * (1 - forget)
+
+        grad_bias = torch.stack([grad_forget.view(-1, width).sum(0),
+                                 grad_reset.view(-1, width).sum(0)])
+        grad_u = [grad_u0, grad_forget, grad_reset]
+        k_ = u.size(-1) // width
+        if k_ == 4:
+            grad_u.append(grad_x_tilde)
+            grad_x = None
+        else:
+            grad_x = self._flip_backward_direction(grad_x_tilde) \
+                .contiguous().view(*x.size())
+        grad_u = self._flip_backward_direction(torch.stack(grad_u, 3)) \
+            .contiguous().view(*u.size())
+        return grad_u, grad_x, grad_bias.view(-1), grad_init, None
+
 
 class SRUCell(nn.Module):
     def __init__(self, n_in, n_out, dropout=0, rnn_dropout=0,
@@ -556,6 +691,8 @@ class SRU(nn.Module):
 
     This implementation is adpoted from the author of the paper:
     https://github.com/taolei87/sru/blob/master/cuda_functional.py.
+    On gpu it runs the cuda kernels (see `check_sru_requirement`), on
+    CPU their vectorized counterparts of `SRU_Compute`.
 
     Args:
       input_size (int): input to model
@@ -572,9 +709,6 @@ class SRU(nn.Module):
     def __init__(self, input_size, hidden_size,
                  num_layers=2, dropout=0, rnn_dropout=0,
                  bidirectional=False, use_tanh=1, use_relu=0):
-        # An entry check here, will catch on train side and translate side
-        # if requirements are not satisfied.
-        check_sru_requirement(abort=True)
         super(SRU, self).__init__()
         self.n_in = input_size
         self.n_out = hidden_size
@@ -633,3 +767,53 @@ class SRU(nn.Module):
             return prevx, fh
         else:
             return prevx
+
+
+def _reference_sru(u, x, bias, init, activation_type, d_out, bidirectional,
+                   mask_h=None):
+    """
+    Plain Python loop over the steps and directions of `SRU_Compute`,
+    to check its results: the hidden states and the last cell states.
+    """
+    width = d_out * (2 if bidirectional else 1)
+    k = u.size(-1) // width
+    u = u.view(x.size(0), x.size(1), width, k)
+    bias = bias.view(2, width)
+    activation = [lambda c: c, torch.tanh, lambda c: c.clamp(min=0)][
+        activation_type]
+    h, last = [], []
+    for direction in range(2 if bidirectional else 1):
+        cols = slice(direction * d_out, (direction + 1) * d_out)
+        steps = list(range(x.size(0)))
+        c = init[:, cols]
+        mask = 1 if mask_h is None else mask_h[:, cols]
+        h_dir = [None] * len(steps)
+        for t in (steps if direction == 0 else reversed(steps)):
+            forget = torch.sigmoid(u[t, :, cols, 1] + bias[0, cols])
+            reset = torch.sigmoid(u[t, :, cols, 2] + bias[1, cols])
+            c = (c - u[t, :, cols, 0]) * forget + u[t, :, cols, 0]
+            x_t = x[t, :, cols] if k == 3 else u[t, :, cols, 3]
+            h_dir[t] = (activation(c) * mask - x_t) * reset + x_t
+        h.append(torch.stack(h_dir))
+        last.append(c)
+    return torch.cat(h, 2), torch.stack(last) if bidirectional else last[0]
+
+
+if __name__ == "__main__":
+    # Check the CPU SRU_Compute against the Python loop.
+    for bidirectional in [False, True]:
+        d_out, width = 4, 8 if bidirectional else 4
+        x = torch.randn(6, 3, width).double().requires_grad_()
+        u = torch.randn(18, width * 3).double().requires_grad_()
+        bias = torch.randn(width * 2).double().requires_grad_()
+        init = torch.randn(3, width).double().requires_grad_()
+        grad_h = torch.randn(6, 3, width).double()
+        h, _ = SRU_Compute(1, d_out, bidirectional)(u, x, bias, init)
+        grads = torch.autograd.grad((h * grad_h).sum(), [u, x, bias, init])
+        ref_h, _ = _reference_sru(u, x, bias, init, 1, d_out,
+                                  bidirectional)
+        ref_grads = torch.autograd.grad((ref_h * grad_h).sum(),
+                                        [u, x, bias, init])
+        print("bidirectional=%s max error: %g" % (bidirectional, max(
+            float((a - b).abs().max())
+            for a, b in zip([h] + list(grads), [ref_h] + list(ref_grads)))))
@@ -4,11 +4,35 @@ import torch.cuda
 from onmt.Utils import get_logger
 
 
+def batch_inverse(matrices):
+    """
+    Inverse of each matrix of `matrices` `[batch x n x n]`: at once where
+    `torch.inverse` takes batches (pytorch >= 1.0), one matrix at a time
+    otherwise.
+    """
+    global _batched_inverse
+    if _batched_inverse is None:
+        try:
+            torch.inverse(torch.ones(1, 1, 1))
+            _batched_inverse = True
+        except RuntimeError:
+            _batched_inverse = False
+    if _batched_inverse:
+        return torch.inverse(matrices)
+    return torch.stack([matrix.inverse() for matrix in matrices])
+
+
+# Whether `torch.inverse` takes batches, once probed.
+_batched_inverse = None
+
+
 class MatrixTree(nn.Module):
     """Implementation of the matrix-tree theorem for computing marginals
     of non-projective dependency parsing. This attention layer is used
     in the paper "Learning Structured Text Representations."
 
+    The Laplacians of the whole batch `[batch x n x n]` are built and
+    inverted together, on the device of the input.
 
     :cite:`DBLP:journals/corr/LiuL17d`
     """
@@ -18,32 +42,33 @@ class MatrixTree(nn.Module):
         super(MatrixTree, self).__init__()
 
     def forward(self, input):
+        batch, n, _ = input.size()
+        eye = torch.eye(n).type_as(input)
+        diag_mask = eye.ne(0).unsqueeze(0).expand_as(input)
+
         laplacian = input.exp() + self.eps
-        output = input.clone()
-        for b in range(input.size(0)):
-            lap = laplacian[b].masked_fill(
-                torch.eye(input.size(1)).cuda().ne(0), 0)
-            lap = -lap + torch.diag(lap.sum(0))
-            # store roots on diagonal
-            lap[0] = input[b].diag().exp()
-            inv_laplacian = lap.inverse()
-
-            factor = inv_laplacian.diag().unsqueeze(1)\
-                                         .expand_as(input[b]).transpose(0, 1)
-            term1 = input[b].exp().mul(factor).clone()
-            term2 = input[b].exp().mul(inv_laplacian.transpose(0, 1)).clone()
-            term1[:, 0] = 0
-            term2[0] = 0
-            output[b] = term1 - term2
-            roots_output = input[b].diag().exp().mul(
-                inv_laplacian.transpose(0, 1)[0])
-            output[b] = output[b] + torch.diag(roots_output)
-        return output
+        lap = laplacian.masked_fill(diag_mask, 0)
+        lap = -lap + eye * lap.sum(1).unsqueeze(2)
+        # store roots on diagonal
+        roots = input.masked_select(diag_mask).view(batch, n).exp()
+        lap = torch.cat([roots.unsqueeze(1), lap[:, 1:]], 1)
+        inv_laplacian = batch_inverse(lap)
+        inv_laplacian_t = inv_laplacian.transpose(1, 2)
+
+        factor = inv_laplacian.masked_select(diag_mask).view(batch, 1, n)
+        term1 = input.exp().mul(factor)
+        term2 = input.exp().mul(inv_laplacian_t)
+        term1[:, :, 0] = 0
+        term2[:, 0] = 0
+        roots_output = roots.mul(inv_laplacian_t[:, 0])
+        return term1 - term2 + eye * roots_output.unsqueeze(2)
 
 
 if __name__ == "__main__":
     logger = get_logger('StructuredAttention.log')
     dtree = MatrixTree()
-    q = torch.rand(1, 5, 5).cuda()
+    q = torch.rand(1, 5, 5)
+    if torch.cuda.is_available():
+        q = q.cuda()
     marg = dtree.forward(q)
     logger.info(marg.sum(1))
@@ -169,7 +169,26 @@ class TransformerDecoderLayer(nn.Module):
         self.register_buffer('mask', mask)
 
     def forward(self, inputs, memory_bank, src_pad_mask, tgt_pad_mask,
-                previous_input=None):
+                previous_input=None, layer_cache=None):
+        """
+        Args:
+            inputs (`FloatTensor`): `[batch_size x tgt_len x model_dim]`
+            memory_bank (`FloatTensor`): `[batch_size x src_len x model_dim]`
+            src_pad_mask (`LongTensor`): `[batch_size x tgt_len x src_len]`
+            tgt_pad_mask (`LongTensor`): `[batch_size x tgt_len x tgt_len]`
+            previous_input (`FloatTensor`): normalized inputs of the
+                previous steps, recomputed with `inputs`.
+            layer_cache (dict): projected keys and values of the previous
+                steps, see :obj:`MultiHeadedAttention`. When given,
+                `previous_input` is not used.
+
+        Returns:
+            (`FloatTensor`, `FloatTensor`, `FloatTensor`):
+
+            * output `[batch_size x tgt_len x model_dim]`
+            * attn `[batch_size x tgt_len x src_len]`
+            * all_input `[batch_size x current_step x model_dim]`
+        """
         # Args Checks
         input_batch, input_len, _ = inputs.size()
         if previous_input is not None:
@@ -190,16 +209,23 @@ class TransformerDecoderLayer(nn.Module):
                                       :tgt_pad_mask.size(1)], 0)
         input_norm = self.layer_norm_1(inputs)
         all_input = input_norm
-        if previous_input is not None:
-            all_input = torch.cat((previous_input, input_norm), dim=1)
-            dec_mask = None
-        query, attn = self.self_attn(all_input, all_input, input_norm,
-                                     mask=dec_mask)
+        if layer_cache is not None:
+            query, attn = self.self_attn(input_norm, input_norm, input_norm,
+                                         layer_cache=layer_cache,
+                                         type="self")
+        else:
+            if previous_input is not None:
+                all_input = torch.cat((previous_input, input_norm), dim=1)
+                dec_mask = None
+            query, attn = self.self_attn(all_input, all_input, input_norm,
+                                         mask=dec_mask)
         query = self.drop(query) + inputs
 
         query_norm = self.layer_norm_2(query)
         mid, attn = self.context_attn(memory_bank, memory_bank, query_norm,
-                                      mask=src_pad_mask)
+                                      mask=src_pad_mask,
+                                      layer_cache=layer_cache,
+                                      type="context")
         output = self.feed_forward(self.drop(mid) + query)
 
         # CHECKS
@@ -278,6 +304,10 @@ class TransformerDecoder(nn.Module):
     def forward(self, tgt, memory_bank, state, memory_lengths=None):
         """
         See :obj:`onmt.modules.RNNDecoderBase.forward()`
+
+        When decoding one step at a time in evaluation mode, the projected
+        self-attention and context keys and values are cached in `state`
+        so that previous steps are not recomputed.
         """
         # CHECKS
         assert isinstance(state, TransformerDecoderState)
@@ -293,6 +323,18 @@ class TransformerDecoder(nn.Module):
         aeq(tgt_batch, memory_batch, src_batch, tgt_batch)
         aeq(memory_len, src_len)
 
+        # Incremental decoding: one step at a time, with a cache started
+        # at the first step.
+        cache = None
+        if not self.training and tgt_len == 1 and \
+                (state.cache is not None or state.previous_input is None):
+            cache = state.cache
+            if cache is None:
+                cache = [{} for _ in range(self.num_layers)]
+        step = None
+        if cache is not None and state.previous_input is not None:
+            step = state.previous_input.size(0)
+
         if state.previous_input is not None:
             tgt = torch.cat([state.previous_input, tgt], 0)
         # END CHECKS
@@ -304,9 +346,12 @@ class TransformerDecoder(nn.Module):
             attns["copy"] = []
 
         # Run the forward pass of the TransformerDecoder.
-        emb = self.embeddings(tgt)
-        if state.previous_input is not None:
-            emb = emb[state.previous_input.size(0):, ]
+        if cache is not None:
+            emb = self.embeddings(tgt[-1:], step=step or 0)
+        else:
+            emb = self.embeddings(tgt)
+            if state.previous_input is not None:
+                emb = emb[state.previous_input.size(0):, ]
         assert emb.dim() == 3  # len x batch x embedding_dim
 
         output = emb.transpose(0, 1).contiguous()
@@ -321,15 +366,20 @@ class TransformerDecoder(nn.Module):
         saved_inputs = []
         for i in range(self.num_layers):
             prev_layer_input = None
-            if state.previous_input is not None:
+            layer_cache = None
+            if cache is not None:
+                layer_cache = cache[i]
+            elif state.previous_input is not None:
                 prev_layer_input = state.previous_layer_inputs[i]
             output, attn, all_input \
                 = self.transformer_layers[i](output, src_memory_bank,
                                              src_pad_mask, tgt_pad_mask,
-                                             previous_input=prev_layer_input)
+                                             previous_input=prev_layer_input,
+                                             layer_cache=layer_cache)
             saved_inputs.append(all_input)
 
-        saved_inputs = torch.stack(saved_inputs)
+        saved_inputs = None if cache is not None \
+            else torch.stack(saved_inputs)
         output = self.layer_norm(output)
 
         # Process the result and update the attentions.
@@ -341,7 +391,7 @@ class TransformerDecoder(nn.Module):
             attns["copy"] = attn
 
         # Update the state.
-        state = state.update_state(tgt, saved_inputs)
+        state = state.update_state(tgt, saved_inputs, cache)
         return outputs, state, attns
 
     def init_decoder_state(self, src, memory_bank, enc_hidden):
@@ -358,6 +408,7 @@ class TransformerDecoderState(DecoderState):
         self.src = src
         self.previous_input = None
         self.previous_layer_inputs = None
+        self.cache = None
 
     @property
     def _all(self):
@@ -366,13 +417,28 @@ class TransformerDecoderState(DecoderState):
         """
         return (self.previous_input, self.previous_layer_inputs, self.src)
 
-    def update_state(self, input, previous_layer_inputs):
+    def update_state(self, input, previous_layer_inputs, cache=None):
         """ Called for every decoder forward pass. """
         state = TransformerDecoderState(self.src)
         state.previous_input = input
         state.previous_layer_inputs = previous_layer_inputs
+        state.cache = cache
         return state
 
     def repeat_beam_size_times(self, beam_size):
         """ Repeat beam_size times along batch dimension. """
         self.src = self.src.data.repeat(1, beam_size, 1)
+
+    def index_select(self, positions):
+        """ See :obj:`onmt.Models.DecoderState.index_select()` """
+        self.src = self.src.data.index_select(1, positions)
+        if self.previous_input is not None:
+            self.previous_input = \
+                self.previous_input.data.index_select(1, positions)
+        if self.previous_layer_inputs is not None:
+            self.previous_layer_inputs = \
+                self.previous_layer_inputs.data.index_select(1, positions)
+        if self.cache is not None:
+            for layer_cache in self.cache:
+                for key, value in layer_cache.items():
+                    layer_cache[key] = value.data.index_select(0, positions)
@@ -4,6 +4,8 @@ from onmt.modules.GlobalAttention import GlobalAttention
 from onmt.modules.ConvMultiStepAttention import ConvMultiStepAttention
 from onmt.modules.ImageEncoder import ImageEncoder
 from onmt.modules.AudioEncoder import AudioEncoder
+from onmt.modules.ChunkedLogSoftmax import ChunkedLogSoftmax, \
+    chunked_log_softmax
 from onmt.modules.CopyGenerator import CopyGenerator, CopyGeneratorLossCompute
 from onmt.modules.StructuredAttention import MatrixTree
 from onmt.modules.Transformer import \
@@ -17,10 +19,9 @@ from onmt.modules.WeightNorm import WeightNormConv2d
 from onmt.Models import EncoderBase, MeanEncoder, StdRNNDecoder, \
     RNNDecoderBase, InputFeedRNNDecoder, RNNEncoder, NMTModel
 
-from onmt.modules.SRU import check_sru_requirement
-can_use_sru = check_sru_requirement()
-if can_use_sru:
-    from onmt.modules.SRU import SRU
+# The cuda kernels of SRU are checked and loaded when it first runs on gpu,
+# see `check_sru_requirement`.
+from onmt.modules.SRU import SRU, check_sru_requirement
 
 
 # For flake8 compatibility.
@@ -33,7 +34,6 @@ __all__ = [EncoderBase, MeanEncoder, RNNDecoderBase, InputFeedRNNDecoder,
            TransformerEncoder, TransformerDecoder, Embeddings, Elementwise,
            MatrixTree, WeightNormConv2d, ConvMultiStepAttention,
            CNNEncoder, CNNDecoder, StackedLSTM, StackedGRU,
-           context_gate_factory, CopyGeneratorLossCompute, AudioEncoder]
-
-if can_use_sru:
-    __all__.extend([SRU, check_sru_requirement])
+           context_gate_factory, CopyGeneratorLossCompute, AudioEncoder,
+           ChunkedLogSoftmax, chunked_log_softmax,
+           SRU, check_sru_requirement]
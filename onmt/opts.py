@@ -1,5 +1,4 @@
 import argparse
-from onmt.modules.SRU import CheckSRU
 
 
 def model_opts(parser):
@@ -82,7 +81,6 @@ def model_opts(parser):
                        state and the first decoder state""")
     group.add_argument('-rnn_type', type=str, default='LSTM',
                        choices=['LSTM', 'GRU', 'SRU'],
-                       action=CheckSRU,
                        help="""The gate type to use in the RNNs""")
     # group.add_argument('-residual',   action="store_true",
     #                     help="Add residual connections between RNN layers.")
@@ -148,6 +146,16 @@ def preprocess_opts(parser):
                        If 0, the data will be handled as a whole. The unit
                        is in bytes. Optimal value should be multiples of
                        64 bytes.""")
+    group.add_argument('-data_format', default="pt", choices=["pt", "bin"],
+                       help="""Format of the preprocessed text data.
+                       pt: pickled datasets of torchtext examples.
+                       bin: flat arrays of token ids, memory-mapped at
+                       training time (no -dynamic_dict).""")
+    group.add_argument('-workers', type=int, default=1,
+                       help="""Number of processes that parse, filter and
+                       save the text shards and count the vocabulary. With
+                       -max_shard_size 0, the corpus is split in this many
+                       shards.""")
 
     # Dictionary options, for text corpus
 
@@ -225,6 +233,21 @@ def train_opts(parser):
     # GPU
     group.add_argument('-gpuid', default=[], nargs='+', type=int,
                        help="Use CUDA on the listed devices.")
+    group.add_argument('-world_size', type=int, default=1,
+                       help="""Number of processes of distributed
+                       training, over all nodes. If more than 1, one
+                       process is launched for each rank of -dist_ranks,
+                       on the matching device of -gpuid, or on CPU. Each
+                       process trains on its own training shards.""")
+    group.add_argument('-dist_ranks', default=[], nargs='+', type=int,
+                       help="""Ranks of the processes of this node.
+                       Defaults to all the ranks, on a single node.""")
+    group.add_argument('-dist_backend', default='gloo',
+                       choices=['gloo', 'nccl'],
+                       help="Backend of torch.distributed.")
+    group.add_argument('-dist_init_method', default='tcp://localhost:10000',
+                       help="""Init method of torch.distributed, e.g. the
+                       address of the rank 0 node.""")
 
     group.add_argument('-seed', type=int, default=-1,
                        help="""Random seed used for the experiments
@@ -268,9 +291,16 @@ def train_opts(parser):
     group.add_argument('-batch_size', type=int, default=64,
                        help='Maximum batch size for training')
     group.add_argument('-batch_type', default='sents',
-                       choices=["sents", "tokens"],
+                       choices=["sents", "tokens", "buckets"],
                        help="""Batch grouping for batch_size. Standard
-                               is sents. Tokens will do dynamic batching""")
+                               is sents. Tokens will do dynamic batching.
+                               Buckets groups examples of similar lengths
+                               into batches of at most batch_size src + tgt
+                               tokens, padding included.""")
+    group.add_argument('-batch_multiple', type=int, default=1,
+                       help="""With -batch_type buckets, round the number
+                       of sentences of a batch down to a multiple of
+                       this, e.g. 8 for fp16.""")
     group.add_argument('-normalization', default='sents',
                        choices=["sents", "tokens"],
                        help='Normalization method of the gradient.')
@@ -281,10 +311,19 @@ def train_opts(parser):
                        Recommended for Transformer.""")
     group.add_argument('-valid_batch_size', type=int, default=32,
                        help='Maximum batch size for validation')
+    group.add_argument('-prefetch', type=int, default=0,
+                       help="""Number of batches built ahead of the model in
+                       a background thread, loading of the next shard
+                       included. 0 builds them on the training thread.""")
     group.add_argument('-max_generator_batches', type=int, default=32,
                        help="""Maximum batches of words in a sequence to run
                         the generator on in parallel. Higher is faster, but
                         uses more memory.""")
+    group.add_argument('-generator_chunk_size', type=int, default=0,
+                       help="""Fuse the generator softmax with the loss and
+                       compute it over blocks of this many vocabulary
+                       columns, so that the [words x vocab] scores are
+                       never built. 0 computes the full scores.""")
     group.add_argument('-epochs', type=int, default=13,
                        help='Number of training epochs')
     group.add_argument('-optim', default='sgd',
@@ -380,8 +419,10 @@ def train_opts(parser):
 
 def translate_opts(parser):
     group = parser.add_argument_group('Model')
-    group.add_argument('-model', required=True,
-                       help='Path to model .pt file')
+    group.add_argument('-model', required=True, nargs='+',
+                       help="""Path to model .pt file, or several paths to
+                       decode with an ensemble of models that share their
+                       vocabularies.""")
 
     group = parser.add_argument_group('Data')
     group.add_argument('-data_type', default="text",
@@ -389,14 +430,15 @@ def translate_opts(parser):
 
     group.add_argument('-src',   required=True,
                        help="""Source sequence to decode (one line per
-                       sequence)""")
+                       sequence), or - to stream it from stdin""")
     group.add_argument('-src_dir',   default="",
                        help='Source directory for image or audio files')
     group.add_argument('-tgt',
                        help='True target sequence (optional)')
     group.add_argument('-output', default='pred.txt',
                        help="""Path to output the predictions (each line will
-                       be the decoded sequence""")
+                       be the decoded sequence), or - for stdout, which
+                       has no -report_bleu and -report_rouge""")
     group.add_argument('-report_bleu', action='store_true',
                        help="""Report bleu score after translation,
                        call tools/multi-bleu.perl on command line""")
@@ -436,6 +478,16 @@ def translate_opts(parser):
                         (higher = longer generation)""")
     group.add_argument('-beta', type=float, default=-0.,
                        help="""Coverage penalty parameter""")
+    group.add_argument('-random_sampling_topk', type=int, default=1,
+                       help="""With -beam_size 1, sample each word from the
+                       k most likely ones, or from the whole vocabulary
+                       with -1. 1 is greedy decoding.""")
+    group.add_argument('-random_sampling_temp', type=float, default=1.0,
+                       help="""Temperature of the random sampling: higher
+                       is more random.""")
+    group.add_argument('-seed', type=int, default=-1,
+                       help="""Random seed of the sampling, unseeded if
+                       negative.""")
     group.add_argument('-block_ngram_repeat', type=int, default=0,
                        help='Block repetition of ngrams during decoding.')
     group.add_argument('-ignore_when_blocking', nargs='+', type=str,
@@ -458,6 +510,10 @@ def translate_opts(parser):
                        help="Output logs to a file under this path.")
     group.add_argument('-attn_debug', action="store_true",
                        help='Print best attn for each word')
+    group.add_argument('-report_time', action="store_true",
+                       help="""Report the translation speed and, for an
+                       ensemble, the share of the time spent in each
+                       model.""")
     group.add_argument('-dump_beam', type=str, default="",
                        help='File to dump beam information to.')
     group.add_argument('-n_best', type=int, default=1,
@@ -467,6 +523,32 @@ def translate_opts(parser):
     group = parser.add_argument_group('Efficiency')
     group.add_argument('-batch_size', type=int, default=30,
                        help='Batch size')
+    group.add_argument('-batch_type', default='sents',
+                       choices=["sents", "tokens"],
+                       help="""Batch grouping for batch_size. With tokens,
+                       batch_size is the number of padded source (and
+                       gold target) tokens of a batch.""")
+    group.add_argument('-sort_by_length', action='store_true',
+                       help="""Translate the whole input sorted by source
+                       length, which reduces padding. With -batch_type
+                       tokens, batches are cut from length buckets. The
+                       output keeps the order of the input.""")
+    group.add_argument('-stream', action='store_true',
+                       help="""Read and translate the input window by
+                       window, each sorted by length, writing the
+                       translations in input order as they are done.
+                       Memory does not depend on the input size. Text
+                       only, without -tgt. Implied by -src -.""")
+    group.add_argument('-stream_window', type=int, default=1000,
+                       help="""Maximum number of lines translated together
+                       with -stream.""")
+    group.add_argument('-workers', type=int, default=1,
+                       help="""Number of processes translating windows of
+                       the input on CPU, see -stream, which this implies.
+                       They share the weights of the model loaded once.""")
+    group.add_argument('-worker_threads', type=int, default=0,
+                       help="""Torch threads of each -workers process. By
+                       default the cores are divided among the workers.""")
     group.add_argument('-gpu', type=int, default=-1,
                        help="Device to run on")
 
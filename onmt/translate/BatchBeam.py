@@ -0,0 +1,289 @@
+from __future__ import division
+import torch
+
+from onmt.Utils import sequence_mask
+from onmt.translate.Beam import NGramBlocker
+
+
+class BatchBeam(object):
+    """
+    Tensorized beam search over a whole batch of sentences.
+
+    Unlike :obj:`Beam`, which is instantiated once per sentence, a
+    `BatchBeam` keeps the scores, back-pointers, partial hypotheses and
+    end-of-sentence flags of every sentence in flat `[batch * beam]`
+    tensors. Rows are laid out batch-major: hypothesis `k` of sentence
+    `b` lives in row `b * size + k`. One step is a single topk over
+    `[batch x (beam * words)]` and the decoder state is reordered with a
+    single `index_select` on :obj:`get_current_origin()`.
+
+    Sentences are dropped from the search as soon as they are done, so
+    the live batch shrinks over time. `batch_offset` maps each live
+    sentence back to its position in the original batch and
+    :obj:`get_alive_rows()` tells the caller which rows to keep in the
+    encoder outputs.
+
+    For a given :obj:`GNMTGlobalScorer` the translations are the same as
+    the ones produced by one :obj:`Beam` per sentence.
+
+    Args:
+       size (int): beam size
+       batch_size (int): number of sentences
+       pad, bos, eos (int): indices of padding, beginning, and ending.
+       n_best (int): nbest size to use
+       cuda (bool): use gpu
+       global_scorer (:obj:`GlobalScorer`)
+       memory_lengths (`LongTensor`): source lengths `[batch]`, used to
+          trim attention and to ignore padding in the coverage penalty.
+    """
+
+    def __init__(self, size, batch_size, pad, bos, eos,
+                 n_best=1, cuda=False,
+                 global_scorer=None,
+                 min_length=0,
+                 stepwise_penalty=False,
+                 block_ngram_repeat=0,
+                 exclusion_tokens=set(),
+                 memory_lengths=None):
+
+        self.size = size
+        self.batch_size = batch_size
+        self.tt = torch.cuda if cuda else torch
+
+        # The score for each live hypothesis, `[batch * beam]`.
+        self.scores = self.tt.FloatTensor(batch_size * size).zero_()
+
+        # The backpointers at each time-step, as absolute row indices.
+        self.prev_ks = []
+
+        # Original batch position of each live sentence.
+        self.batch_offset = self.tt.LongTensor(range(batch_size))
+        self._alive_rows = None
+
+        # The live hypotheses, `[batch * beam x len]`. Only the first
+        # hypothesis of each sentence starts with BOS.
+        self.alive_seq = self.tt.LongTensor(batch_size, size).fill_(pad)
+        self.alive_seq[:, 0] = bos
+        self.alive_seq = self.alive_seq.view(-1, 1)
+
+        # The attentions of the live hypotheses, `[len x batch * beam x
+        # src_len]`.
+        self.alive_attn = None
+
+        # Has EOS topped the beam yet, `[live batch]`.
+        self._eos = eos
+        self.eos_top = self.tt.ByteTensor(batch_size).zero_()
+
+        # (score, hypothesis, attention) triples for finished, per original
+        # sentence.
+        self.finished = [[] for _ in range(batch_size)]
+        self.n_best = n_best
+
+        # Information for global scoring.
+        self.global_scorer = global_scorer
+        self.global_state = {}
+
+        # Source lengths and padding mask of each row.
+        self.memory_lengths = None
+        self._src_pad_mask = None
+        if memory_lengths is not None:
+            self.memory_lengths = memory_lengths.view(-1, 1) \
+                .repeat(1, size).view(-1)
+            self._src_pad_mask = 1 - sequence_mask(self.memory_lengths)
+
+        # Minimum prediction length
+        self.min_length = min_length
+
+        # Apply Penalty at every step
+        self.stepwise_penalty = stepwise_penalty
+        self.block_ngram_repeat = block_ngram_repeat
+        self.exclusion_tokens = exclusion_tokens
+        self.ngram_blocker = NGramBlocker(block_ngram_repeat,
+                                          exclusion_tokens)
+
+    @property
+    def next_ys(self):
+        "The outputs at each time-step, `len x [batch * beam]`."
+        return self.alive_seq.t()
+
+    @property
+    def attn(self):
+        "The attentions at each time-step, `len x [batch * beam x src_len]`."
+        return self.alive_attn
+
+    def get_current_state(self):
+        "Get the outputs for the current timestep, `[batch * beam]`."
+        return self.alive_seq[:, -1]
+
+    def get_current_origin(self):
+        "Get the backpointers for the current timestep, `[batch * beam]`."
+        return self.prev_ks[-1]
+
+    def get_alive_rows(self):
+        """
+        Rows of the previous step that belong to sentences still being
+        decoded, or None if no sentence was dropped at the last step.
+        """
+        return self._alive_rows
+
+    def get_tile_index(self):
+        """
+        Row indices repeating each sentence `size` times, to expand the
+        encoder outputs and the decoder state to the beam layout.
+        """
+        return torch.arange(0, self.batch_size).type_as(self.alive_seq) \
+            .view(-1, 1).repeat(1, self.size).view(-1)
+
+    def advance(self, word_probs, attn_out):
+        """
+        Given prob over words for every live hypothesis and attention
+        `attn_out`: Compute and update the beam search of every sentence.
+
+        Parameters:
+
+        * `word_probs`- probs of advancing from the last step
+          `[batch * beam x words]`
+        * `attn_out`- attention at the last step `[batch * beam x src_len]`
+        """
+        num_words = word_probs.size(1)
+        live_size = self.batch_offset.size(0)
+        if self._src_pad_mask is not None:
+            attn_out = attn_out.masked_fill(
+                self._src_pad_mask[:, :attn_out.size(1)], 0)
+        if self.stepwise_penalty:
+            self.global_scorer.update_score(self, attn_out)
+        # force the output to be longer than self.min_length
+        cur_len = len(self.next_ys)
+        if cur_len < self.min_length:
+            word_probs[:, self._eos] = -1e20
+        # Sum the previous scores.
+        if len(self.prev_ks) > 0:
+            beam_scores = word_probs + \
+                self.scores.unsqueeze(1).expand_as(word_probs)
+            # Don't let EOS have children.
+            eos_rows = self.get_current_state().eq(self._eos)
+            beam_scores.masked_fill_(
+                eos_rows.unsqueeze(1).expand_as(beam_scores), -1e20)
+
+            # Block ngram repeats
+            if self.block_ngram_repeat > 0:
+                blocked = self.ngram_blocker.update(
+                    self.get_current_origin(), self.get_current_state(),
+                    num_words)
+                beam_scores.masked_fill_(
+                    blocked.unsqueeze(1).expand_as(beam_scores), -10e20)
+            flat_beam_scores = beam_scores.view(live_size, -1)
+        else:
+            # Only the first hypothesis of each sentence is live.
+            flat_beam_scores = word_probs.view(
+                live_size, self.size, num_words)[:, 0]
+        best_scores, best_scores_id = flat_beam_scores.topk(self.size, 1,
+                                                            True, True)
+
+        # best_scores_id is flattened beam x word array, so calculate which
+        # word and beam each score came from
+        prev_k = best_scores_id // num_words
+        next_y = best_scores_id - prev_k * num_words
+        row_offset = torch.arange(0, live_size) \
+            .type_as(prev_k).unsqueeze(1) * self.size
+        select_indices = (prev_k + row_offset).view(-1)
+
+        self.scores = best_scores.view(-1)
+        self.prev_ks.append(select_indices)
+        self.alive_seq = torch.cat(
+            [self.alive_seq.index_select(0, select_indices),
+             next_y.view(-1, 1)], 1)
+        attn_out = attn_out.index_select(0, select_indices).unsqueeze(0)
+        if self.alive_attn is None:
+            self.alive_attn = attn_out
+        else:
+            self.alive_attn = torch.cat(
+                [self.alive_attn.index_select(1, select_indices), attn_out],
+                0)
+        if len(self.prev_ks) == 1 and self._src_pad_mask is not None:
+            # Padded source positions start with a coverage of exactly one,
+            # which leaves every coverage penalty unchanged.
+            self.global_state["coverage"] = \
+                self._src_pad_mask[:, :attn_out.size(2)].type_as(attn_out)
+        self.global_scorer.update_global_state(self)
+
+        eos_rows = self.get_current_state().eq(self._eos).nonzero().view(-1)
+        if eos_rows.numel() > 0:
+            global_scores = self.global_scorer.score(self,
+                                                     self.scores.clone())
+            for i in eos_rows.tolist():
+                self._add_finished(i, global_scores[i])
+
+        # End condition is when top-of-beam is EOS and no global score.
+        top_rows = self.get_current_state().view(-1, self.size)[:, 0]
+        self.eos_top |= top_rows.eq(self._eos)
+
+        self._drop_finished()
+
+    def done(self):
+        "True when every sentence of the batch is done."
+        return self.batch_offset.numel() == 0
+
+    def _drop_finished(self):
+        """
+        Remove the sentences that are done from every live tensor and from
+        the backpointers of the last step.
+        """
+        self._alive_rows = None
+        n_finished = self.tt.LongTensor(
+            [len(self.finished[b]) for b in self.batch_offset.tolist()])
+        alive = self.eos_top.eq(0) | n_finished.lt(self.n_best)
+        if alive.all():
+            return
+        alive_sents = alive.nonzero().view(-1)
+        self.batch_offset = self.batch_offset.index_select(0, alive_sents)
+        self.eos_top = self.eos_top.index_select(0, alive_sents)
+        if alive_sents.numel() == 0:
+            return
+
+        alive_rows = alive.view(-1, 1).repeat(1, self.size).view(-1) \
+            .nonzero().view(-1)
+        self._alive_rows = alive_rows
+        self.prev_ks[-1] = self.prev_ks[-1].index_select(0, alive_rows)
+        self.scores = self.scores.index_select(0, alive_rows)
+        self.alive_seq = self.alive_seq.index_select(0, alive_rows)
+        self.alive_attn = self.alive_attn.index_select(1, alive_rows)
+        for key, state in self.global_state.items():
+            self.global_state[key] = state.index_select(0, alive_rows)
+        if self.memory_lengths is not None:
+            self.memory_lengths = \
+                self.memory_lengths.index_select(0, alive_rows)
+            self._src_pad_mask = \
+                self._src_pad_mask.index_select(0, alive_rows)
+
+    def sort_finished(self, b, minimum=None):
+        """
+        Sort the finished hypotheses of sentence `b`.
+
+        Returns:
+            (list, list): the scores and the (hypothesis, attention) pairs.
+        """
+        finished = self.finished[b]
+        if minimum is not None and len(finished) < minimum:
+            # Add from beam until we have minimum outputs.
+            global_scores = self.global_scorer.score(self,
+                                                     self.scores.clone())
+            live_b = self.batch_offset.tolist().index(b)
+            i = 0
+            while len(finished) < minimum:
+                row = live_b * self.size + i
+                self._add_finished(row, global_scores[row])
+                i += 1
+
+        finished.sort(key=lambda a: -a[0])
+        scores = [sc for sc, _, _ in finished]
+        hyps = [(hyp, attn) for _, hyp, attn in finished]
+        return scores, hyps
+
+    def _add_finished(self, row, score):
+        b = int(self.batch_offset[row // self.size])
+        hyp = self.alive_seq[row, 1:].tolist()
+        attn = self.alive_attn[:, row]
+        if self.memory_lengths is not None:
+            attn = attn[:, :self.memory_lengths[row]]
+        self.finished[b].append((score, hyp, attn.clone()))
@@ -62,6 +62,8 @@ class Beam(object):
         self.stepwise_penalty = stepwise_penalty
         self.block_ngram_repeat = block_ngram_repeat
         self.exclusion_tokens = exclusion_tokens
+        self.ngram_blocker = NGramBlocker(block_ngram_repeat,
+                                          exclusion_tokens)
 
     def get_current_state(self):
         "Get the outputs for the current timestep."
@@ -102,24 +104,11 @@ class Beam(object):
 
             # Block ngram repeats
             if self.block_ngram_repeat > 0:
-                ngrams = []
-                le = len(self.next_ys)
-                for j in range(self.next_ys[-1].size(0)):
-                    hyp, _ = self.get_hyp(le - 1, j)
-                    ngrams = set()
-                    fail = False
-                    gram = []
-                    for i in range(le - 1):
-                        # Last n tokens, n = block_ngram_repeat
-                        gram = (gram + [hyp[i]])[-self.block_ngram_repeat:]
-                        # Skip the blocking if it is in the exclusion list
-                        if set(gram) & self.exclusion_tokens:
-                            continue
-                        if tuple(gram) in ngrams:
-                            fail = True
-                        ngrams.add(tuple(gram))
-                    if fail:
-                        beam_scores[j] = -10e20
+                blocked = self.ngram_blocker.update(
+                    self.get_current_origin(), self.get_current_state(),
+                    num_words)
+                beam_scores.masked_fill_(
+                    blocked.unsqueeze(1).expand_as(beam_scores), -10e20)
         else:
             beam_scores = word_probs[0]
         flat_beam_scores = beam_scores.view(-1)
@@ -137,9 +126,12 @@ class Beam(object):
         self.attn.append(attn_out.index_select(0, prev_k))
         self.global_scorer.update_global_state(self)
 
+        global_scores = None
         for i in range(self.next_ys[-1].size(0)):
             if self.next_ys[-1][i] == self._eos:
-                global_scores = self.global_scorer.score(self, self.scores)
+                if global_scores is None:
+                    global_scores = self.global_scorer.score(
+                        self, self.scores.clone())
                 s = global_scores[i]
                 self.finished.append((s, len(self.next_ys) - 1, i))
 
@@ -155,8 +147,9 @@ class Beam(object):
         if minimum is not None:
             i = 0
             # Add from beam until we have minimum outputs.
+            global_scores = self.global_scorer.score(self,
+                                                     self.scores.clone())
             while len(self.finished) < minimum:
-                global_scores = self.global_scorer.score(self, self.scores)
                 s = global_scores[i]
                 self.finished.append((s, len(self.next_ys) - 1, i))
                 i += 1
@@ -178,6 +171,89 @@ class Beam(object):
         return hyp[::-1], torch.stack(attn[::-1])
 
 
+class NGramBlocker(object):
+    """
+    Incremental n-gram repeat blocking for beam search.
+
+    Follows every hypothesis as the beam is extended: its last `n`
+    tokens, the n-grams it contains and whether one of them is
+    repeated. At each step the history is reordered with the
+    back-pointers and only the newest n-gram is compared with it, which
+    is a single tensor operation for the whole beam.
+
+    An n-gram is encoded as a number in base `num_words`, which is exact
+    as long as `num_words ** n` fits in 64 bits and a hash otherwise.
+
+    Args:
+       n (int): size of the n-grams not to repeat
+       exclusion_tokens (set): n-grams with one of these tokens are
+          never blocked
+    """
+
+    def __init__(self, n, exclusion_tokens=set()):
+        self.n = n
+        self.exclusion_tokens = exclusion_tokens
+        self._excluded = None
+        # Last n tokens, `[hyps x n]`.
+        self.recent = None
+        # Codes of the n-grams seen and whether they count, `[hyps x
+        # n-grams]`.
+        self.history = None
+        self.history_valid = None
+        # Does the hypothesis repeat an n-gram, `[hyps]`.
+        self.blocked = None
+
+    def update(self, origin, tokens, num_words):
+        """
+        Extend the hypotheses: hypothesis `i` is now hypothesis
+        `origin[i]` of the last call followed by `tokens[i]`.
+
+        Returns:
+            `ByteTensor` `[hyps]`: the hypotheses that repeat an n-gram.
+        """
+        if self.recent is None:
+            self.recent = tokens.unsqueeze(1)
+            self.blocked = tokens.new(tokens.size()).zero_().byte()
+        else:
+            recent = self.recent.index_select(0, origin)
+            recent = recent[:, max(0, recent.size(1) + 1 - self.n):]
+            self.recent = torch.cat([recent, tokens.unsqueeze(1)], 1)
+            self.blocked = self.blocked.index_select(0, origin)
+            if self.history is not None:
+                self.history = self.history.index_select(0, origin)
+                self.history_valid = \
+                    self.history_valid.index_select(0, origin)
+        if self.recent.size(1) < self.n:
+            return self.blocked
+
+        code = self.recent[:, 0].clone()
+        for j in range(1, self.n):
+            code = code * num_words + self.recent[:, j]
+        code = code.unsqueeze(1)
+        valid = 1 - self._is_excluded(self.recent, num_words)
+
+        if self.history is not None:
+            repeat = (self.history.eq(code) & self.history_valid) \
+                .max(1)[0] & valid.squeeze(1)
+            self.blocked |= repeat
+            self.history = torch.cat([self.history, code], 1)
+            self.history_valid = torch.cat([self.history_valid, valid], 1)
+        else:
+            self.history = code
+            self.history_valid = valid
+        return self.blocked
+
+    def _is_excluded(self, grams, num_words):
+        """ `[hyps x 1]`, does the n-gram hold an excluded token. """
+        if self._excluded is None:
+            self._excluded = grams.new(num_words).zero_().byte()
+            if self.exclusion_tokens:
+                self._excluded.index_fill_(
+                    0, grams.new(list(self.exclusion_tokens)), 1)
+        return self._excluded.index_select(0, grams.view(-1)) \
+            .view_as(grams).max(1, keepdim=True)[0]
+
+
 class GNMTGlobalScorer(object):
     """
     NMT re-ranking score from
@@ -200,16 +276,15 @@ class GNMTGlobalScorer(object):
 
     def score(self, beam, logprobs):
         """
-        Rescores a prediction based on penalty functions
+        Rescores a prediction based on penalty functions. The coverage
+        penalty is the one kept in `beam.global_state`, so every
+        hypothesis of the beam is scored at once.
         """
         normalized_probs = self.length_penalty(beam,
                                                logprobs,
                                                self.alpha)
         if not beam.stepwise_penalty:
-            penalty = self.cov_penalty(beam,
-                                       beam.global_state["coverage"],
-                                       self.beta)
-            normalized_probs -= penalty
+            normalized_probs -= beam.global_state["cov_penalty"]
 
         return normalized_probs
 
@@ -223,20 +298,33 @@ class GNMTGlobalScorer(object):
                                        beam.global_state["coverage"] + attn,
                                        self.beta)
             beam.scores.sub_(penalty)
+            # The penalty of the coverage after this step, before the
+            # hypotheses are reordered.
+            beam.global_state["next_penalty"] = penalty
 
     def update_global_state(self, beam):
-        "Keeps the coverage vector as sum of attentions"
-        if len(beam.prev_ks) == 1:
-            beam.global_state["prev_penalty"] = beam.scores.clone().fill_(0.0)
-            beam.global_state["coverage"] = beam.attn[-1]
-            self.cov_total = beam.attn[-1].sum(1)
+        """
+        Keeps the coverage vector as sum of attentions, and its penalty,
+        for the hypotheses after the last step. A coverage already in
+        `beam.global_state` before the first step is where it starts.
+        """
+        state = beam.global_state
+        prev_k = beam.prev_ks[-1]
+        if "coverage" not in state:
+            state["coverage"] = beam.attn[-1]
+        else:
+            state["coverage"] = state["coverage"].index_select(0, prev_k) \
+                .add(beam.attn[-1])
+
+        if "next_penalty" in state:
+            # Computed by update_score on the same coverage.
+            state["cov_penalty"] = \
+                state.pop("next_penalty").index_select(0, prev_k)
         else:
-            self.cov_total += torch.min(beam.attn[-1],
-                                        beam.global_state['coverage']).sum(1)
-            beam.global_state["coverage"] = beam.global_state["coverage"] \
-                .index_select(0, beam.prev_ks[-1]).add(beam.attn[-1])
-
-            prev_penalty = self.cov_penalty(beam,
-                                            beam.global_state["coverage"],
-                                            self.beta)
-            beam.global_state["prev_penalty"] = prev_penalty
+            state["cov_penalty"] = self.cov_penalty(beam, state["coverage"],
+                                                    self.beta)
+        if beam.stepwise_penalty:
+            if len(beam.prev_ks) == 1:
+                state["prev_penalty"] = beam.scores.clone().fill_(0.0)
+            else:
+                state["prev_penalty"] = state["cov_penalty"]
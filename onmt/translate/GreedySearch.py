@@ -0,0 +1,163 @@
+from __future__ import division
+import torch
+import torch.nn.functional as F
+
+
+class GreedySearch(object):
+    """
+    Greedy or random sampling decoding of a batch of sentences.
+
+    Where :obj:`BatchBeam` keeps `[batch * beam]` hypotheses and their
+    back-pointers, a `GreedySearch` keeps one hypothesis per sentence: the
+    tokens so far `[batch x len]`, their log-prob `[batch]` and a finished
+    mask. Each step picks the argmax of the scores, or samples from the
+    `sampling_topk` best words with temperature `sampling_temp`, and
+    the finished sentences are dropped from the batch as in
+    :obj:`BatchBeam`, whose interface it follows.
+
+    The scores are the log-probs of the translations: the length and
+    coverage penalties of a :obj:`GNMTGlobalScorer` only rerank beams.
+
+    Args:
+       batch_size (int): number of sentences
+       pad, bos, eos (int): indices of padding, beginning, and ending.
+       cuda (bool): use gpu
+       min_length (int): minimum prediction length
+       sampling_topk (int): 1 for greedy decoding, k > 1 to sample from
+          the k best words, -1 to sample from the whole vocabulary.
+       sampling_temp (float): temperature of the sampling distribution.
+       memory_lengths (`LongTensor`): source lengths `[batch]`, used to
+          trim attention.
+    """
+
+    def __init__(self, batch_size, pad, bos, eos, cuda=False,
+                 min_length=0, sampling_topk=1, sampling_temp=1.0,
+                 memory_lengths=None):
+
+        self.size = 1
+        self.batch_size = batch_size
+        self.tt = torch.cuda if cuda else torch
+        self.min_length = min_length
+        self.sampling_topk = sampling_topk
+        self.sampling_temp = sampling_temp
+        self._eos = eos
+
+        # Log-prob of each live hypothesis, `[batch]`.
+        self.scores = self.tt.FloatTensor(batch_size).zero_()
+
+        # Original batch position of each live sentence.
+        self.batch_offset = self.tt.LongTensor(range(batch_size))
+        self._alive_rows = None
+
+        # The live hypotheses `[batch x len]` and their attentions
+        # `[len x batch x src_len]`.
+        self.alive_seq = self.tt.LongTensor(batch_size, 1).fill_(bos)
+        self.alive_attn = None
+        self.memory_lengths = memory_lengths
+
+        # (score, hypothesis, attention) of each original sentence.
+        self.finished = [[] for _ in range(batch_size)]
+
+    def get_current_state(self):
+        "Get the outputs for the current timestep, `[batch]`."
+        return self.alive_seq[:, -1]
+
+    def get_current_origin(self):
+        """
+        Rows of the previous step to keep in the decoder state, or None
+        if no sentence was dropped at the last step.
+        """
+        return self._alive_rows
+
+    def get_alive_rows(self):
+        """
+        Rows of the previous step that belong to sentences still being
+        decoded, or None if no sentence was dropped at the last step.
+        """
+        return self._alive_rows
+
+    def get_tile_index(self):
+        "Row of each sentence: the batch is not expanded."
+        return torch.arange(0, self.batch_size).type_as(self.alive_seq)
+
+    def advance(self, word_probs, attn_out):
+        """
+        Pick the next word of every live sentence.
+
+        Parameters:
+
+        * `word_probs`- log-probs of the next word `[batch x words]`
+        * `attn_out`- attention at the last step `[batch x src_len]`
+        """
+        if self.alive_seq.size(1) < self.min_length:
+            word_probs[:, self._eos] = -1e20
+
+        if self.sampling_topk == 1:
+            best_scores, next_y = word_probs.max(1)
+        else:
+            next_y = self._sample(word_probs)
+            best_scores = word_probs.gather(1, next_y.view(-1, 1)).view(-1)
+
+        self.scores += best_scores
+        self.alive_seq = torch.cat([self.alive_seq, next_y.view(-1, 1)], 1)
+        attn_out = attn_out.unsqueeze(0)
+        if self.alive_attn is None:
+            self.alive_attn = attn_out
+        else:
+            self.alive_attn = torch.cat([self.alive_attn, attn_out], 0)
+
+        finished = next_y.eq(self._eos)
+        for i in finished.nonzero().view(-1).tolist():
+            self._add_finished(i)
+        self._drop_finished(finished)
+
+    def _sample(self, word_probs):
+        """ Sample a word for each row of `word_probs` `[batch x words]`. """
+        logits = word_probs / self.sampling_temp
+        if self.sampling_topk > 0:
+            kth_best = logits.topk(self.sampling_topk, 1)[0][:, -1:]
+            logits = logits.masked_fill(logits < kth_best, -float('inf'))
+        return torch.multinomial(F.softmax(logits, dim=1), 1).view(-1)
+
+    def done(self):
+        "True when every sentence of the batch is done."
+        return self.batch_offset.numel() == 0
+
+    def _drop_finished(self, finished):
+        self._alive_rows = None
+        if not finished.any():
+            return
+        alive_rows = finished.eq(0).nonzero().view(-1)
+        self.batch_offset = self.batch_offset.index_select(0, alive_rows)
+        if alive_rows.numel() == 0:
+            return
+        self._alive_rows = alive_rows
+        self.scores = self.scores.index_select(0, alive_rows)
+        self.alive_seq = self.alive_seq.index_select(0, alive_rows)
+        self.alive_attn = self.alive_attn.index_select(1, alive_rows)
+        if self.memory_lengths is not None:
+            self.memory_lengths = \
+                self.memory_lengths.index_select(0, alive_rows)
+
+    def sort_finished(self, b, minimum=None):
+        """
+        The translation of sentence `b`, or its hypothesis so far if it
+        is still live.
+
+        Returns:
+            (list, list): the scores and the (hypothesis, attention) pairs.
+        """
+        finished = self.finished[b]
+        if minimum is not None and not finished:
+            self._add_finished(self.batch_offset.tolist().index(b))
+        scores = [sc for sc, _, _ in finished]
+        hyps = [(hyp, attn) for _, hyp, attn in finished]
+        return scores, hyps
+
+    def _add_finished(self, row):
+        b = int(self.batch_offset[row])
+        hyp = self.alive_seq[row, 1:].tolist()
+        attn = self.alive_attn[:, row]
+        if self.memory_lengths is not None:
+            attn = attn[:, :self.memory_lengths[row]]
+        self.finished[b].append((float(self.scores[row]), hyp, attn.clone()))
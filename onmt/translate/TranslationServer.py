@@ -5,9 +5,9 @@ import argparse
 import torch
 import io
 import time
-import codecs
 import json
 import threading
+import traceback
 
 from onmt.translate.Translator import make_translator
 
@@ -46,6 +46,33 @@ class ServerModelError(Exception):
     pass
 
 
+class ServerRequest:
+    def __init__(self, segments):
+        """A set of segments waiting to be translated by the scheduler of
+           a `ServerModel`
+
+            Args:
+                segments: (list) tokenized segments (str) to translate
+        """
+        self.segments = segments
+        self.results = [None] * len(segments)
+        self.scores = [None] * len(segments)
+        self.remaining = len(segments)
+        self.error = None
+        self.done = threading.Event()
+
+    def set_result(self, i, result, score):
+        self.results[i] = result
+        self.scores[i] = score
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.done.set()
+
+    def set_error(self, error):
+        self.error = error
+        self.done.set()
+
+
 class TranslationServer():
     def __init__(self):
         self.models = {}
@@ -67,7 +94,10 @@ class TranslationServer():
                       'load': conf.get('load', None),
                       'tokenizer_opt': conf.get('tokenizer', None),
                       'on_timeout': conf.get('on_timeout', None),
-                      'model_root': conf.get('model_root', self.models_root)
+                      'model_root': conf.get('model_root', self.models_root),
+                      'max_wait': conf.get('max_wait', None),
+                      'max_batch_tokens': conf.get('max_batch_tokens', None),
+                      'request_timeout': conf.get('request_timeout', None)
                       }
             kwargs = {k: v for (k, v) in kwargs.items() if v is not None}
             model_id = conf.get("id", None)
@@ -148,7 +178,9 @@ class TranslationServer():
 
 class ServerModel:
     def __init__(self, opt, model_id, tokenizer_opt=None, load=False,
-                 timeout=-1, on_timeout="to_cpu", model_root="./"):
+                 timeout=-1, on_timeout="to_cpu", model_root="./",
+                 max_wait=0.01, max_batch_tokens=4096,
+                 request_timeout=600):
         """
             Args:
                 opt: (dict) options for the Translator
@@ -161,6 +193,13 @@ class ServerModel:
                             timeout (see function `do_timeout`)
                 model_root: (str) path to the model directory
                             it must contain de model and tokenizer file
+                max_wait: (float) seconds a segment may wait in the queue
+                          for other segments to be batched with
+                max_batch_tokens: (int) maximum number of source tokens
+                                  in a batch, padding included
+                request_timeout: (int) seconds a request waits for its
+                                 translation before failing
+                                 Negative values means no timeout
 
         """
         self.model_root = model_root
@@ -177,6 +216,15 @@ class ServerModel:
         self.user_opt = opt
         self.tokenizer = None
 
+        # Segments of all the pending requests, batched by `self.schedule`
+        self.max_wait = max_wait
+        self.max_batch_tokens = max_batch_tokens
+        self.request_timeout = request_timeout
+        self.queue = []
+        self.queue_cond = threading.Condition()
+        self.scheduler = None
+        self.load_lock = threading.Lock()
+
         if load:
             self.load()
 
@@ -193,11 +241,18 @@ class ServerModel:
         parser = argparse.ArgumentParser()
         onmt.opts.translate_opts(parser)
 
-        opt['model'] = os.path.join(self.model_root, opt['model'])
+        models = opt['model']
+        if not isinstance(models, (list, tuple)):
+            models = [models]
+        opt['model'] = [os.path.join(self.model_root, model)
+                        for model in models]
         opt['src'] = "dummy_src"
 
         for (k, v) in opt.items():
-            sys.argv += ['-%s' % k, str(v)]
+            if k == 'model':
+                sys.argv += ['-model'] + v
+            else:
+                sys.argv += ['-%s' % k, str(v)]
 
         opt = parser.parse_args()
         opt.cuda = opt.gpu > -1
@@ -245,6 +300,9 @@ class ServerModel:
     def run(self, inputs):
         """Translate `inputs` using this model
 
+            The segments are queued and translated by the scheduler thread
+            together with the segments of concurrent calls.
+
             Args:
                 inputs: [{"src": "..."},{"src": ...}]
 
@@ -256,51 +314,50 @@ class ServerModel:
         print("\nRunning translation using %d" % self.model_id)
 
         timer.start()
-        if not self.loaded:
-            self.load()
-            timer.tick(name="load")
-        elif self.opt.cuda:
-            self.to_gpu()
-            timer.tick(name="to_gpu")
-
-        # NOTE: the translator exept a filepath as parameter
-        #       therefore we write the data as a temp file.
-        tmp_root = "/tmp/onmt_server"
-        if not os.path.exists(tmp_root):
-            os.makedirs(tmp_root)
-        src_path = os.path.join(tmp_root, "tmp_src")
-        with codecs.open(src_path, 'w', 'utf-8') as f:
-            # NOTE: If an input contains an line separator \n we split it
-            #       into subsegments that we translate independantly
-            #       we then merge the translations together with the same
-            #       line breaks
-            subsegment = {}
-            sscount = 0
-            sslength = []
-            for (i, inp) in enumerate(inputs):
-                src = inp['src']
-                lines = src.split("\n")
-                subsegment[i] = slice(sscount, sscount + len(lines))
-                sscount += len(lines)
-                for line in lines:
-                    tok = self.maybe_tokenize(line)
-                    f.write(tok + "\n")
-                    sslength += [len(tok.split())]
-        timer.tick(name="writing")
-        try:
-            scores = self.translator.translate(None, src_path, None,
-                                               self.opt.batch_size)
-        except RuntimeError as e:
-            raise ServerModelError("Runtime Error: %s" % str(e))
+        with self.load_lock:
+            if not self.loaded:
+                self.load()
+                timer.tick(name="load")
+        self.start_scheduler()
+
+        # NOTE: If an input contains an line separator \n we split it
+        #       into subsegments that we translate independantly
+        #       we then merge the translations together with the same
+        #       line breaks
+        subsegment = {}
+        sscount = 0
+        sslength = []
+        segments = []
+        for (i, inp) in enumerate(inputs):
+            src = inp['src']
+            lines = src.split("\n")
+            subsegment[i] = slice(sscount, sscount + len(lines))
+            sscount += len(lines)
+            for line in lines:
+                tok = self.maybe_tokenize(line)
+                segments += [tok]
+                sslength += [len(tok.split())]
+        timer.tick(name="tokenizing")
+        if len(segments) == 0:
+            return [], [], self.opt.n_best, timer.times
+
+        request = ServerRequest(segments)
+        self.enqueue(request)
+        timeout = self.request_timeout if self.request_timeout >= 0 else None
+        if not request.done.wait(timeout):
+            self.dequeue(request)
+            raise ServerModelError("Timeout: no translation after %d seconds"
+                                   % self.request_timeout)
+        if request.error is not None:
+            raise ServerModelError(request.error)
 
         timer.tick(name="translation")
         print("""Using model #%d\t%d inputs (%d subsegment)
                \ttranslation time: %f""" % (self.model_id, len(subsegment),
                                             sscount,
                                             timer.times['translation']))
-        self.reset_unload_timer()
-        results = self.out_file.getvalue().split("\n")
-        print("Results: ", len(results))
+        results = request.results
+        scores = request.scores
         results = ['\n'.join([self.maybe_detokenize(_)
                               for _ in results[subsegment[i]]
                               if len(_) > 0])
@@ -311,21 +368,155 @@ class ServerModel:
                       for k, sub
                       in sorted(subsegment.items(), key=lambda x: x[0])]
 
-        self.clear_out_file()
         return results, avg_scores, self.opt.n_best, timer.times
 
+    def start_scheduler(self):
+        """Start the scheduler thread if it is not running yet
+        """
+        with self.queue_cond:
+            if self.scheduler is None:
+                self.scheduler = threading.Thread(target=self.schedule)
+                self.scheduler.daemon = True
+                self.scheduler.start()
+
+    def enqueue(self, request):
+        """Add the segments of `request` to the queue
+        """
+        now = time.time()
+        with self.queue_cond:
+            for i, segment in enumerate(request.segments):
+                self.queue.append((len(segment.split()), now, request, i))
+            self.queue_cond.notify()
+
+    def dequeue(self, request):
+        """Remove the segments of `request` that are still in the queue
+        """
+        with self.queue_cond:
+            self.queue = [x for x in self.queue if x[2] is not request]
+
+    def schedule(self):
+        """Scheduler loop: wait for a batch to be ready, translate it and
+           send the results back to the requests
+        """
+        while True:
+            with self.queue_cond:
+                while True:
+                    while len(self.queue) == 0:
+                        self.queue_cond.wait()
+                    tokens = sum(length for length, _, _, _ in self.queue)
+                    wait = min(t for _, t, _, _ in self.queue) \
+                        + self.max_wait - time.time()
+                    if tokens >= self.max_batch_tokens or \
+                            len(self.queue) >= self.opt.batch_size or \
+                            wait <= 0:
+                        break
+                    self.queue_cond.wait(wait)
+                batch = self.next_batch()
+            self.translate_batch(batch)
+
+    def next_batch(self):
+        """Remove the next batch from the queue and return it
+
+           The batch is a bucket of segments of similar lengths around the
+           segment that waited the longest, such that the padded batch has
+           at most `self.max_batch_tokens` tokens and `opt.batch_size`
+           segments.
+        """
+        self.queue.sort(key=lambda x: x[0])
+        oldest = min(range(len(self.queue)), key=lambda i: self.queue[i][1])
+        lo, hi = oldest, oldest + 1
+        while hi - lo < self.opt.batch_size:
+            # Grow the bucket toward the closest length
+            left = self.queue[lo - 1][0] if lo > 0 else None
+            right = self.queue[hi][0] if hi < len(self.queue) else None
+            if left is None and right is None:
+                break
+            if right is None or \
+                    (left is not None and
+                     self.queue[oldest][0] - left < right -
+                     self.queue[oldest][0]):
+                max_len = self.queue[hi - 1][0]
+                lo_, hi_ = lo - 1, hi
+            else:
+                max_len = right
+                lo_, hi_ = lo, hi + 1
+            if max(max_len, 1) * (hi_ - lo_) > self.max_batch_tokens:
+                break
+            lo, hi = lo_, hi_
+        batch = self.queue[lo:hi]
+        del self.queue[lo:hi]
+        return batch
+
+    def translate_batch(self, batch):
+        """Translate a batch of queued segments and dispatch the results
+        """
+        # The lock is held until the timer is reset, so that the model
+        # is not unloaded or moved to CPU while it translates.
+        with self.load_lock:
+            try:
+                if not self.loaded:
+                    self.load()
+                elif self.opt.cuda:
+                    self.to_gpu()
+                results, scores = self.translate_segments(
+                    [request.segments[i] for _, _, request, i in batch])
+            except (RuntimeError, ServerModelError) as e:
+                for _, _, request, _ in batch:
+                    request.set_error("Runtime Error: %s" % str(e))
+                return
+            except Exception as e:
+                # Keep the scheduler alive for the other requests.
+                traceback.print_exc()
+                for _, _, request, _ in batch:
+                    request.set_error("Error: %s: %s" % (type(e).__name__,
+                                                         str(e)))
+                return
+            self.reset_unload_timer()
+        for (_, _, request, i), result, score in zip(batch, results, scores):
+            request.set_result(i, result, score)
+
+    def translate_segments(self, segments):
+        """Translate tokenized segments
+
+            Args:
+                segments: (list) tokenized segments (str)
+
+            Returns:
+                results: (list) tokenized translations (str)
+                scores: (list) translation scores
+        """
+        results, scores = [], []
+        for trans in self.translator.translate_sentences(
+                [segment.split() for segment in segments],
+                self.opt.batch_size):
+            results.append(" ".join(trans.pred_sents[0]))
+            scores.append(trans.pred_scores[0])
+        return results, scores
+
     def do_timeout(self):
         """Timeout function that free GPU memory by moving the model to CPU
            or unloading it; depending on `self.on_timemout` value
         """
-        if self.on_timeout == "unload":
-            print("Timeout: unloading model %d" % self.model_id)
-            self.unload()
-        if self.on_timeout == "to_cpu":
-            print("Timeout: sending model %d to CPU" % self.model_id)
-            self.to_cpu()
+        with self.load_lock:
+            # The timer was reset or cancelled while waiting for the lock.
+            if threading.current_thread() is not self.unload_timer:
+                return
+            if self.on_timeout == "unload":
+                print("Timeout: unloading model %d" % self.model_id)
+                self._unload()
+            if self.on_timeout == "to_cpu":
+                print("Timeout: sending model %d to CPU" % self.model_id)
+                self.to_cpu()
 
     def unload(self):
+        with self.load_lock:
+            if self.unload_timer is not None:
+                self.unload_timer.cancel()
+                self.unload_timer = None
+            if self.loaded:
+                self._unload()
+
+    def _unload(self):
         print("Unloading model %d" % self.model_id)
         del self.translator
         if self.opt.cuda:
@@ -367,11 +558,6 @@ class ServerModel:
         torch.cuda.set_device(self.opt.gpu)
         self.translator.model.cuda()
 
-    def clear_out_file(self):
-        # Creating a new object is faster
-        self.out_file = io.StringIO()
-        self.translator.out_file = self.out_file
-
     def maybe_tokenize(self, sequence):
         """Tokenize the sequence (or not)
 
@@ -3,9 +3,14 @@ import torch
 import codecs
 import os
 import math
+import multiprocessing
+import sys
+import time
 
+from collections import deque
 from itertools import count
 
+import onmt.Ensemble
 import onmt.ModelConstructor
 import onmt.translate.Beam
 import onmt.io
@@ -14,17 +19,27 @@ import onmt.opts
 
 def make_translator(opt, report_score=True, logger=None, out_file=None):
     if out_file is None:
-        out_file = codecs.open(opt.output, 'w', 'utf-8')
+        if opt.output == '-':
+            out_file = codecs.getwriter('utf-8')(
+                getattr(sys.stdout, 'buffer', sys.stdout))
+        else:
+            out_file = codecs.open(opt.output, 'w', 'utf-8')
 
     if opt.gpu > -1:
         torch.cuda.set_device(opt.gpu)
+    if opt.seed >= 0:
+        torch.manual_seed(opt.seed)
 
     dummy_parser = argparse.ArgumentParser(description='train.py')
     onmt.opts.model_opts(dummy_parser)
     dummy_opt = dummy_parser.parse_known_args([])[0]
 
-    fields, model, model_opt = \
-        onmt.ModelConstructor.load_test_model(opt, dummy_opt.__dict__)
+    if len(opt.model) > 1:
+        fields, model, model_opt = \
+            onmt.Ensemble.load_test_model(opt, dummy_opt.__dict__)
+    else:
+        fields, model, model_opt = \
+            onmt.ModelConstructor.load_test_model(opt, dummy_opt.__dict__)
 
     scorer = onmt.translate.GNMTGlobalScorer(opt.alpha,
                                              opt.beta,
@@ -36,7 +51,10 @@ def make_translator(opt, report_score=True, logger=None, out_file=None):
                         "stepwise_penalty", "block_ngram_repeat",
                         "ignore_when_blocking", "dump_beam",
                         "data_type", "replace_unk", "gpu", "verbose",
-                        "report_bleu", "report_rouge", "output"]}
+                        "report_bleu", "report_rouge", "output",
+                        "batch_type", "sort_by_length",
+                        "random_sampling_topk", "random_sampling_temp",
+                        "report_time"]}
 
     translator = Translator(model, fields, global_scorer=scorer,
                             out_file=out_file, report_score=report_score,
@@ -63,6 +81,14 @@ class Translator(object):
        cuda (bool): use cuda
        beam_trace (bool): trace beam search for debugging
        logger(logging.Logger): logger.
+       batch_type (str): "sents" or "tokens", see `translate`.
+       sort_by_length (bool): translate the input sorted by length, see
+          `translate`.
+       random_sampling_topk (int): with beam_size 1, sample each word
+          from the k best ones (-1 for all), or decode greedily with 1.
+       random_sampling_temp (float): temperature of the sampling.
+       report_time (bool): report the translation speed, and the share
+          of the time spent in each model of an ensemble.
     """
 
     def __init__(self,
@@ -92,7 +118,12 @@ class Translator(object):
                  report_rouge=False,
                  verbose=False,
                  out_file=None,
-                 output=None):
+                 output=None,
+                 batch_type="sents",
+                 sort_by_length=False,
+                 random_sampling_topk=1,
+                 random_sampling_temp=1.0,
+                 report_time=False):
         self.logger = logger
         self.gpu = gpu
         self.cuda = gpu > -1
@@ -122,6 +153,20 @@ class Translator(object):
         self.report_bleu = report_bleu
         self.report_rouge = report_rouge
         self.output = output
+        self.batch_type = batch_type
+        self.sort_by_length = sort_by_length
+        self.random_sampling_topk = random_sampling_topk
+        self.random_sampling_temp = random_sampling_temp
+        self.report_time = report_time
+        self.model_timer = getattr(model, "timer", None)
+        if self.model_timer is not None:
+            self.model_timer.enabled = report_time
+            self.model_timer.cuda = self.cuda
+        if random_sampling_topk != 1:
+            assert beam_size == 1 and block_ngram_repeat == 0 \
+                and dump_beam == "", \
+                "random sampling needs -beam_size 1, without " \
+                "-block_ngram_repeat and -dump_beam"
         # for debugging
         self.beam_trace = self.dump_beam != ""
         self.beam_accum = None
@@ -134,6 +179,19 @@ class Translator(object):
 
     def translate(self, src_dir, src_path, tgt_path,
                   batch_size, attn_debug=False):
+        """
+        Translate `src_path` and write the translations to the output
+        file, in the order of the input.
+
+        By default a batch is `batch_size` consecutive sentences. With
+        `batch_type` "tokens", `batch_size` is the number of padded
+        source and gold target tokens of a batch. With `sort_by_length`,
+        the whole input is sorted by length before batching, and with
+        "tokens" too, the batches are cut from length buckets by
+        :obj:`onmt.io.TokenBucketIterator`. The translations are then
+        held back until those of all the previous sentences are written.
+        """
+        start_time = self._start_timer()
         data = onmt.io.build_dataset(self.fields,
                                      self.data_type,
                                      src_path,
@@ -145,10 +203,7 @@ class Translator(object):
                                      window=self.window,
                                      use_filter_pred=self.use_filter_pred)
 
-        data_iter = onmt.io.OrderedIterator(
-            dataset=data, device=self.gpu,
-            batch_size=batch_size, train=False, sort=False,
-            sort_within_batch=True, shuffle=False)
+        data_iter = self._make_data_iter(data, batch_size)
 
         builder = onmt.translate.TranslationBuilder(
             data, self.fields,
@@ -160,49 +215,15 @@ class Translator(object):
         gold_score_total, gold_words_total = 0, 0
 
         all_scores = []
-        for batch in data_iter:
-            batch_data = self.translate_batch(batch, data)
-            translations = builder.from_batch(batch_data)
-
-            for trans in translations:
-                all_scores += [trans.pred_scores[0]]
-                pred_score_total += trans.pred_scores[0]
-                pred_words_total += len(trans.pred_sents[0])
-                if tgt_path is not None:
-                    gold_score_total += trans.gold_score
-                    gold_words_total += len(trans.gold_sent) + 1
-
-                n_best_preds = [" ".join(pred)
-                                for pred in trans.pred_sents[:self.n_best]]
-                self.out_file.write('\n'.join(n_best_preds) + '\n')
-                self.out_file.flush()
-
-                if self.verbose:
-                    sent_number = next(counter)
-                    output = trans.log(sent_number)
-                    if self.logger:
-                        self.logger.info(output)
-                    else:
-                        os.write(1, output.encode('utf-8'))
-
-                # Debug attention.
-                if attn_debug:
-                    srcs = trans.src_raw
-                    preds = trans.pred_sents[0]
-                    preds.append('</s>')
-                    attns = trans.attns[0].tolist()
-                    header_format = "{:>10.10} " + "{:>10.7} " * len(srcs)
-                    row_format = "{:>10.10} " + "{:>10.7f} " * len(srcs)
-                    output = header_format.format("", *trans.src_raw) + '\n'
-                    for word, row in zip(preds, attns):
-                        max_index = row.index(max(row))
-                        row_format = row_format.replace(
-                            "{:>10.7f} ", "{:*>10.7f} ", max_index + 1)
-                        row_format = row_format.replace(
-                            "{:*>10.7f} ", "{:>10.7f} ", max_index)
-                        output += row_format.format(word, *row) + '\n'
-                        row_format = "{:>10.10} " + "{:>10.7f} " * len(srcs)
-                    os.write(1, output.encode('utf-8'))
+        for trans in self._in_input_order(data_iter, data, builder):
+            all_scores += [trans.pred_scores[0]]
+            pred_score_total += trans.pred_scores[0]
+            pred_words_total += len(trans.pred_sents[0])
+            if tgt_path is not None:
+                gold_score_total += trans.gold_score
+                gold_words_total += len(trans.gold_sent) + 1
+
+            self._write_translation(trans, counter, attn_debug)
 
         if self.report_score:
             msg = self._report_score('PRED', pred_score_total,
@@ -221,30 +242,253 @@ class Translator(object):
                     self.logger.info(msg)
                 else:
                     print(msg)
-                if self.report_bleu:
+                if self.output == '-' and \
+                        (self.report_bleu or self.report_rouge):
+                    msg = "No BLEU or ROUGE report of predictions " \
+                        "written to stdout"
+                    if self.logger:
+                        self.logger.info(msg)
+                    else:
+                        print(msg)
+                elif self.report_bleu:
                     msg = self._report_bleu(tgt_path)
                     if self.logger:
                         self.logger.info(msg)
                     else:
                         print(msg)
-                if self.report_rouge:
+                if self.report_rouge and self.output != '-':
                     msg = self._report_rouge(tgt_path)
                     if self.logger:
                         self.logger.info(msg)
                     else:
                         print(msg)
 
+        if self.report_time:
+            self._report_time(len(all_scores), time.time() - start_time)
+
         if self.dump_beam:
             import json
             json.dump(self.translator.beam_accum,
                       codecs.open(self.dump_beam, 'w', 'utf-8'))
         return all_scores
 
+    def _write_translation(self, trans, counter, attn_debug=False):
+        """
+        Write the n-best translations of `trans` to the output file, and
+        log it in verbose mode.
+        """
+        n_best_preds = [" ".join(pred)
+                        for pred in trans.pred_sents[:self.n_best]]
+        self.out_file.write('\n'.join(n_best_preds) + '\n')
+        self.out_file.flush()
+
+        if self.verbose:
+            sent_number = next(counter)
+            output = trans.log(sent_number)
+            if self.logger:
+                self.logger.info(output)
+            else:
+                os.write(1, output.encode('utf-8'))
+
+        # Debug attention.
+        if attn_debug:
+            srcs = trans.src_raw
+            preds = trans.pred_sents[0]
+            preds.append('</s>')
+            attns = trans.attns[0].tolist()
+            header_format = "{:>10.10} " + "{:>10.7} " * len(srcs)
+            row_format = "{:>10.10} " + "{:>10.7f} " * len(srcs)
+            output = header_format.format("", *trans.src_raw) + '\n'
+            for word, row in zip(preds, attns):
+                max_index = row.index(max(row))
+                row_format = row_format.replace(
+                    "{:>10.7f} ", "{:*>10.7f} ", max_index + 1)
+                row_format = row_format.replace(
+                    "{:*>10.7f} ", "{:>10.7f} ", max_index)
+                output += row_format.format(word, *row) + '\n'
+                row_format = "{:>10.10} " + "{:>10.7f} " * len(srcs)
+            os.write(1, output.encode('utf-8'))
+
+    def _make_data_iter(self, data, batch_size):
+        if self.batch_type == "tokens":
+            assert self.data_type == 'text', \
+                "-batch_type tokens only supports text input"
+            if self.sort_by_length:
+                return onmt.io.TokenBucketIterator(
+                    dataset=data, device=self.gpu, batch_size=batch_size,
+                    train=False, sort=False, sort_within_batch=True,
+                    shuffle=False)
+
+        def batch_size_fn(new, count, sofar):
+            """ Padded src + tgt tokens of the batch. """
+            if count == 1:
+                max_lengths[:] = [0, 0]
+            max_lengths[0] = max(max_lengths[0], len(new.src))
+            if hasattr(new, "tgt"):
+                max_lengths[1] = max(max_lengths[1], len(new.tgt) + 2)
+            return count * sum(max_lengths)
+        max_lengths = [0, 0]
+
+        return onmt.io.OrderedIterator(
+            dataset=data, device=self.gpu,
+            batch_size=batch_size, train=False, sort=self.sort_by_length,
+            sort_within_batch=True, shuffle=False,
+            batch_size_fn=batch_size_fn if self.batch_type == "tokens"
+            else None)
+
+    def _in_input_order(self, data_iter, data, builder):
+        """
+        Translate the batches of `data_iter` and yield the translations
+        in the order of the input: a reorder buffer holds those that
+        come before their turn.
+        """
+        pending = {}
+        next_index = 0
+        for batch in data_iter:
+            batch_data = self.translate_batch(batch, data)
+            # from_batch sorts the translations by index.
+            indices = sorted(batch.indices.data.tolist())
+            for index, trans in zip(indices, builder.from_batch(batch_data)):
+                pending[index] = trans
+            while next_index in pending:
+                yield pending.pop(next_index)
+                next_index += 1
+        # Only left if some examples were filtered out.
+        for index in sorted(pending):
+            yield pending[index]
+
+    def translate_stream(self, src_file, batch_size, window, attn_debug=False,
+                         workers=1, threads=0):
+        """
+        Translate the lines of `src_file`, e.g. stdin, as they are read,
+        and write the translations to the output file in the order of
+        the input.
+
+        The input is read in windows of `window` lines, each translated
+        by `translate_sentences`, so the memory used does not depend on
+        the size of the input. The first window is one line and the next
+        ones double up to `window`, so that the first translation is
+        written at once.
+
+        With `workers` > 1, the windows are translated by a pool of
+        forked processes, which share the weights of the model loaded
+        here copy-on-write. Each runs `threads` torch threads (by default
+        the cores divided among the workers). This is meant for CPU
+        translation, where one process gains little from more threads.
+        At most two windows per worker are read ahead of the output.
+
+        Args:
+           src_file: file of tokenized source sentences, one per line
+           batch_size (int): see `translate`
+           window (int): maximum number of lines translated together
+           workers (int): number of translation processes
+           threads (int): torch threads of each worker process
+        """
+        assert self.data_type == 'text', \
+            "translate_stream only supports text input"
+        start_time = self._start_timer()
+        windows = self._read_windows(src_file, window)
+        if workers > 1:
+            assert not self.cuda, "-workers only supports CPU translation"
+            if threads <= 0:
+                threads = max(1, multiprocessing.cpu_count() // workers)
+            pool = multiprocessing.Pool(
+                workers, _init_worker, (self, batch_size, threads,
+                                        attn_debug))
+            results = self._pooled_windows(pool, windows, 2 * workers)
+        else:
+            pool = None
+            results = (list(self.translate_sentences(sentences, batch_size))
+                       for sentences in windows)
+
+        counter = count(1)
+        n_sents, pred_score_total, pred_words_total = 0, 0, 0
+        try:
+            for translations in results:
+                n_sents += len(translations)
+                for trans in translations:
+                    pred_score_total += trans.pred_scores[0]
+                    pred_words_total += len(trans.pred_sents[0])
+                    self._write_translation(trans, counter, attn_debug)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        if self.report_score and pred_words_total > 0:
+            msg = self._report_score('PRED', pred_score_total,
+                                     pred_words_total)
+            if self.logger:
+                self.logger.info(msg)
+            else:
+                print(msg)
+        if self.report_time:
+            # The models run in the workers, which keep their own times.
+            self._report_time(n_sents, time.time() - start_time,
+                              model_shares=workers <= 1)
+
+    @staticmethod
+    def _pooled_windows(pool, windows, max_pending):
+        """
+        Yield the translations of `windows` by `pool`, in order. At most
+        `max_pending` windows are in flight: the oldest one is waited for
+        before the next is read, so a fast reader is not buffered whole.
+        """
+        pending = deque()
+        for sentences in windows:
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+            pending.append(pool.apply_async(_translate_window, (sentences,)))
+        while pending:
+            yield pending.popleft().get()
+
+    @staticmethod
+    def _read_windows(src_file, window):
+        """ Yield lists of tokenized lines: 1, 2, 4, ... `window` lines. """
+        sentences, size = [], 1
+        for line in src_file:
+            sentences.append(line.split())
+            if len(sentences) >= size:
+                yield sentences
+                sentences, size = [], min(2 * size, window)
+        if sentences:
+            yield sentences
+
+    def translate_sentences(self, sentences, batch_size):
+        """
+        Translate tokenized sentences held in memory.
+
+        The sentences are numericalized directly with the vocabularies of
+        `self.fields`, see :obj:`onmt.io.InMemoryTextDataset`; nothing is
+        written to disk and no torchtext dataset is built.
+
+        Args:
+           sentences (list of list of str): tokenized source sentences
+           batch_size (int): number of sentences translated together
+
+        Yields:
+           :obj:`onmt.translate.Translation`: the translation of each
+           sentence, in the order of `sentences`. They are translated
+           sorted by length.
+        """
+        assert self.data_type == 'text', \
+            "translate_sentences only supports text input"
+        data = onmt.io.InMemoryTextDataset(self.fields, sentences,
+                                           dynamic_dict=self.copy_attn)
+        builder = onmt.translate.TranslationBuilder(
+            data, self.fields, self.n_best, self.replace_unk)
+        data_iter = data.batches(batch_size, cuda=self.cuda,
+                                 batch_type=self.batch_type,
+                                 sort_by_length=True)
+        for trans in self._in_input_order(data_iter, data, builder):
+            yield trans
+
     def translate_batch(self, batch, data):
         """
         Translate a batch of sentences.
 
-        Mostly a wrapper around :obj:`Beam`.
+        Mostly a wrapper around :obj:`BatchBeam`, or around
+        :obj:`GreedySearch` for greedy decoding and random sampling.
 
         Args:
            batch (:obj:`Batch`): a batch from a dataset object
@@ -267,29 +511,6 @@ class Translator(object):
         exclusion_tokens = set([vocab.stoi[t]
                                 for t in self.ignore_when_blocking])
 
-        beam = [onmt.translate.Beam(beam_size, n_best=self.n_best,
-                                    cuda=self.cuda,
-                                    global_scorer=self.global_scorer,
-                                    pad=vocab.stoi[onmt.io.PAD_WORD],
-                                    eos=vocab.stoi[onmt.io.EOS_WORD],
-                                    bos=vocab.stoi[onmt.io.BOS_WORD],
-                                    min_length=self.min_length,
-                                    stepwise_penalty=self.stepwise_penalty,
-                                    block_ngram_repeat=self.block_ngram_repeat,
-                                    exclusion_tokens=exclusion_tokens)
-                for __ in range(batch_size)]
-
-        # Help functions for working with beams and batches
-        def var(a): return a
-
-        def rvar(a): return var(a.repeat(1, beam_size, 1))
-
-        def bottle(m):
-            return m.view(batch_size * beam_size, -1)
-
-        def unbottle(m):
-            return m.view(beam_size, batch_size, -1)
-
         # (1) Run the encoder on the src.
         src = onmt.io.make_features(batch, 'src', data_type)
         src_lengths = None
@@ -301,26 +522,57 @@ class Translator(object):
             src, memory_bank, enc_states)
 
         if src_lengths is None:
-            src_lengths = torch.Tensor(batch_size).type_as(memory_bank.data)\
+            bank = memory_bank[0] if isinstance(memory_bank, tuple) \
+                else memory_bank
+            src_lengths = torch.Tensor(batch_size).type_as(bank.data)\
                                                   .long()\
-                                                  .fill_(memory_bank.size(0))
+                                                  .fill_(bank.size(0))
+
+        if beam_size == 1 and self.block_ngram_repeat == 0 \
+                and not self.beam_trace:
+            beam = onmt.translate.GreedySearch(
+                batch_size, cuda=self.cuda,
+                pad=vocab.stoi[onmt.io.PAD_WORD],
+                eos=vocab.stoi[onmt.io.EOS_WORD],
+                bos=vocab.stoi[onmt.io.BOS_WORD],
+                min_length=self.min_length,
+                sampling_topk=self.random_sampling_topk,
+                sampling_temp=self.random_sampling_temp,
+                memory_lengths=src_lengths)
+        else:
+            beam = onmt.translate.BatchBeam(
+                beam_size, batch_size, n_best=self.n_best,
+                cuda=self.cuda,
+                global_scorer=self.global_scorer,
+                pad=vocab.stoi[onmt.io.PAD_WORD],
+                eos=vocab.stoi[onmt.io.EOS_WORD],
+                bos=vocab.stoi[onmt.io.BOS_WORD],
+                min_length=self.min_length,
+                stepwise_penalty=self.stepwise_penalty,
+                block_ngram_repeat=self.block_ngram_repeat,
+                exclusion_tokens=exclusion_tokens,
+                memory_lengths=src_lengths)
 
         # (2) Repeat src objects `beam_size` times.
+        # Each sentence is repeated in place, so that row `b * beam_size + k`
+        # holds hypothesis `k` of sentence `b`.
+        tile = beam.get_tile_index()
+
+        def rvar(a): return a.index_select(1, tile)
+
         src_map = rvar(batch.src_map.data) \
             if data_type == 'text' and self.copy_attn else None
-        memory_bank = rvar(memory_bank.data)
-        memory_lengths = src_lengths.repeat(beam_size)
-        dec_states.repeat_beam_size_times(beam_size)
+        memory_bank = _select_memory(memory_bank, tile)
+        memory_lengths = src_lengths.index_select(0, tile)
+        dec_states.index_select(tile)
 
         # (3) run the decoder to generate sentences, using beam search.
         for i in range(self.max_length):
-            if all((b.done() for b in beam)):
+            if beam.done():
                 break
 
             # Construct batch x beam_size nxt words.
-            # Get all the pending current beam words and arrange for forward.
-            inp = var(torch.stack([b.get_current_state() for b in beam])
-                      .t().contiguous().view(1, -1))
+            inp = beam.get_current_state().view(1, -1)
 
             # Turn any copied words to UNKs
             # 0 is unk
@@ -336,30 +588,40 @@ class Translator(object):
             dec_out, dec_states, attn = self.model.decoder(
                 inp, memory_bank, dec_states, memory_lengths=memory_lengths)
             dec_out = dec_out.squeeze(0)
-            # dec_out: beam x rnn_size
+            # dec_out: (batch * beam) x rnn_size
 
             # (b) Compute a vector of batch x beam word scores.
             if not self.copy_attn:
                 out = self.model.generator.forward(dec_out).data
-                out = unbottle(out)
-                # beam x tgt_vocab
-                beam_attn = unbottle(attn["std"])
+                # (batch * beam) x tgt_vocab
+                beam_attn = attn["std"]
             else:
                 out = self.model.generator.forward(dec_out,
                                                    attn["copy"].squeeze(0),
                                                    src_map)
-                # beam x (tgt_vocab + extra_vocab)
+                # beam x batch x (tgt_vocab + extra_vocab)
+                out = out.data.view(-1, beam_size, out.size(-1)) \
+                    .transpose(0, 1).contiguous()
                 out = data.collapse_copy_scores(
-                    unbottle(out.data),
-                    batch, self.fields["tgt"].vocab, data.src_vocabs)
-                # beam x tgt_vocab
-                out = out.log()
-                beam_attn = unbottle(attn["copy"])
-            # (c) Advance each beam.
-            for j, b in enumerate(beam):
-                b.advance(out[:, j],
-                          beam_attn.data[:, j, :memory_lengths[j]])
-                dec_states.beam_update(j, b.get_current_origin(), beam_size)
+                    out, batch, vocab, data.get_copy_maps(vocab),
+                    batch_offset=beam.batch_offset)
+                # (batch * beam) x tgt_vocab
+                out = out.transpose(0, 1).contiguous() \
+                    .view(-1, out.size(2)).log()
+                beam_attn = attn["copy"]
+            # (c) Advance every beam at once and reorder the state.
+            beam.advance(out, beam_attn.data.view(-1, beam_attn.size(-1)))
+            origin = beam.get_current_origin()
+            if origin is not None:
+                dec_states.index_select(origin)
+
+            # (d) Drop the sentences that are done from the batch.
+            alive_rows = beam.get_alive_rows()
+            if alive_rows is not None:
+                memory_bank = _select_memory(memory_bank, alive_rows)
+                memory_lengths = memory_lengths.index_select(0, alive_rows)
+                if src_map is not None:
+                    src_map = src_map.index_select(1, alive_rows)
 
         # (4) Extract sentences from beam.
         ret = self._from_beam(beam)
@@ -373,12 +635,11 @@ class Translator(object):
         ret = {"predictions": [],
                "scores": [],
                "attention": []}
-        for b in beam:
+        for b in range(beam.batch_size):
             n_best = self.n_best
-            scores, ks = b.sort_finished(minimum=n_best)
+            scores, hyps_attn = beam.sort_finished(b, minimum=n_best)
             hyps, attn = [], []
-            for i, (times, k) in enumerate(ks[:n_best]):
-                hyp, att = b.get_hyp(times, k)
+            for hyp, att in hyps_attn[:n_best]:
                 hyps.append(hyp)
                 attn.append(att)
             ret["predictions"].append(hyps)
@@ -417,6 +678,23 @@ class Translator(object):
             gold_scores += scores.view(-1)
         return gold_scores
 
+    def _start_timer(self):
+        if self.model_timer is not None:
+            self.model_timer.times = [0.] * len(self.model_timer.times)
+        return time.time()
+
+    def _report_time(self, n_sents, elapsed, model_shares=True):
+        msg = "Translated %d sentences in %.2fs (%.2f sentences/s)" % (
+            n_sents, elapsed, n_sents / max(elapsed, 1e-6))
+        if self.model_timer is not None and model_shares:
+            msg += ", time share of each model: " + ", ".join(
+                "%.1f%%" % (100 * t / max(elapsed, 1e-6))
+                for t in self.model_timer.times)
+        if self.logger:
+            self.logger.info(msg)
+        else:
+            print(msg)
+
     def _report_score(self, name, score_total, words_total):
         msg = ("%s AVG SCORE: %.4f, %s PPL: %.4f" % (
             name, score_total / words_total,
@@ -466,3 +744,34 @@ class Translator(object):
             shell=True).decode("utf-8")
         msg = res.strip()
         return msg
+
+
+def _select_memory(memory_bank, index):
+    """
+    Select `index` along the batch dimension of the memory bank, or of
+    each memory bank of an ensemble.
+    """
+    if isinstance(memory_bank, tuple):
+        return tuple(m.data.index_select(1, index) for m in memory_bank)
+    return memory_bank.data.index_select(1, index)
+
+
+# State of the processes of `Translator.translate_stream`, set by fork.
+_worker_state = {}
+
+
+def _init_worker(translator, batch_size, threads, attn_debug):
+    torch.set_num_threads(threads)
+    _worker_state.update(translator=translator, batch_size=batch_size,
+                         attn_debug=attn_debug)
+
+
+def _translate_window(sentences):
+    translations = list(_worker_state['translator'].translate_sentences(
+        sentences, _worker_state['batch_size']))
+    for trans in translations:
+        # Only send back what `_write_translation` needs.
+        trans.src = None
+        if not _worker_state['attn_debug']:
+            trans.attns = None
+    return translations
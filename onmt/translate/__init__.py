@@ -1,10 +1,12 @@
 from onmt.translate.Translator import Translator
 from onmt.translate.Translation import Translation, TranslationBuilder
 from onmt.translate.Beam import Beam, GNMTGlobalScorer
+from onmt.translate.BatchBeam import BatchBeam
+from onmt.translate.GreedySearch import GreedySearch
 from onmt.translate.Penalties import PenaltyBuilder
 from onmt.translate.TranslationServer import TranslationServer, \
                                              ServerModelError
 
-__all__ = [Translator, Translation, Beam,
+__all__ = [Translator, Translation, Beam, BatchBeam, GreedySearch,
            GNMTGlobalScorer, TranslationBuilder,
            PenaltyBuilder, TranslationServer, ServerModelError]
@@ -5,6 +5,8 @@ import argparse
 import os
 import glob
 import sys
+import multiprocessing
+from collections import Counter, defaultdict
 
 import torch
 
@@ -18,11 +20,12 @@ def check_existing_pt_files(opt):
     # when training, so check to avoid tampering with existing pt files
     # or mixing them up.
     for t in ['train', 'valid', 'vocab']:
-        pattern = opt.save_data + '.' + t + '*.pt'
-        if glob.glob(pattern):
-            sys.stderr.write("Please backup exisiting pt file: %s, "
-                             "to avoid tampering!\n" % pattern)
-            sys.exit(1)
+        for ext in ['.pt', '.bin']:
+            pattern = opt.save_data + '.' + t + '*' + ext
+            if glob.glob(pattern):
+                sys.stderr.write("Please backup exisiting %s file: %s, "
+                                 "to avoid tampering!\n" % (ext, pattern))
+                sys.exit(1)
 
 
 def parse_args():
@@ -36,46 +39,286 @@ def parse_args():
     opt = parser.parse_args()
     torch.manual_seed(opt.seed)
 
+    if opt.data_format == 'bin':
+        assert opt.data_type == 'text', \
+            "-data_format bin is only supported for text data."
+        assert not opt.dynamic_dict, \
+            "-data_format bin does not support -dynamic_dict."
+
     check_existing_pt_files(opt)
 
     return opt
 
 
-def build_save_text_dataset_in_shards(src_corpus, tgt_corpus, fields,
-                                      corpus_type, opt, logger=None):
-    '''
-    Divide the big corpus into shards, and build dataset separately.
-    This is currently only for data_type=='text'.
+def split_corpus(src_corpus, tgt_corpus, shard_size, n_shards):
+    """
+    Split a parallel corpus into byte ranges which begin and end at line
+    boundaries and hold the same lines on both sides. Only newlines are
+    counted, so this is fast compared to building the shards.
+
+    The source ranges are `shard_size` bytes (rounded up to the end of a
+    line), or the source is split in `n_shards` if `shard_size` is 0.
+
+    Returns:
+        A list of ((src_start, src_end), (tgt_start, tgt_end)) tuples.
+    """
+    src_size = os.path.getsize(src_corpus)
+    tgt_size = os.path.getsize(tgt_corpus)
+    if shard_size == 0:
+        shard_size = max(1, -(-src_size // n_shards))
+
+    src_bounds = [0]
+    with open(src_corpus, 'rb') as f:
+        while src_bounds[-1] < src_size:
+            f.seek(src_bounds[-1] + shard_size - 1)
+            f.readline()
+            src_bounds.append(min(f.tell(), src_size))
+
+    # Number of complete lines before the end of each source range.
+    line_counts = []
+    with open(src_corpus, 'rb') as f:
+        n_lines = 0
+        for start, end in zip(src_bounds[:-1], src_bounds[1:]):
+            n_lines += count_newlines(f, start, end)
+            line_counts.append(n_lines)
+
+    tgt_bounds = [0] + newline_offsets(tgt_corpus, line_counts[:-1]) \
+        + [tgt_size]
+    return list(zip(zip(src_bounds[:-1], src_bounds[1:]),
+                    zip(tgt_bounds[:-1], tgt_bounds[1:])))
+
+
+def count_newlines(f, start, end, block_size=1 << 20):
+    f.seek(start)
+    count = 0
+    while start < end:
+        block = f.read(min(block_size, end - start))
+        count += block.count(b'\n')
+        start += len(block)
+    return count
+
+
+def newline_offsets(path, line_counts, block_size=1 << 20):
+    """
+    Byte offsets of `path` right after its n-th newline, for each n of
+    the increasing `line_counts`.
+    """
+    offsets = []
+    counts = iter(line_counts)
+    n = next(counts, None)
+    seen, pos = 0, 0
+    with open(path, 'rb') as f:
+        while n is not None:
+            block = f.read(block_size)
+            if not block:
+                raise AssertionError(
+                    "Two corpuses must have same number of lines!")
+            in_block = block.count(b'\n')
+            while n is not None and seen + in_block >= n:
+                i = -1
+                for _ in range(n - seen):
+                    i = block.index(b'\n', i + 1)
+                offsets.append(pos + i + 1)
+                n = next(counts, None)
+            seen += in_block
+            pos += len(block)
+    return offsets
+
+
+def read_lines(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        lines = f.read(end - start).decode('utf-8').split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return lines
+
+
+def filter_text_examples(examples_iter, opt):
+    """
+    Keep the examples of `examples_iter` that `TextDataset` would keep.
+    """
+    for ex in examples_iter:
+        if 0 < len(ex['src']) <= opt.src_seq_length \
+                and 0 < len(ex['tgt']) <= opt.tgt_seq_length:
+            yield ex
+
+
+def count_text_examples(examples_iter, keys, src_vocab, tgt_vocab):
+    """
+    Count the tokens of `examples_iter` for the vocabularies of `keys`,
+    as `onmt.io.build_vocab` does.
+    """
+    counter = dict((k, Counter()) for k in keys)
+    for ex in examples_iter:
+        for k in keys:
+            val = ex[k]
+            if k == 'src' and src_vocab:
+                val = [item for item in val if item in src_vocab]
+            elif k == 'tgt' and tgt_vocab:
+                val = [item for item in val if item in tgt_vocab]
+            counter[k].update(val)
+    return counter
+
+
+# State of the shard workers, set by `init_worker`.
+worker_state = {}
+
+
+def init_worker(state):
+    worker_state.update(state)
+
+
+def build_shard(task):
+    """
+    Parse and filter the lines of a shard, then, depending on `mode`:
+
+    * 'pt': save it as a pickled `onmt.io.TextDataset`.
+    * 'bin': save it as an `onmt.io.BinaryTextDataset`.
+    * 'count': only count its vocabulary.
+
+    Returns:
+        (saved file or None, number of examples, vocabulary counter or
+        None) tuple. The vocabulary is only counted on training shards.
+    """
+    mode, corpus_type, index, src_range, tgt_range = task
+    opt = worker_state['opt']
+    fields = worker_state['fields']
+    if corpus_type == 'train':
+        src_corpus, tgt_corpus = opt.train_src, opt.train_tgt
+    else:
+        src_corpus, tgt_corpus = opt.valid_src, opt.valid_tgt
 
-    The reason we do this is to avoid taking up too much memory due
-    to sucking in a huge corpus file.
+    src_lines = read_lines(src_corpus, *src_range)
+    tgt_lines = read_lines(tgt_corpus, *tgt_range)
+    if len(src_lines) != len(tgt_lines):
+        raise AssertionError("Two corpuses must have same number of lines!")
+
+    src_iter = (ex for ex, nfeats in onmt.io.TextDataset.read_text_lines(
+        src_lines, opt.src_seq_length_trunc, 'src'))
+    tgt_iter = (ex for ex, nfeats in onmt.io.TextDataset.read_text_lines(
+        tgt_lines, opt.tgt_seq_length_trunc, 'tgt'))
 
-    To tackle this, we only read in part of the corpus file of size
-    `max_shard_size`(actually it is multiples of 64 bytes that equals
-    or is slightly larger than this size), and process it into dataset,
-    then write it to disk along the way. By doing this, we only focus on
-    part of the corpus at any moment, thus effectively reducing memory use.
-    According to test, this method can reduce memory footprint by ~50%.
+    keys = ['src', 'tgt'] + onmt.io.collect_features(fields, 'src') \
+        + onmt.io.collect_features(fields, 'tgt')
+    counter = None
 
-    Note! As we process along the shards, previous shards might still
-    stay in memory, but since we are done with them, and no more
-    reference to them, if there is memory tight situation, the OS could
-    easily reclaim these memory.
+    if mode == 'pt':
+        dataset = onmt.io.TextDataset(
+            fields, src_iter, tgt_iter,
+            worker_state['src_nfeats'], worker_state['tgt_nfeats'],
+            src_seq_length=opt.src_seq_length,
+            tgt_seq_length=opt.tgt_seq_length,
+            dynamic_dict=opt.dynamic_dict)
+        if corpus_type == 'train':
+            counter = count_text_examples(
+                (ex.__dict__ for ex in dataset.examples), keys,
+                worker_state['src_vocab'], worker_state['tgt_vocab'])
 
-    If `max_shard_size` is 0 or is larger than the corpus size, it is
-    effectively preprocessed into one dataset, i.e. no sharding.
+        # We save fields in vocab.pt seperately, so make it empty.
+        dataset.fields = []
+
+        out_file = "{:s}.{:s}.{:d}.pt".format(
+            opt.save_data, corpus_type, index)
+        torch.save(dataset, out_file)
+        return out_file, len(dataset), counter
+
+    examples = filter_text_examples(
+        (dict(src, **tgt) for src, tgt in zip(src_iter, tgt_iter)), opt)
+
+    if mode == 'count':
+        examples = list(examples)
+        counter = count_text_examples(
+            examples, keys,
+            worker_state['src_vocab'], worker_state['tgt_vocab'])
+        return None, len(examples), counter
+
+    out_file = "{:s}.{:s}.{:d}.bin".format(
+        opt.save_data, corpus_type, index)
+    n_examples = onmt.io.BinaryTextDataset.save(
+        out_file, fields, examples,
+        worker_state['src_nfeats'], worker_state['tgt_nfeats'])
+    return out_file, n_examples, counter
+
+
+def run_shard_tasks(tasks, state, opt, logger=None):
+    """
+    Run `build_shard` on `tasks`, in a pool of `opt.workers` processes.
+    The fields can't be pickled, so the workers get `state` by forking.
+
+    Returns:
+        The list of the results of `build_shard`.
+    """
+    if opt.workers > 1:
+        pool = multiprocessing.Pool(opt.workers, init_worker, (state,))
+        results = pool.imap(build_shard, tasks)
+    else:
+        pool = None
+        init_worker(state)
+        results = (build_shard(task) for task in tasks)
+
+    ret_list = []
+    try:
+        for task, result in zip(tasks, results):
+            if logger:
+                mode, corpus_type, index = task[:3]
+                if mode == 'count':
+                    logger.info(" * counted the vocabulary of %s shard "
+                                "%d (%d examples)."
+                                % (corpus_type, index, result[1]))
+                else:
+                    logger.info(" * saved %s data shard to %s "
+                                "(%d examples)."
+                                % (corpus_type, result[0], result[1]))
+            ret_list.append(result)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return ret_list
+
+
+def merge_counters(counters):
+    counter = defaultdict(Counter)
+    for c in counters:
+        for k, v in c.items():
+            counter[k].update(v)
+    return counter
+
+
+def build_save_text_dataset_in_shards(fields, opt, logger):
+    '''
+    Divide the big corpora into shards, and build the datasets in
+    parallel. This is currently only for data_type=='text'.
+
+    The reason we do this is to avoid taking up too much memory due
+    to sucking in a huge corpus file, and to use all cores: the
+    corpora are split into byte ranges aligned to line boundaries
+    (see `split_corpus`), and `opt.workers` processes read, tokenize,
+    filter and save a shard each. The vocabulary is counted by the same
+    processes on the training shards, and their counters are merged in
+    the end.
+
+    Shards of `max_shard_size` bytes of source are read at once, so the
+    memory used is about `opt.workers` times the memory of a shard.
+    If `max_shard_size` is 0, the corpora are split in `opt.workers`
+    shards, i.e. no sharding with one worker.
+
+    With `-data_format bin`, token ids need the vocabulary, so the
+    training shards are first parsed to count it, then parsed again to
+    be saved.
 
     NOTE! `max_shard_size` is measuring the input corpus size, not the
     output pt file size. So a shard pt file consists of examples of size
     2 * `max_shard_size`(source + target).
     '''
-
-    corpus_size = os.path.getsize(src_corpus)
-    if corpus_size > 10 * (1024**2) and opt.max_shard_size == 0:
+    corpus_size = os.path.getsize(opt.train_src)
+    if corpus_size > 10 * (1024**2) and opt.max_shard_size == 0 \
+            and opt.workers == 1:
         if logger:
             logger.info("Warning. The corpus %s is larger than 10M bytes, "
                         "you can set '-max_shard_size' to process it by "
-                        "small shards to use less memory." % src_corpus)
+                        "small shards to use less memory." % opt.train_src)
 
     if opt.max_shard_size != 0:
         if logger:
@@ -83,38 +326,47 @@ def build_save_text_dataset_in_shards(src_corpus, tgt_corpus, fields,
                         'separately (shard_size = %d bytes).'
                         % opt.max_shard_size)
 
-    ret_list = []
-    src_iter = onmt.io.ShardedTextCorpusIterator(
-        src_corpus, opt.src_seq_length_trunc,
-        "src", opt.max_shard_size)
-    tgt_iter = onmt.io.ShardedTextCorpusIterator(
-        tgt_corpus, opt.tgt_seq_length_trunc,
-        "tgt", opt.max_shard_size,
-        assoc_iter=src_iter)
-
-    index = 0
-    while not src_iter.hit_end():
-        index += 1
-        dataset = onmt.io.TextDataset(
-            fields, src_iter, tgt_iter,
-            src_iter.num_feats, tgt_iter.num_feats,
-            src_seq_length=opt.src_seq_length,
-            tgt_seq_length=opt.tgt_seq_length,
-            dynamic_dict=opt.dynamic_dict)
-
-        # We save fields in vocab.pt seperately, so make it empty.
-        dataset.fields = []
-
-        pt_file = "{:s}.{:s}.{:d}.pt".format(
-            opt.save_data, corpus_type, index)
-        if logger:
-            logger.info(" * saving %s data shard to %s."
-                        % (corpus_type, pt_file))
-        torch.save(dataset, pt_file)
+    tasks = {}
+    for corpus_type, src_corpus, tgt_corpus in [
+            ('train', opt.train_src, opt.train_tgt),
+            ('valid', opt.valid_src, opt.valid_tgt)]:
+        ranges = split_corpus(src_corpus, tgt_corpus,
+                              opt.max_shard_size, opt.workers)
+        tasks[corpus_type] = [(corpus_type, i + 1, src_range, tgt_range)
+                              for i, (src_range, tgt_range)
+                              in enumerate(ranges)]
+
+    state = {'opt': opt, 'fields': fields,
+             'src_nfeats': len(onmt.io.collect_features(fields, 'src')),
+             'tgt_nfeats': len(onmt.io.collect_features(fields, 'tgt')),
+             'src_vocab': onmt.io.read_vocab_file(opt.src_vocab, "source"),
+             'tgt_vocab': onmt.io.read_vocab_file(opt.tgt_vocab, "target")}
+
+    if opt.data_format == 'bin':
+        logger.info("Counting vocabulary...")
+        results = run_shard_tasks(
+            [('count',) + task for task in tasks['train']],
+            state, opt, logger)
+        fields = build_save_text_vocab(
+            merge_counters(r[2] for r in results), fields, opt, logger)
+        state['fields'] = fields
+
+        logger.info("Building & saving training data...")
+        run_shard_tasks([('bin',) + task for task in tasks['train']],
+                        state, opt, logger)
+    else:
+        logger.info("Building & saving training data...")
+        results = run_shard_tasks(
+            [('pt',) + task for task in tasks['train']],
+            state, opt, logger)
 
-        ret_list.append(pt_file)
+        logger.info("Building & saving vocabulary...")
+        build_save_text_vocab(merge_counters(r[2] for r in results),
+                              fields, opt, logger)
 
-    return ret_list
+    logger.info("Building & saving validation data...")
+    run_shard_tasks([(opt.data_format,) + task for task in tasks['valid']],
+                    state, opt, logger)
 
 
 def build_save_dataset(corpus_type, fields, opt, logger=None):
@@ -127,12 +379,6 @@ def build_save_dataset(corpus_type, fields, opt, logger=None):
         src_corpus = opt.valid_src
         tgt_corpus = opt.valid_tgt
 
-    # Currently we only do preprocess sharding for corpus: data_type=='text'.
-    if opt.data_type == 'text':
-        return build_save_text_dataset_in_shards(
-            src_corpus, tgt_corpus, fields,
-            corpus_type, opt)
-
     # For data_type == 'img' or 'audio', currently we don't do
     # preprocess sharding. We only build a monolithic dataset.
     # But since the interfaces are uniform, it would be not hard
@@ -177,6 +423,20 @@ def build_save_vocab(train_dataset, fields, opt, logger=None):
     torch.save(onmt.io.save_fields_to_vocab(fields), vocab_file)
 
 
+def build_save_text_vocab(counter, fields, opt, logger=None):
+    fields = onmt.io.build_vocab_from_counter(counter, fields, opt.data_type,
+                                              opt.share_vocab,
+                                              opt.src_vocab_size,
+                                              opt.src_words_min_frequency,
+                                              opt.tgt_vocab_size,
+                                              opt.tgt_words_min_frequency,
+                                              logger)
+
+    vocab_file = opt.save_data + '.vocab.pt'
+    torch.save(onmt.io.save_fields_to_vocab(fields), vocab_file)
+    return fields
+
+
 def main():
     opt = parse_args()
     logger = get_logger(opt.log_file)
@@ -190,6 +450,11 @@ def main():
     logger.info("Building `Fields` object...")
     fields = onmt.io.get_fields(opt.data_type, src_nfeats, tgt_nfeats)
 
+    # Currently we only do preprocess sharding for corpus: data_type=='text'.
+    if opt.data_type == 'text':
+        build_save_text_dataset_in_shards(fields, opt, logger)
+        return
+
     logger.info("Building & saving training data...")
     train_dataset_files = build_save_dataset('train', fields, opt, logger)
 
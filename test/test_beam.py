@@ -0,0 +1,120 @@
+import unittest
+
+import torch
+
+from onmt.translate import Beam, BatchBeam, GNMTGlobalScorer
+from onmt.translate.Beam import NGramBlocker
+
+PAD, BOS, EOS = 1, 2, 3
+
+
+class TestBatchBeam(unittest.TestCase):
+    """
+    `BatchBeam` must find the translations of one `Beam` per sentence.
+    """
+
+    batch_size = 5
+    beam_size = 4
+    n_words = 8
+    src_len = 6
+    max_length = 12
+
+    def run_beams(self, scorer, n_best=1, **kwargs):
+        torch.manual_seed(1)
+        steps = self.max_length
+        rows = self.batch_size * self.beam_size
+        # Few words and a likely EOS: the beams finish at various steps.
+        log_probs = torch.randn(steps, rows, self.n_words)
+        log_probs[:, :, EOS] += 1
+        log_probs = torch.nn.functional.log_softmax(log_probs, -1)
+        attns = torch.nn.functional.softmax(
+            torch.randn(steps, rows, self.src_len), -1)
+        lengths = torch.LongTensor(self.batch_size).random_(
+            2, self.src_len + 1)
+        lengths[0] = self.src_len
+
+        beams = [Beam(self.beam_size, PAD, BOS, EOS, n_best=n_best,
+                      global_scorer=scorer, **kwargs)
+                 for _ in range(self.batch_size)]
+        for t in range(steps):
+            for b, beam in enumerate(beams):
+                if beam.done():
+                    continue
+                sent_rows = slice(b * self.beam_size,
+                                  (b + 1) * self.beam_size)
+                # The attention of a single sentence is not padded.
+                beam.advance(log_probs[t, sent_rows].clone(),
+                             attns[t, sent_rows, :lengths[b]])
+
+        batch_beam = BatchBeam(self.beam_size, self.batch_size, PAD, BOS,
+                               EOS, n_best=n_best, global_scorer=scorer,
+                               memory_lengths=lengths, **kwargs)
+        for t in range(steps):
+            if batch_beam.done():
+                break
+            live = batch_beam.batch_offset.view(-1, 1) * self.beam_size \
+                + torch.arange(0, self.beam_size).long().view(1, -1)
+            live = live.view(-1)
+            batch_beam.advance(log_probs[t].index_select(0, live),
+                               attns[t].index_select(0, live))
+
+        for b, beam in enumerate(beams):
+            scores, ks = beam.sort_finished(minimum=n_best)
+            batch_scores, hyps = batch_beam.sort_finished(b, minimum=n_best)
+            self.assertEqual(len(scores), len(batch_scores))
+            for score, (timestep, k), batch_score, (hyp, attn) in zip(
+                    scores, ks, batch_scores, hyps):
+                ref_hyp, ref_attn = beam.get_hyp(timestep, k)
+                self.assertEqual([int(w) for w in ref_hyp], hyp)
+                self.assertAlmostEqual(float(score), float(batch_score),
+                                       places=4)
+                self.assertTrue(ref_attn.sub(attn).abs().max() < 1e-6)
+
+    def test_no_penalty(self):
+        self.run_beams(GNMTGlobalScorer(0., 0., "none", "none"), n_best=2)
+
+    def test_length_penalty(self):
+        self.run_beams(GNMTGlobalScorer(0.6, 0., "none", "wu"))
+        self.run_beams(GNMTGlobalScorer(0., 0., "none", "avg"))
+
+    def test_coverage_penalty(self):
+        self.run_beams(GNMTGlobalScorer(0.6, 0.2, "wu", "wu"), n_best=2)
+        self.run_beams(GNMTGlobalScorer(0., 0.2, "summary", "none"))
+
+    def test_stepwise_coverage_penalty(self):
+        self.run_beams(GNMTGlobalScorer(0.6, 0.2, "wu", "wu"),
+                       stepwise_penalty=True)
+        self.run_beams(GNMTGlobalScorer(0., 0.2, "summary", "none"),
+                       stepwise_penalty=True)
+
+    def test_block_ngram_repeat(self):
+        self.run_beams(GNMTGlobalScorer(0., 0., "none", "none"),
+                       block_ngram_repeat=1)
+        self.run_beams(GNMTGlobalScorer(0.6, 0.2, "wu", "wu"), n_best=2,
+                       block_ngram_repeat=2, exclusion_tokens=set([4]))
+
+    def test_min_length(self):
+        self.run_beams(GNMTGlobalScorer(0., 0., "none", "none"),
+                       min_length=4)
+
+
+class TestNGramBlocker(unittest.TestCase):
+
+    def test_update(self):
+        torch.manual_seed(2)
+        n_hyps, n_words, n = 6, 4, 2
+        excluded = set([0])
+        blocker = NGramBlocker(n, excluded)
+        hyps = [[] for _ in range(n_hyps)]
+        for step in range(10):
+            origin = torch.LongTensor(n_hyps).random_(0, n_hyps)
+            tokens = torch.LongTensor(n_hyps).random_(0, n_words)
+            hyps = [hyps[int(o)] + [int(w)]
+                    for o, w in zip(origin, tokens)]
+            blocked = blocker.update(origin, tokens, n_words)
+            for hyp, is_blocked in zip(hyps, blocked.tolist()):
+                grams = [tuple(hyp[i:i + n])
+                         for i in range(len(hyp) - n + 1)]
+                grams = [g for g in grams if not set(g) & excluded]
+                self.assertEqual(len(grams) != len(set(grams)),
+                                 bool(is_blocked))
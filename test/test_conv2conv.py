@@ -0,0 +1,88 @@
+import unittest
+
+import torch
+
+from onmt.modules import Embeddings, CNNEncoder, CNNDecoder
+
+
+class TestCNNDecoder(unittest.TestCase):
+    """
+    Decoding one step at a time with the cache of the decoder state must
+    give the outputs of decoding the whole target at once.
+    """
+
+    hidden_size = 8
+    n_words = 20
+    src_len = 7
+    tgt_len = 9
+    batch_size = 3
+
+    def make_model(self, position_encoding):
+        torch.manual_seed(7)
+        encoder = CNNEncoder(2, self.hidden_size, 3, 0.,
+                             Embeddings(self.hidden_size, self.n_words, 1))
+        decoder = CNNDecoder(2, self.hidden_size, "general", False, 3, 0.,
+                             Embeddings(self.hidden_size, self.n_words, 1,
+                                        position_encoding=position_encoding))
+        for module in [encoder, decoder]:
+            module.double()
+            module.eval()
+            for p in module.parameters():
+                p.data.uniform_(-0.5, 0.5)
+            for m in module.modules():
+                # Evaluate WeightNorm layers with their current weights.
+                if hasattr(m, "polyak_decay"):
+                    m.polyak_decay = 0.
+        return encoder, decoder
+
+    def encode(self, encoder):
+        src = torch.LongTensor(self.src_len, self.batch_size, 1).random_(
+            2, self.n_words)
+        tgt = torch.LongTensor(self.tgt_len, self.batch_size, 1).random_(
+            2, self.n_words)
+        enc_out, memory_bank = encoder(src)
+        return src, tgt, enc_out, memory_bank
+
+    def test_incremental_decoding(self):
+        for position_encoding in [False, True]:
+            encoder, decoder = self.make_model(position_encoding)
+            with torch.no_grad():
+                src, tgt, enc_out, memory_bank = self.encode(encoder)
+                state = decoder.init_decoder_state(src, memory_bank, enc_out)
+                full_out, _, full_attns = decoder(tgt, memory_bank, state)
+
+                state = decoder.init_decoder_state(src, memory_bank, enc_out)
+                outs, attns = [], []
+                for t in range(self.tgt_len):
+                    out, state, attn = decoder(tgt[t:t + 1], memory_bank,
+                                               state)
+                    outs.append(out)
+                    attns.append(attn["std"])
+                self.assertTrue(state.cache is not None)
+            self.assertTrue(
+                torch.cat(outs).sub(full_out).abs().max() < 1e-10)
+            self.assertTrue(torch.cat(attns).sub(full_attns["std"])
+                            .abs().max() < 1e-10)
+
+    def test_reorder_cache(self):
+        encoder, decoder = self.make_model(False)
+        # As the translator reorders the beam and drops finished rows.
+        positions = torch.LongTensor([2, 0, 2, 1])
+        with torch.no_grad():
+            src, tgt, enc_out, memory_bank = self.encode(encoder)
+            state = decoder.init_decoder_state(src, memory_bank, enc_out)
+            for t in range(4):
+                _, state, _ = decoder(tgt[t:t + 1], memory_bank, state)
+            state.index_select(positions)
+            tgt = tgt.index_select(1, positions)
+            memory_bank = memory_bank.index_select(1, positions)
+            outs = []
+            for t in range(4, self.tgt_len):
+                out, state, _ = decoder(tgt[t:t + 1], memory_bank, state)
+                outs.append(out)
+
+            state = decoder.init_decoder_state(
+                src.index_select(1, positions), memory_bank,
+                enc_out.index_select(1, positions))
+            full_out, _, _ = decoder(tgt, memory_bank, state)
+        self.assertTrue(torch.cat(outs).sub(full_out[4:]).abs().max() < 1e-10)
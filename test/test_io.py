@@ -0,0 +1,141 @@
+import os
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+
+import onmt
+import onmt.io
+from onmt.io import bucket_batches, padding_efficiency, \
+    BinaryTextDataset, BinaryTextIterator
+from onmt.io.DatasetBase import UNK_WORD, BOS_WORD, EOS_WORD
+
+
+class TestBucketBatches(unittest.TestCase):
+
+    def setUp(self):
+        lengths = [(1 + (7 * i) % 13, 2 + (5 * i) % 11) for i in range(50)]
+        self.lengths = lengths
+
+    def padded_tokens(self, batch):
+        return len(batch) * (max(self.lengths[i][0] for i in batch) +
+                             max(self.lengths[i][1] for i in batch))
+
+    def check_batches(self, batches, batch_tokens):
+        examples = sorted(i for batch in batches for i in batch)
+        self.assertEqual(examples, list(range(len(self.lengths))))
+        for batch in batches:
+            if len(batch) > 1:
+                self.assertTrue(self.padded_tokens(batch) <= batch_tokens)
+
+    def test_budget(self):
+        for batch_tokens in [1, 20, 64, 1000]:
+            self.check_batches(bucket_batches(self.lengths, batch_tokens),
+                               batch_tokens)
+
+    def test_sorted(self):
+        batches = bucket_batches(self.lengths, 64, train=False)
+        examples = [i for batch in batches for i in batch]
+        self.assertEqual(examples, sorted(range(len(self.lengths)),
+                                          key=lambda i: self.lengths[i]))
+
+    def test_batch_multiple(self):
+        for batch_tokens in [40, 64, 200]:
+            batches = bucket_batches(self.lengths, batch_tokens,
+                                     batch_multiple=4, train=False)
+            self.check_batches(batches, batch_tokens)
+            # Only a remainder of the rounding or the last batch are not
+            # a multiple of 4.
+            for batch in batches[:-1]:
+                self.assertTrue(len(batch) % 4 == 0 or len(batch) < 4)
+
+    def test_remainder(self):
+        # Rounding the 5 short examples down to 4 leaves one, which does
+        # not fit with the long example either.
+        self.lengths = [(1, 1)] * 5 + [(9, 9)]
+        batches = bucket_batches(self.lengths, 20, batch_multiple=4,
+                                 train=False)
+        self.check_batches(batches, 20)
+        self.assertEqual(batches, [[0, 1, 2, 3], [4], [5]])
+
+    def test_padding_efficiency(self):
+        lengths = [(2, 3), (4, 1), (4, 4)]
+        self.assertAlmostEqual(padding_efficiency([[0, 1], [2]], lengths),
+                               18. / 22)
+        self.assertEqual(padding_efficiency([[2]], lengths), 1.)
+        # Buckets of similar lengths waste less than batches in order.
+        in_order = [list(range(i, min(i + 5, len(self.lengths))))
+                    for i in range(0, len(self.lengths), 5)]
+        buckets = bucket_batches(self.lengths, 100)
+        self.assertTrue(len(buckets) <= len(in_order))
+        self.assertTrue(padding_efficiency(buckets, self.lengths) >
+                        padding_efficiency(in_order, self.lengths))
+
+
+class TestBinaryTextDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fields = onmt.io.get_fields("text", 1, 0)
+        self.examples = [
+            {"src": ("a", "b", "c"), "src_feat_0": ("N", "V", "N"),
+             "tgt": ("x", "y"), "indices": 0},
+            {"src": ("b", "oov"), "src_feat_0": ("V", "N"),
+             "tgt": ("y", "z", "x", "oov"), "indices": 1},
+            {"src": ("c",), "src_feat_0": ("N",),
+             "tgt": (), "indices": 2},
+        ]
+        counter = dict((key, Counter()) for key in self.fields)
+        for ex in self.examples[:1]:
+            for key in ["src", "src_feat_0", "tgt"]:
+                counter[key].update(ex[key])
+        counter["tgt"].update(["z"])
+        onmt.io.build_vocab_from_counter(counter, self.fields, "text",
+                                         False, 0, 1, 0, 1)
+        self.path = os.path.join(self.dir, "data.train.1.bin")
+        self.n_written = BinaryTextDataset.save(
+            self.path, self.fields, iter(self.examples), 1, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def tokens(self, ex, key):
+        """ `ex[key]` as numericalized and read back. """
+        vocab = self.fields[key].vocab
+        return [tok if tok in vocab.stoi else UNK_WORD for tok in ex[key]]
+
+    def test_round_trip(self):
+        self.assertEqual(self.n_written, len(self.examples))
+        dataset = BinaryTextDataset(self.path, self.fields)
+        self.assertEqual(len(dataset), len(self.examples))
+        self.assertEqual(dataset.keys, ["src", "src_feat_0", "tgt"])
+        self.assertEqual(dataset.indices.tolist(),
+                         [ex["indices"] for ex in self.examples])
+        self.assertEqual(dataset.lengths("tgt").tolist(),
+                         [len(ex["tgt"]) for ex in self.examples])
+        for i, ex in enumerate(self.examples):
+            for key in dataset.keys:
+                itos = self.fields[key].vocab.itos
+                self.assertEqual(
+                    [itos[j] for j in dataset.tokens(key, i)],
+                    self.tokens(ex, key))
+
+    def test_batches(self):
+        dataset = BinaryTextDataset(self.path, self.fields)
+        batches = list(BinaryTextIterator(dataset, 3, train=False))
+        self.assertEqual(len(batches), 1)
+        batch = batches[0]
+        # Sorted by decreasing source length.
+        self.assertEqual(batch.indices.tolist(), [0, 1, 2])
+        src, src_lengths = batch.src
+        self.assertEqual(src_lengths.tolist(), [3, 2, 1])
+        itos = self.fields["tgt"].vocab.itos
+        for b, ex in enumerate(self.examples):
+            tgt = [itos[j] for j in batch.tgt[:, b].tolist()]
+            self.assertEqual(tgt[:len(ex["tgt"]) + 2],
+                             [BOS_WORD] + self.tokens(ex, "tgt") +
+                             [EOS_WORD])
+            self.assertEqual(
+                set(tgt[len(ex["tgt"]) + 2:]) - set([onmt.io.PAD_WORD]),
+                set())
+        self.assertEqual(batch.src_feat_0.size(), src.size())
@@ -0,0 +1,135 @@
+import unittest
+from collections import Counter
+
+import torch
+import torch.nn as nn
+from torch.autograd import gradcheck
+
+import onmt
+import onmt.io
+from onmt.Loss import NMTLossCompute
+from onmt.modules import chunked_log_softmax
+
+
+def make_tgt_vocab(n_words):
+    fields = onmt.io.get_fields("text", 0, 0)
+    counter = {"src": Counter(), "tgt": Counter(
+        dict(("w%d" % i, n_words - i) for i in range(n_words)))}
+    onmt.io.build_vocab_from_counter(counter, fields, "text", False,
+                                     0, 1, 0, 1)
+    return fields["tgt"].vocab
+
+
+class TestSmoothedLoss(unittest.TestCase):
+    """
+    The label smoothed loss, computed from the target, padding and summed
+    scores of each row, must be the KL-divergence to the dense smoothed
+    target distribution.
+    """
+
+    dim = 6
+    tgt_len = 5
+    batch_size = 3
+
+    def setUp(self):
+        torch.manual_seed(3)
+        self.tgt_vocab = make_tgt_vocab(11)
+        self.padding_idx = self.tgt_vocab.stoi[onmt.io.PAD_WORD]
+        self.generator = nn.Sequential(
+            nn.Linear(self.dim, len(self.tgt_vocab)), nn.LogSoftmax(dim=-1))
+        self.target = torch.LongTensor(self.tgt_len, self.batch_size) \
+            .random_(0, len(self.tgt_vocab))
+        self.target[-2:, 0] = self.padding_idx
+
+    def kl_div_loss(self, output, label_smoothing):
+        """ The former dense computation of the smoothed loss. """
+        scores = self.generator(output.view(-1, self.dim))
+        gtruth = self.target.view(-1)
+        one_hot = torch.Tensor(1, len(self.tgt_vocab)).fill_(
+            label_smoothing / (len(self.tgt_vocab) - 2))
+        one_hot[0][self.padding_idx] = 0
+        smoothed = one_hot.repeat(gtruth.size(0), 1)
+        smoothed.scatter_(1, gtruth.unsqueeze(1), 1 - label_smoothing)
+        smoothed.masked_fill_(
+            gtruth.eq(self.padding_idx).unsqueeze(1).expand_as(smoothed), 0)
+        return nn.KLDivLoss(size_average=False)(scores, smoothed)
+
+    def check_loss(self, label_smoothing, generator_chunk_size=0):
+        output = torch.randn(self.tgt_len, self.batch_size, self.dim,
+                             requires_grad=True)
+        ref_loss = self.kl_div_loss(output, label_smoothing)
+        ref_grad, = torch.autograd.grad(ref_loss, output)
+
+        loss_compute = NMTLossCompute(
+            self.generator, self.tgt_vocab,
+            label_smoothing=label_smoothing,
+            generator_chunk_size=generator_chunk_size)
+        loss, stats = loss_compute._compute_loss(None, output, self.target)
+        grad, = torch.autograd.grad(loss, output)
+
+        self.assertAlmostEqual(float(loss), float(ref_loss), places=4)
+        self.assertTrue(grad.sub(ref_grad).abs().max() < 1e-5)
+        self.assertEqual(int(stats.n_words),
+                         int(self.target.ne(self.padding_idx).sum()))
+
+    def test_smoothed_loss(self):
+        self.check_loss(0.1)
+        self.check_loss(0.5)
+
+    def test_chunked_smoothed_loss(self):
+        self.check_loss(0.1, generator_chunk_size=4)
+
+
+class TestChunkedLogSoftmax(unittest.TestCase):
+
+    n_rows = 5
+    dim = 4
+    n_vocab = 10
+
+    def setUp(self):
+        torch.manual_seed(4)
+        self.hidden = torch.randn(self.n_rows, self.dim).double()
+        self.weight = torch.randn(self.n_vocab, self.dim).double()
+        self.bias = torch.randn(self.n_vocab).double()
+        # Not the masked column 2, whose log-prob is -inf.
+        self.index = torch.LongTensor(self.n_rows, 3).random_(
+            3, self.n_vocab)
+
+    def test_forward(self):
+        for chunk_size in [1, 3, self.n_vocab]:
+            for mask_index in [None, 2]:
+                logits = self.hidden.mm(self.weight.t()) + self.bias
+                if mask_index is not None:
+                    logits[:, mask_index] = -float('inf')
+                log_probs = torch.nn.functional.log_softmax(logits, -1)
+                kept = torch.LongTensor(
+                    [j for j in range(self.n_vocab) if j != mask_index])
+                ref_sum = log_probs.index_select(1, kept).sum(1)
+                ref_max, ref_argmax = log_probs.max(1)
+
+                gathered, sum_log_probs, max_log_prob, argmax = \
+                    chunked_log_softmax(self.hidden, self.weight, self.bias,
+                                        self.index, chunk_size, mask_index)
+                self.assertTrue(gathered.sub(log_probs.gather(
+                    1, self.index)).abs().max() < 1e-10)
+                self.assertTrue(
+                    sum_log_probs.sub(ref_sum).abs().max() < 1e-10)
+                self.assertTrue(
+                    max_log_prob.sub(ref_max).abs().max() < 1e-10)
+                self.assertTrue(argmax.eq(ref_argmax).all())
+
+    def test_gradcheck(self):
+        for chunk_size in [3, self.n_vocab]:
+            for bias in [self.bias, None]:
+                for mask_index in [None, 2]:
+                    inputs = [self.hidden.clone().requires_grad_(),
+                              self.weight.clone().requires_grad_()]
+                    if bias is not None:
+                        inputs.append(bias.clone().requires_grad_())
+
+                    def fn(hidden, weight, bias=None):
+                        return chunked_log_softmax(
+                            hidden, weight, bias, self.index, chunk_size,
+                            mask_index)[:2]
+                    self.assertTrue(gradcheck(fn, inputs, eps=1e-6,
+                                              atol=1e-5))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import preprocess
+
+
+class TestSplitCorpus(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.src_lines = [u" ".join([u"w%d" % j] * (1 + j % 7))
+                          for j in range(40)]
+        self.src_lines[3] = u""
+        self.src_lines[8] = u"é ü ß"
+        self.tgt_lines = [u"t%d" % (j % 3) * (j % 5) for j in range(40)]
+        self.src = self.write("src.txt", self.src_lines)
+        # No newline after the last line.
+        self.tgt = self.write("tgt.txt", self.tgt_lines, end=u"")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, lines, end=u"\n"):
+        path = os.path.join(self.dir, name)
+        with io.open(path, "w", encoding="utf-8") as f:
+            f.write(u"\n".join(lines) + end)
+        return path
+
+    def check_ranges(self, path, ranges):
+        with open(path, "rb") as f:
+            data = f.read()
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(data))
+        for (_, end), (start, _) in zip(ranges[:-1], ranges[1:]):
+            self.assertEqual(end, start)
+            # Ranges begin at the start of a line.
+            self.assertEqual(data[start - 1:start], b"\n")
+
+    def check_split(self, shard_size, n_shards):
+        shards = preprocess.split_corpus(self.src, self.tgt, shard_size,
+                                         n_shards)
+        src_ranges = [src_range for src_range, _ in shards]
+        tgt_ranges = [tgt_range for _, tgt_range in shards]
+        self.check_ranges(self.src, src_ranges)
+        self.check_ranges(self.tgt, tgt_ranges)
+
+        src_lines, tgt_lines = [], []
+        for (src_start, src_end), (tgt_start, tgt_end) in shards:
+            src_shard = preprocess.read_lines(self.src, src_start, src_end)
+            tgt_shard = preprocess.read_lines(self.tgt, tgt_start, tgt_end)
+            # Both sides of a shard hold the same lines.
+            self.assertEqual(len(src_shard), len(tgt_shard))
+            src_lines += src_shard
+            tgt_lines += tgt_shard
+        self.assertEqual(src_lines, self.src_lines)
+        self.assertEqual(tgt_lines, self.tgt_lines)
+        return shards
+
+    def test_shard_size(self):
+        for shard_size in [1, 7, 50, 10 ** 6]:
+            shards = self.check_split(shard_size, 0)
+            for (src_start, src_end), _ in shards[:-1]:
+                self.assertTrue(src_end - src_start >= shard_size)
+
+    def test_n_shards(self):
+        for n_shards in [1, 3, 8]:
+            shards = self.check_split(0, n_shards)
+            self.assertTrue(len(shards) <= n_shards)
+
+    def test_newline_offsets(self):
+        with open(self.src, "rb") as f:
+            data = f.read()
+        newlines = [i + 1 for i, c in enumerate(bytearray(data))
+                    if c == ord(b"\n")]
+        line_counts = [1, 2, 9, 10, 40]
+        for block_size in [1, 5, 1 << 20]:
+            self.assertEqual(
+                preprocess.newline_offsets(self.src, line_counts,
+                                           block_size),
+                [newlines[n - 1] for n in line_counts])
+
+    def test_different_lengths(self):
+        self.tgt = self.write("tgt.txt", self.tgt_lines[:20])
+        with self.assertRaises(AssertionError):
+            preprocess.split_corpus(self.src, self.tgt, 50, 0)
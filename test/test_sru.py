@@ -0,0 +1,55 @@
+import itertools
+import unittest
+
+import torch
+
+from onmt.modules.SRU import SRU_Compute, _reference_sru
+
+
+class TestSRUCompute(unittest.TestCase):
+    """
+    The CPU `SRU_Compute` must give the hidden states, last cell states
+    and gradients of the plain loop `_reference_sru`.
+    """
+
+    d_out = 3
+    batch_size = 2
+
+    def check_sru(self, activation_type, k, bidirectional, length,
+                  masked):
+        torch.manual_seed(8)
+        width = self.d_out * (2 if bidirectional else 1)
+        n_in = width if k == 3 else 5
+        x = torch.randn(length, self.batch_size, n_in).double() \
+            .requires_grad_()
+        u = torch.randn(length * self.batch_size, width * k).double() \
+            .requires_grad_()
+        bias = torch.randn(2 * width).double().requires_grad_()
+        init = torch.randn(self.batch_size, width).double().requires_grad_()
+        mask_h = torch.rand(self.batch_size, width).double() if masked \
+            else None
+        # The highway input is a column of u when k is 4.
+        inputs = [u, bias, init] + ([x] if k == 3 else [])
+
+        h, last = SRU_Compute(activation_type, self.d_out, bidirectional)(
+            u, x, bias, init, mask_h)
+        grad_h, grad_last = torch.randn_like(h), torch.randn_like(last)
+        grads = torch.autograd.grad(
+            (h * grad_h).sum() + (last * grad_last).sum(), inputs)
+
+        ref_h, ref_last = _reference_sru(u, x, bias, init, activation_type,
+                                         self.d_out, bidirectional, mask_h)
+        ref_grads = torch.autograd.grad(
+            (ref_h * grad_h).sum() + (ref_last * grad_last).sum(), inputs)
+
+        for a, b in zip([h, last] + list(grads),
+                        [ref_h, ref_last] + list(ref_grads)):
+            self.assertEqual(a.size(), b.size())
+            self.assertTrue(a.sub(b).abs().max() < 1e-10)
+
+    def test_sru_compute(self):
+        for activation_type, k, bidirectional, length, masked in \
+                itertools.product([0, 1, 2], [3, 4], [False, True], [1, 5],
+                                  [False, True]):
+            self.check_sru(activation_type, k, bidirectional, length,
+                           masked)
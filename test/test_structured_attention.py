@@ -0,0 +1,65 @@
+import unittest
+
+import torch
+
+from onmt.modules import MatrixTree
+from onmt.modules import StructuredAttention
+
+
+def loop_matrix_tree(input, eps=1e-5):
+    """ The former `MatrixTree.forward`, one Laplacian at a time. """
+    laplacian = input.exp() + eps
+    output = input.clone()
+    for b in range(input.size(0)):
+        lap = laplacian[b].masked_fill(
+            torch.eye(input.size(1)).type_as(input).ne(0), 0)
+        lap = -lap + torch.diag(lap.sum(0))
+        # store roots on diagonal
+        lap[0] = input[b].diag().exp()
+        inv_laplacian = lap.inverse()
+
+        factor = inv_laplacian.diag().unsqueeze(1)\
+                                     .expand_as(input[b]).transpose(0, 1)
+        term1 = input[b].exp().mul(factor).clone()
+        term2 = input[b].exp().mul(inv_laplacian.transpose(0, 1)).clone()
+        term1[:, 0] = 0
+        term2[0] = 0
+        output[b] = term1 - term2
+        roots_output = input[b].diag().exp().mul(
+            inv_laplacian.transpose(0, 1)[0])
+        output[b] = output[b] + torch.diag(roots_output)
+    return output
+
+
+class TestMatrixTree(unittest.TestCase):
+
+    def check_matrix_tree(self):
+        torch.manual_seed(6)
+        matrix_tree = MatrixTree()
+        for batch_size, n in [(1, 1), (1, 5), (4, 7)]:
+            input = torch.rand(batch_size, n, n).double()
+            grad_output = torch.randn(batch_size, n, n).double()
+
+            batched_input = input.clone().requires_grad_()
+            output = matrix_tree(batched_input)
+            grad, = torch.autograd.grad((output * grad_output).sum(),
+                                        batched_input)
+
+            loop_input = input.clone().requires_grad_()
+            ref_output = loop_matrix_tree(loop_input)
+            ref_grad, = torch.autograd.grad(
+                (ref_output * grad_output).sum(), loop_input)
+
+            self.assertTrue(output.sub(ref_output).abs().max() < 1e-10)
+            self.assertTrue(grad.sub(ref_grad).abs().max() < 1e-10)
+
+    def test_matrix_tree(self):
+        self.check_matrix_tree()
+
+    def test_matrix_tree_without_batched_inverse(self):
+        batched_inverse = StructuredAttention._batched_inverse
+        StructuredAttention._batched_inverse = False
+        try:
+            self.check_matrix_tree()
+        finally:
+            StructuredAttention._batched_inverse = batched_inverse
@@ -0,0 +1,92 @@
+import unittest
+from collections import Counter
+
+import torch
+import torchtext
+
+import onmt
+import onmt.io
+from onmt.io import TextDataset
+from onmt.io.DatasetBase import UNK_WORD, PAD_WORD
+
+
+class Batch(object):
+    def __init__(self, indices):
+        self.indices = indices
+        self.batch_size = indices.size(0)
+
+
+class TestCollapseCopyScores(unittest.TestCase):
+    """
+    The copy scores collapsed with the copy maps of the dataset must be
+    those of the former loop over the dynamic dictionary of each example.
+    """
+
+    def setUp(self):
+        torch.manual_seed(5)
+        fields = onmt.io.get_fields("text", 0, 0)
+        tgt_words = ["a", "b", "c", "d", "e"]
+        onmt.io.build_vocab_from_counter(
+            {"src": Counter(), "tgt": Counter(tgt_words)}, fields, "text",
+            False, 0, 1, 0, 1)
+        self.tgt_vocab = fields["tgt"].vocab
+        sentences = [["a", "x", "b"], ["y"], ["c", "d", "z", "a", "e"],
+                     ["x", "e"]]
+        self.src_vocabs = [
+            torchtext.vocab.Vocab(Counter(words),
+                                  specials=[UNK_WORD, PAD_WORD])
+            for words in sentences]
+        self.copy_maps = TextDataset.make_copy_maps(self.src_vocabs,
+                                                    self.tgt_vocab)
+        self.n_extra = max(len(v) for v in self.src_vocabs)
+
+    def loop_collapse(self, scores, indices):
+        """ The former `collapse_copy_scores`. """
+        offset = len(self.tgt_vocab)
+        for b in range(indices.size(0)):
+            blank, fill = [], []
+            src_vocab = self.src_vocabs[int(indices[b])]
+            for i in range(1, len(src_vocab)):
+                ti = self.tgt_vocab.stoi[src_vocab.itos[i]]
+                if ti != 0:
+                    blank.append(offset + i)
+                    fill.append(ti)
+            if blank:
+                blank = torch.LongTensor(blank)
+                fill = torch.LongTensor(fill)
+                scores[:, b].index_add_(
+                    1, fill, scores[:, b].index_select(1, blank))
+                scores[:, b].index_fill_(1, blank, 1e-10)
+        return scores
+
+    def random_scores(self, batch_size):
+        return torch.rand(3, batch_size, len(self.tgt_vocab) + self.n_extra)
+
+    def test_collapse_copy_scores(self):
+        indices = torch.LongTensor([2, 0, 3, 1])
+        batch = Batch(indices)
+        scores = self.random_scores(indices.size(0))
+        ref = self.loop_collapse(scores.clone(), indices)
+        out = TextDataset.collapse_copy_scores(
+            scores, batch, self.tgt_vocab, self.copy_maps)
+        self.assertTrue(out.sub(ref).abs().max() < 1e-6)
+
+    def test_batch_offset(self):
+        indices = torch.LongTensor([2, 0, 3, 1])
+        batch = Batch(indices)
+        TextDataset.collapse_copy_scores(
+            self.random_scores(indices.size(0)), batch, self.tgt_vocab,
+            self.copy_maps)
+        copy_fill = batch.copy_fill
+        # The batch shrinks as its sentences are done.
+        for batch_offset in [[0, 2, 3], [3, 0], [2]]:
+            batch_offset = torch.LongTensor(batch_offset)
+            scores = self.random_scores(batch_offset.size(0))
+            ref = self.loop_collapse(
+                scores.clone(), indices.index_select(0, batch_offset))
+            out = TextDataset.collapse_copy_scores(
+                scores, batch, self.tgt_vocab, self.copy_maps,
+                batch_offset=batch_offset)
+            self.assertTrue(out.sub(ref).abs().max() < 1e-6)
+        # The copy maps of the batch were built once.
+        self.assertTrue(batch.copy_fill is copy_fill)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Startup benchmark: time of `import onmt` and of the imports of the
+command line tools, each in fresh interpreters, next to the time of
+`import torch` which they can't go below.
+
+    PYTHONPATH=. python tools/bench_import.py -repeat 5
+"""
+from __future__ import division, print_function
+import argparse
+import subprocess
+import sys
+
+
+STATEMENTS = [
+    "import torch",
+    "import onmt",
+    "import onmt.opts",
+    "import onmt.io",
+    "import onmt.modules",
+    "from onmt.translate.Translator import make_translator",
+    "import onmt.translate",
+]
+
+TIMER = ("%s\nimport time\nstart = time.time()\n%s\n"
+         "print(time.time() - start)")
+
+
+def time_import(statement, repeat, setup=""):
+    """
+    Median time of `statement` over `repeat` new interpreters, after
+    `setup` (not timed).
+    """
+    times = sorted(
+        float(subprocess.check_output(
+            [sys.executable, "-c", TIMER % (setup, statement)])
+            .decode().split()[-1])
+        for _ in range(repeat))
+    return times[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bench_import.py")
+    parser.add_argument("-repeat", type=int, default=5,
+                        help="Number of interpreters started per import.")
+    opt = parser.parse_args()
+
+    print("%-56s %8s %12s" % ("import", "seconds", "over torch"))
+    for statement in STATEMENTS:
+        total = time_import(statement, opt.repeat)
+        over_torch = time_import(statement, opt.repeat, "import torch")
+        print("%-56s %8.3f %12.3f" % (statement, total, over_torch))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Benchmark of the batched `onmt.modules.MatrixTree` against the former
+loop over the batch, which built and inverted one Laplacian at a time,
+over `[batch, n, n]` inputs. Also prints the largest difference between
+their marginals.
+
+    PYTHONPATH=. python tools/bench_matrix_tree.py -batch_sizes 16 64 \
+        -sizes 10 30 50 -gpu 0
+"""
+from __future__ import division, print_function
+import argparse
+import time
+
+import torch
+
+from onmt.modules import MatrixTree
+
+
+def loop_matrix_tree(input, eps=1e-5):
+    """ The former `MatrixTree.forward`, on the device of `input`. """
+    laplacian = input.exp() + eps
+    output = input.clone()
+    for b in range(input.size(0)):
+        lap = laplacian[b].masked_fill(
+            torch.eye(input.size(1)).type_as(input).ne(0), 0)
+        lap = -lap + torch.diag(lap.sum(0))
+        # store roots on diagonal
+        lap[0] = input[b].diag().exp()
+        inv_laplacian = lap.inverse()
+
+        factor = inv_laplacian.diag().unsqueeze(1)\
+                                     .expand_as(input[b]).transpose(0, 1)
+        term1 = input[b].exp().mul(factor).clone()
+        term2 = input[b].exp().mul(inv_laplacian.transpose(0, 1)).clone()
+        term1[:, 0] = 0
+        term2[0] = 0
+        output[b] = term1 - term2
+        roots_output = input[b].diag().exp().mul(
+            inv_laplacian.transpose(0, 1)[0])
+        output[b] = output[b] + torch.diag(roots_output)
+    return output
+
+
+def time_fn(fn, input, repeat, cuda):
+    """ Median time of `fn(input)` over `repeat` calls. """
+    times = []
+    for _ in range(repeat):
+        if cuda:
+            torch.cuda.synchronize()
+        start = time.time()
+        fn(input)
+        if cuda:
+            torch.cuda.synchronize()
+        times.append(time.time() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bench_matrix_tree.py")
+    parser.add_argument("-batch_sizes", type=int, nargs='+',
+                        default=[16, 64],
+                        help="Batch sizes to time.")
+    parser.add_argument("-sizes", type=int, nargs='+', default=[10, 30, 50],
+                        help="Numbers of nodes n to time.")
+    parser.add_argument("-repeat", type=int, default=10,
+                        help="Calls timed per input.")
+    parser.add_argument("-gpu", type=int, default=-1,
+                        help="Device to run on, -1 for CPU.")
+    opt = parser.parse_args()
+
+    cuda = opt.gpu >= 0
+    if cuda:
+        torch.cuda.set_device(opt.gpu)
+    matrix_tree = MatrixTree()
+
+    print("%6s %6s %10s %10s %8s %10s" % ("batch", "n", "loop ms",
+                                          "batched ms", "speedup",
+                                          "max diff"))
+    for batch_size in opt.batch_sizes:
+        for n in opt.sizes:
+            input = torch.rand(batch_size, n, n)
+            if cuda:
+                input = input.cuda()
+            loop = time_fn(loop_matrix_tree, input, opt.repeat, cuda)
+            batched = time_fn(matrix_tree, input, opt.repeat, cuda)
+            diff = (loop_matrix_tree(input) - matrix_tree(input)) \
+                .abs().max()
+            print("%6d %6d %10.2f %10.2f %8.2f %10.2e"
+                  % (batch_size, n, loop * 1000, batched * 1000,
+                     loop / batched, float(diff)))
+
+
+if __name__ == "__main__":
+    main()
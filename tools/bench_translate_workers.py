@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Scaling report of `translate.py -workers`: translates the same source
+with each number of workers and prints the sentences per second, to
+size CPU translation machines. The model is loaded once.
+
+    python tools/bench_translate_workers.py -model model.pt -src src.txt \
+        -worker_counts 1 2 4 8
+"""
+from __future__ import division, print_function
+import argparse
+import io
+import multiprocessing
+import os
+import time
+
+import torch
+
+import onmt.opts
+from onmt.translate.Translator import make_translator
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='bench_translate_workers.py',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    onmt.opts.translate_opts(parser)
+    parser.add_argument('-worker_counts', type=int, nargs='+',
+                        default=[1, 2, 4],
+                        help="Numbers of workers to time.")
+    opt = parser.parse_args()
+
+    with io.open(opt.src, encoding='utf-8') as f:
+        text = f.read()
+    n_sents = text.count('\n')
+
+    with open(os.devnull, 'w') as out_file:
+        translator = make_translator(opt, report_score=False,
+                                     out_file=out_file)
+        print("%8s %8s %10s %8s" % ("workers", "threads", "sents/s",
+                                    "speedup"))
+        base = None
+        for workers in opt.worker_counts:
+            threads = opt.worker_threads
+            if threads <= 0:
+                threads = max(1, multiprocessing.cpu_count() // workers)
+            if workers == 1:
+                # Translated in this process.
+                torch.set_num_threads(threads)
+            start = time.time()
+            translator.translate_stream(
+                io.StringIO(text), opt.batch_size, opt.stream_window,
+                workers=workers, threads=threads)
+            speed = n_sents / (time.time() - start)
+            base = base or speed
+            print("%8d %8d %10.2f %8.2f" % (workers, threads, speed,
+                                            speed / base))
+
+
+if __name__ == "__main__":
+    main()
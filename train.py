@@ -5,13 +5,16 @@ from __future__ import division
 
 import argparse
 import glob
+import logging
 import os
 import sys
 import random
+import time
 from datetime import datetime
 
 import torch
 import torch.nn as nn
+import torch.multiprocessing
 from torch import cuda
 
 import onmt
@@ -19,6 +22,7 @@ import onmt.io
 import onmt.Models
 import onmt.ModelConstructor
 import onmt.modules
+import onmt.Distributed
 from onmt.Utils import use_gpu, get_logger
 import onmt.opts
 
@@ -45,12 +49,14 @@ if opt.layers != -1:
     opt.dec_layers = opt.layers
 
 opt.brnn = (opt.encoder_type == "brnn")
+# Rank of this process in distributed training.
+opt.dist_rank = 0
 if opt.seed > 0:
     random.seed(opt.seed)
     torch.manual_seed(opt.seed)
 
-if opt.rnn_type == "SRU" and not opt.gpuid:
-    raise AssertionError("Using SRU requires -gpuid set.")
+if opt.rnn_type == "SRU" and opt.gpuid:
+    onmt.modules.check_sru_requirement(abort=True)
 
 if torch.cuda.is_available() and not opt.gpuid:
     logger.info("WARNING: You have a CUDA device, should run with -gpuid 0")
@@ -60,27 +66,36 @@ if opt.gpuid:
     if opt.seed > 0:
         torch.cuda.manual_seed(opt.seed)
 
-if len(opt.gpuid) > 1:
+if len(opt.gpuid) > 1 and opt.world_size == 1:
     sys.stderr.write("Sorry, multigpu isn't supported yet, coming soon!\n")
     sys.exit(1)
 
-# Set up the Crayon logging server.
-if opt.exp_host != "":
-    from pycrayon import CrayonClient
+experiment = None
+writer = None
 
-    cc = CrayonClient(hostname=opt.exp_host)
 
-    experiments = cc.get_experiment_names()
-    logger.info(experiments)
-    if opt.exp in experiments:
-        cc.remove_experiment(opt.exp)
-    experiment = cc.create_experiment(opt.exp)
+def init_experiment_logging():
+    global experiment, writer
+
+    # Set up the Crayon logging server.
+    if opt.exp_host != "":
+        from pycrayon import CrayonClient
+
+        cc = CrayonClient(hostname=opt.exp_host)
+
+        experiments = cc.get_experiment_names()
+        logger.info(experiments)
+        if opt.exp in experiments:
+            cc.remove_experiment(opt.exp)
+        experiment = cc.create_experiment(opt.exp)
+
+    if opt.tensorboard:
+        from tensorboardX import SummaryWriter
+        writer = SummaryWriter(
+            opt.tensorboard_log_dir +
+            datetime.now().strftime("/%b-%d_%H-%M-%S"),
+            comment="Onmt")
 
-if opt.tensorboard:
-    from tensorboardX import SummaryWriter
-    writer = SummaryWriter(
-        opt.tensorboard_log_dir + datetime.now().strftime("/%b-%d_%H-%M-%S"),
-        comment="Onmt")
 
 progress_step = 0
 
@@ -128,14 +143,19 @@ class DatasetLazyIter(object):
         batch_size_fn: custom batch process function.
         device: the GPU device.
         is_train (bool): train or valid?
+        batch_type (str): "sents", "tokens" or "buckets". Binary datasets
+            use it instead of `batch_size_fn`.
+        batch_multiple (int): see `onmt.io.bucket_batches`.
     """
 
     def __init__(self, datasets, fields, batch_size, batch_size_fn,
-                 device, is_train):
+                 device, is_train, batch_type="sents", batch_multiple=1):
         self.datasets = datasets
         self.fields = fields
         self.batch_size = batch_size
         self.batch_size_fn = batch_size_fn
+        self.batch_type = batch_type
+        self.batch_multiple = batch_multiple
         self.device = device
         self.is_train = is_train
 
@@ -169,6 +189,29 @@ class DatasetLazyIter(object):
         # We clear `fields` when saving, restore when loading.
         self.cur_dataset.fields = self.fields
 
+        if isinstance(self.cur_dataset, onmt.io.BinaryTextDataset):
+            cur_iter = onmt.io.BinaryTextIterator(
+                self.cur_dataset, self.batch_size,
+                device=self.device, train=self.is_train,
+                batch_type=self.batch_type,
+                batch_multiple=self.batch_multiple)
+        elif self.batch_type == "buckets":
+            cur_iter = onmt.io.TokenBucketIterator(
+                dataset=self.cur_dataset, batch_size=self.batch_size,
+                batch_multiple=self.batch_multiple,
+                device=self.device, train=self.is_train,
+                sort=False, sort_within_batch=True,
+                repeat=False)
+        else:
+            cur_iter = None
+
+        if cur_iter is not None:
+            if self.batch_type == "buckets":
+                n_batches = len(cur_iter)
+                logger.info(' * %d batches, padding efficiency: %.1f%%' %
+                            (n_batches, 100 * cur_iter.padding_efficiency))
+            return cur_iter
+
         # Sort batch by decreasing lengths of sentence required by pytorch.
         # sort=False means "Use dataset's sortkey instead of iterator's".
         return onmt.io.OrderedIterator(
@@ -207,10 +250,16 @@ def make_dataset_iter(datasets, fields, opt, is_train=True):
             tgt_elements = count * max_tgt_in_batch
             return max(src_elements, tgt_elements)
 
+    batch_type = opt.batch_type if is_train else "sents"
+
     device = opt.gpuid[0] if opt.gpuid else -1
 
-    return DatasetLazyIter(datasets, fields, batch_size, batch_size_fn,
-                           device, is_train)
+    data_iter = DatasetLazyIter(datasets, fields, batch_size, batch_size_fn,
+                                device, is_train, batch_type,
+                                opt.batch_multiple)
+    if opt.prefetch > 0:
+        data_iter = onmt.io.PrefetchIterator(data_iter, opt.prefetch)
+    return data_iter
 
 
 def make_loss_compute(model, tgt_vocab, opt, train=True):
@@ -222,11 +271,13 @@ def make_loss_compute(model, tgt_vocab, opt, train=True):
     if opt.copy_attn:
         compute = onmt.modules.CopyGeneratorLossCompute(
             model.generator, tgt_vocab, opt.copy_attn_force,
-            opt.copy_loss_by_seqlength)
+            opt.copy_loss_by_seqlength,
+            generator_chunk_size=opt.generator_chunk_size)
     else:
         compute = onmt.Loss.NMTLossCompute(
             model.generator, tgt_vocab,
-            label_smoothing=opt.label_smoothing if train else 0.0)
+            label_smoothing=opt.label_smoothing if train else 0.0,
+            generator_chunk_size=opt.generator_chunk_size)
 
     if use_gpu(opt):
         compute.cuda()
@@ -246,7 +297,8 @@ def train_model(model, fields, optim, data_type, model_opt):
 
     trainer = onmt.Trainer(model, train_loss, valid_loss, optim,
                            trunc_size, shard_size, data_type,
-                           norm_method, grad_accum_count)
+                           norm_method, grad_accum_count,
+                           opt.world_size)
 
     logger.info('')
     logger.info('Start training...')
@@ -286,7 +338,8 @@ def train_model(model, fields, optim, data_type, model_opt):
             logger.info("Decaying learning rate to %g" % trainer.optim.lr)
 
         # 5. Drop a checkpoint if needed.
-        if epoch >= opt.start_checkpoint_at:
+        if epoch >= opt.start_checkpoint_at \
+                and onmt.Distributed.is_master(opt):
             trainer.drop_checkpoint(model_opt, epoch, fields, valid_stats)
 
         # 6. Print the score after each epoch if test dataset is given.
@@ -339,8 +392,24 @@ def lazily_load_dataset(corpus_type):
                     (corpus_type, pt_file, len(dataset)))
         return dataset
 
+    def binary_dataset_loader(bin_file, corpus_type):
+        dataset = onmt.io.BinaryTextDataset(bin_file)
+        logger.info('Loading %s binary dataset from %s, '
+                    'number of examples: %d' %
+                    (corpus_type, bin_file, len(dataset)))
+        return dataset
+
+    # Datasets preprocessed with `-data_format bin`.
+    bins = sorted(glob.glob(opt.data + '.' + corpus_type + '.[0-9]*.bin'),
+                  key=lambda f: int(f.split('.')[-2]))
+    if bins:
+        for bin_file in rank_shards(bins, corpus_type):
+            yield binary_dataset_loader(bin_file, corpus_type)
+        return
+
     # Sort the glob output by file name (by increasing indexes).
     pts = sorted(glob.glob(opt.data + '.' + corpus_type + '.[0-9]*.pt'))
+    pts = rank_shards(pts, corpus_type)
     if pts:
         for pt in pts:
             yield lazy_dataset_loader(pt, corpus_type)
@@ -350,6 +419,22 @@ def lazily_load_dataset(corpus_type):
         yield lazy_dataset_loader(pt, corpus_type)
 
 
+def rank_shards(shards, corpus_type):
+    """
+    In distributed training, each process trains on a disjoint slice of
+    the training shards. All of them validate on the whole validation
+    set, so that they decay the learning rate alike.
+    """
+    if opt.world_size == 1 or corpus_type != "train":
+        return shards
+    if len(shards) < opt.world_size:
+        raise AssertionError(
+            "Distributed training needs at least one training shard per "
+            "process, found %d for %d processes; preprocess with "
+            "-max_shard_size or -workers." % (len(shards), opt.world_size))
+    return shards[opt.dist_rank::opt.world_size]
+
+
 def load_fields(dataset, data_type, checkpoint):
     if checkpoint is not None:
         logger.info('Loading vocab from checkpoint at %s.' % opt.train_from)
@@ -358,8 +443,11 @@ def load_fields(dataset, data_type, checkpoint):
     else:
         fields = onmt.io.load_fields_from_vocab(
             torch.load(opt.data + '.vocab.pt'), data_type)
-    fields = dict([(k, f) for (k, f) in fields.items()
-                   if k in dataset.examples[0].__dict__])
+    if isinstance(dataset, onmt.io.BinaryTextDataset):
+        keys = dataset.keys + ['indices']
+    else:
+        keys = dataset.examples[0].__dict__
+    fields = dict([(k, f) for (k, f) in fields.items() if k in keys])
 
     if data_type == 'text':
         logger.info(' * vocabulary size. source = %d; target = %d' %
@@ -478,7 +566,10 @@ def show_optimizer_state(optim):
             element))
 
 
-def main():
+def run_training():
+    if onmt.Distributed.is_master(opt):
+        init_experiment_logging()
+
     # Load checkpoint if we resume from a previous training.
     if opt.train_from:
         logger.info('Loading checkpoint from %s' % opt.train_from)
@@ -505,8 +596,11 @@ def main():
 
     # Build model.
     model = build_model(model_opt, opt, fields, checkpoint)
+    if opt.world_size > 1:
+        onmt.Distributed.broadcast_parameters(model)
     tally_parameters(model)
-    check_save_model_path()
+    if onmt.Distributed.is_master(opt):
+        check_save_model_path()
 
     # Build optimizer.
     optim = build_optim(model, checkpoint)
@@ -515,10 +609,74 @@ def main():
     train_model(model, fields, optim, data_type, model_opt)
 
     # If using tensorboard for logging, close the writer after training.
-    if opt.tensorboard:
+    if writer is not None:
         writer.close()
 
 
+def run_distributed_process(rank, device):
+    """
+    Entry point of a process of distributed training. The module is
+    imported again in the process, so `opt` is parsed again.
+    """
+    opt.dist_rank = rank
+    if device is not None:
+        opt.gpuid = [device]
+        cuda.set_device(device)
+    else:
+        opt.gpuid = []
+    if not onmt.Distributed.is_master(opt):
+        # Only rank 0 reports.
+        logger.setLevel(logging.WARNING)
+        opt.exp_host = ""
+        opt.tensorboard = False
+    onmt.Distributed.init_process_group(opt)
+    run_training()
+
+
+def launch_distributed():
+    """
+    Launch one training process per rank of this node, each one on the
+    matching device of -gpuid, or on CPU. If a process fails, the others
+    are stopped, since they would wait for it forever.
+    """
+    ranks = opt.dist_ranks or list(range(opt.world_size))
+    if opt.gpuid and len(opt.gpuid) != len(ranks):
+        raise AssertionError("-gpuid must give one device per rank of "
+                             "this node, got %d devices for %d ranks."
+                             % (len(opt.gpuid), len(ranks)))
+    devices = opt.gpuid or [None] * len(ranks)
+
+    # CUDA can't be used in forked processes.
+    ctx = torch.multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=run_distributed_process,
+                         args=(rank, device))
+             for rank, device in zip(ranks, devices)]
+    for p in procs:
+        p.start()
+    logger.info('Launched %d training processes, ranks %s.'
+                % (len(procs), ranks))
+
+    while any(p.is_alive() for p in procs):
+        if any(p.exitcode for p in procs):
+            for p in procs:
+                if p.is_alive():
+                    p.terminate()
+            break
+        time.sleep(1)
+    for p in procs:
+        p.join()
+    if any(p.exitcode for p in procs):
+        sys.stderr.write("A training process failed.\n")
+        sys.exit(1)
+
+
+def main():
+    if opt.world_size > 1:
+        launch_distributed()
+    else:
+        run_training()
+
+
 if __name__ == "__main__":
     main()
     path = os.path.dirname(os.path.realpath(__file__))
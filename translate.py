@@ -3,6 +3,8 @@
 
 from __future__ import division, unicode_literals
 import argparse
+import codecs
+import sys
 
 from onmt.translate.Translator import make_translator
 from onmt.Utils import get_logger
@@ -17,8 +19,21 @@ import onmt.opts
 
 def main(opt):
     translator = make_translator(opt, report_score=True, logger=logger)
+    if opt.stream or opt.src == '-' or opt.workers > 1:
+        if opt.src == '-':
+            src_file = codecs.getreader('utf-8')(
+                getattr(sys.stdin, 'buffer', sys.stdin))
+        else:
+            src_file = codecs.open(opt.src, 'r', 'utf-8')
+        translator.translate_stream(src_file, opt.batch_size,
+                                    opt.stream_window, opt.attn_debug,
+                                    opt.workers, opt.worker_threads)
+        return
     translator.translate(opt.src_dir, opt.src, opt.tgt,
                          opt.batch_size, opt.attn_debug)
+    if opt.output == '-':
+        # The predictions were written to stdout.
+        return
     print(translator.output)
     print(opt.output)
     with open(opt.output, "r") as f:
@@ -34,5 +49,9 @@ if __name__ == "__main__":
     onmt.opts.translate_opts(parser)
 
     opt = parser.parse_args()
+    if opt.stream or opt.src == '-' or opt.workers > 1:
+        assert opt.tgt is None, \
+            "-tgt is not supported when streaming (-stream, -src - or " \
+            "-workers)."
     logger = get_logger(opt.log_file)
     main(opt)